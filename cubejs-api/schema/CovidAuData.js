@@ -1,9 +1,27 @@
 cube(`CovidAuData`, {
-  sql: `SELECT * FROM public.covid_au_data t1 JOIN (SELECT dimensions_id, MAX(saved_date) FROM public.covid_au_data GROUP BY dimensions_id) t2 ON t1.dimensions_id = t2.dimensions_id`,
+  // Latest saved rows per dimensions_id, maintained by the ingestion
+  sql: `SELECT * FROM public.covid_au_data_latest`,
+
+  // Rebuild pre-aggregations only after a new load
+  refreshKey: {
+    sql: `SELECT MAX(saved_date) FROM public.covid_au_data_latest`,
+  },
 
   preAggregations: {
-    // Pre-Aggregations definitions go here
-    // Learn more here: https://cube.dev/docs/caching/pre-aggregations/getting-started
+    // Daily counts by state, for the cases, hospitalisation and positivity charts
+    dailyByState: {
+      measures: [CUBE.cases, CUBE.deaths, CUBE.tests, CUBE.hosp, CUBE.icu, CUBE.vent, CUBE.current_hosp, CUBE.current_icu, CUBE.current_vent],
+      dimensions: [CUBE.stateCode, CUBE.stateName],
+      timeDimension: CUBE.date,
+      granularity: `day`,
+    },
+    // Running totals by state, for the total cases, deaths and tests
+    runningTotalsByState: {
+      measures: [CUBE.total_cases, CUBE.total_deaths, CUBE.total_tests],
+      dimensions: [CUBE.stateCode, CUBE.stateName],
+      timeDimension: CUBE.date,
+      granularity: `day`,
+    },
   },
 
   joins: {
@@ -1,9 +1,20 @@
 cube(`CovidAuDeathData`, {
-  sql: `SELECT * FROM public.covid_au_death_data t1 JOIN (SELECT dimensions_id, MAX(saved_date) FROM public.covid_au_death_data GROUP BY dimensions_id) t2 ON t1.dimensions_id = t2.dimensions_id`,
+  // Latest saved rows per dimensions_id, maintained by the ingestion
+  sql: `SELECT * FROM public.covid_au_death_data_latest`,
+
+  // Rebuild pre-aggregations only after a new load
+  refreshKey: {
+    sql: `SELECT MAX(saved_date) FROM public.covid_au_death_data_latest`,
+  },
 
   preAggregations: {
-    // Pre-Aggregations definitions go here
-    // Learn more here: https://cube.dev/docs/caching/pre-aggregations/getting-started
+    // Daily deaths by state, age group and sex
+    dailyByState: {
+      measures: [CUBE.deaths],
+      dimensions: [CUBE.stateCode, CUBE.stateName, CUBE.ageGroup, CUBE.sex],
+      timeDimension: CUBE.date,
+      granularity: `day`,
+    },
   },
 
   measures: {
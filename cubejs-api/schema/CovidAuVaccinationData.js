@@ -1,9 +1,27 @@
 cube(`CovidAuVaccinationData`, {
-  sql: `SELECT * FROM public.covid_au_vaccination_data t1 JOIN (SELECT dimensions_id, MAX(saved_date) FROM public.covid_au_vaccination_data GROUP BY dimensions_id) t2 ON t1.dimensions_id = t2.dimensions_id`,
+  // Latest saved rows per dimensions_id, maintained by the ingestion
+  sql: `SELECT * FROM public.covid_au_vaccination_data_latest`,
+
+  // Rebuild pre-aggregations only after a new load
+  refreshKey: {
+    sql: `SELECT MAX(saved_date) FROM public.covid_au_vaccination_data_latest`,
+  },
 
   preAggregations: {
-    // Pre-Aggregations definitions go here
-    // Learn more here: https://cube.dev/docs/caching/pre-aggregations/getting-started
+    // Daily vaccination rates by state
+    dailyByState: {
+      measures: [CUBE.population, CUBE.firstVaxDosePercent, CUBE.secondVaxDosePercent],
+      dimensions: [CUBE.stateCode, CUBE.stateName],
+      timeDimension: CUBE.date,
+      granularity: `day`,
+    },
+    // Running totals of doses by state
+    runningTotalsByState: {
+      measures: [CUBE.firstVaxDose, CUBE.secondVaxDose],
+      dimensions: [CUBE.stateCode, CUBE.stateName],
+      timeDimension: CUBE.date,
+      granularity: `day`,
+    },
   },
 
   joins: {
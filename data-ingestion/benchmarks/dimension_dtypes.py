@@ -0,0 +1,181 @@
+'''Report the memory and time of each source with dimension columns held
+as categoricals, against a baseline commit.
+
+Each source runs in a fresh process against the fixture store (default
+100x the seed history), retrieving, processing, validating and saving to
+a csv file. The memory of the raw and processed dataframes and the peak
+resident set size of the process are reported with the stage times.
+With --baseline, the same is measured on a git worktree of a baseline
+commit (e.g. the commit before categorical dimensions), and the processed
+data of both is checked to be equal.
+Run from the data-ingestion folder:
+    python -m benchmarks.dimension_dtypes --scale 100 --baseline HEAD~1
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import import_module
+from unittest import mock
+import pandas as pd
+
+STAGES = ['retrieve', 'process', 'validate', 'save']
+
+
+def measure(name, scale, path, output):
+    '''Run a source on the code of the working directory, in this process.
+    Returns dict of stage seconds, dataframe bytes and peak RSS.
+    '''
+    from benchmarks import fixtures
+    from benchmarks.pipeline import SOURCES
+    from ingestion.metrics import peak_rss
+
+    store = fixtures.build(scale, path)
+    module, source = SOURCES[name]
+    module = import_module(f'sources.{module}')
+    tmp = os.path.dirname(output)
+    env = {
+        'INGESTION_STATE': os.path.join(tmp, 'state.json'),
+        'HTTP_CACHE': os.path.join(tmp, 'http'),
+    }
+    seconds = {}
+    with mock.patch.dict(os.environ, env), \
+            mock.patch.multiple(
+                'sources.vaccinations',
+                MANIFEST_PATH=os.path.join(tmp, 'manifests'),
+                PARSED_CACHE=os.path.join(tmp, 'xlsx'),
+            ):
+        engine = module.Ingest({
+            'source': source,
+            'sink': {'type': 'csv', 'name': os.path.join(tmp, name)},
+            'cache': False,
+        })
+        fixtures.mount(engine.http.session, store)
+        df = None
+        for stage in STAGES:
+            start = time.perf_counter()
+            if stage == 'retrieve':
+                df = raw = engine.retrieve()
+            elif stage == 'save':
+                engine.save(df)
+            else:
+                df = getattr(engine, stage)(df)
+            seconds[stage] = time.perf_counter() - start
+    df.to_pickle(output)
+    return {
+        'rows': len(df),
+        'seconds': seconds,
+        'raw_bytes': int(raw.memory_usage(deep=True).sum()),
+        'processed_bytes': int(df.memory_usage(deep=True).sum()),
+        'peak_rss_bytes': peak_rss(),
+    }
+
+
+def run(name, args, tree, output):
+    '''Measure a source in a fresh process on the code of a tree'''
+    result = subprocess.run(
+        [
+            sys.executable, os.path.abspath(__file__),
+            '--measure', name,
+            '--scale', str(args.scale),
+            '--fixtures', os.path.abspath(args.fixtures),
+            '--output', output,
+        ],
+        cwd=tree,
+        env={**os.environ, 'PYTHONPATH': tree},
+        capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f'{name} failed in {tree}:\n{result.stderr}')
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def _objects(df):
+    '''Dataframe with categoricals as objects, for comparison'''
+    df = df.drop(columns='saved_date', errors='ignore')
+    return df.astype({
+        col: object for col in df.columns
+        if isinstance(df[col].dtype, pd.CategoricalDtype)
+    })
+
+
+def worktree(rev, path):
+    '''Check out a commit into a git worktree.
+    Returns the data-ingestion folder of the worktree.
+    '''
+    prefix = subprocess.run(
+        ['git', 'rev-parse', '--show-prefix'],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip()
+    subprocess.run(
+        ['git', 'worktree', 'add', '--detach', path, rev],
+        capture_output=True, check=True,
+    )
+    return os.path.join(path, prefix)
+
+
+def report(name, label, record):
+    mb = 1024 ** 2
+    print(
+        f'{name:<24}{label:<10}{record["rows"]:>9}'
+        + ''.join(f'{record["seconds"][stage]:>9.2f}s' for stage in STAGES)
+        + f'{record["raw_bytes"] / mb:>9.1f}'
+        + f'{record["processed_bytes"] / mb:>11.1f}'
+        + f'{record["peak_rss_bytes"] / mb:>9.0f}'
+    )
+
+
+def main(args):
+    from benchmarks import fixtures
+    from benchmarks.pipeline import SOURCES
+
+    args.fixtures = args.fixtures or fixtures.FIXTURES_PATH
+    fixtures.build(args.scale, args.fixtures)
+    names = args.sources or list(SOURCES)
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = os.path.join(tmp, 'baseline')
+        trees = [('current', os.getcwd())]
+        if args.baseline:
+            trees.insert(0, (args.baseline, worktree(args.baseline, baseline)))
+        print(
+            f'{"source":<24}{"code":<10}{"rows":>9}'
+            + ''.join(f'{stage:>10}' for stage in STAGES)
+            + f'{"raw MB":>9}{"processed":>11}{"peak MB":>9}'
+        )
+        try:
+            for name in names:
+                outputs = []
+                for label, tree in trees:
+                    folder = tempfile.mkdtemp(dir=tmp)
+                    outputs.append(os.path.join(folder, f'{name}.pkl'))
+                    report(name, label, run(name, args, tree, outputs[-1]))
+                if len(outputs) > 1:
+                    pd.testing.assert_frame_equal(
+                        _objects(pd.read_pickle(outputs[1])),
+                        _objects(pd.read_pickle(outputs[0])),
+                        check_dtype=False,
+                    )
+        finally:
+            if args.baseline:
+                subprocess.run(
+                    ['git', 'worktree', 'remove', '--force', baseline],
+                    capture_output=True,
+                )
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, default=100, help='Scale of the seed history.')
+    parser.add_argument('--sources', type=str, nargs='+', help='Sources to run, all by default.')
+    parser.add_argument('--baseline', type=str, help='Git commit to compare with.')
+    parser.add_argument('--fixtures', type=str, help='Fixture store folder.')
+    parser.add_argument('--measure', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--output', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.scale, args.fixtures, args.output)))
+    else:
+        main(args)
@@ -0,0 +1,69 @@
+'''Benchmark dimensions_id hashing against the row-wise apply path.
+
+Run from the data-ingestion folder:
+    python -m benchmarks.dimensions_id --scale 10
+'''
+import argparse
+import glob
+import os
+import time
+import pandas as pd
+
+from ingestion import hash_dimensions
+
+DATA_PATH = 'data'
+
+DIMENSIONS = [
+    'date',
+    'lhd_code',
+    'lhd_name',
+    'lga_code',
+    'lga_name',
+    'state_name',
+    'state_code',
+    'country',
+    'age_group',
+    'sex',
+]
+
+
+def apply_hash(df, dimensions):
+    '''Previous row-wise implementation'''
+    return df.apply(
+        lambda x: hash(tuple(x[d] for d in dimensions)),
+        axis=1
+    )
+
+
+def timed(func, *args, repeat=3):
+    '''Best wall time over a number of runs'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(args):
+    print(f'{"file":<36}{"rows":>10}{"apply rows/s":>16}{"vector rows/s":>16}{"speedup":>10}')
+    for path in sorted(glob.glob(os.path.join(DATA_PATH, '*.csv'))):
+        df = pd.read_csv(path, index_col=0)
+        df = pd.concat([df] * args.scale, ignore_index=True)
+        dimensions = [d for d in DIMENSIONS if d in df.columns]
+        apply_time = timed(apply_hash, df, dimensions, repeat=args.repeat)
+        vector_time = timed(hash_dimensions, df, dimensions, repeat=args.repeat)
+        print(
+            f'{os.path.basename(path):<36}{len(df):>10}'
+            f'{len(df)/apply_time:>16,.0f}{len(df)/vector_time:>16,.0f}'
+            f'{apply_time/vector_time:>9.1f}x'
+        )
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, default=1, help='Times to repeat each dataset.')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions.')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,370 @@
+'''Fixture store of upstream responses, seeded from the csv snapshots.
+
+The store holds the raw responses of every source at a synthetic scale:
+the GitHub csv files, the health.gov.au collection and item pages and
+Excel files, and the records of the NSW Government datastore resources.
+Scaling repeats the seed history, shifted to later dates, so the keys of
+each copy are unique.
+
+ReplayAdapter serves the store to a requests session in place of the
+network. Static responses are served with an ETag, or a Last-Modified
+date where the store entry has one, and conditional requests are
+answered with 304. NSW datastore SQL queries are run against the stored
+records like the CKAN datastore.
+Build a store from the data-ingestion folder:
+    python -m benchmarks.fixtures --scale 10
+'''
+import argparse
+import ast
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qs, urlparse
+import pandas as pd
+import requests
+from openpyxl import Workbook
+
+from sources import nsw_government, vaccinations
+from sources.utils import STATE_CODES
+
+DATA_PATH = 'data'
+FIXTURES_PATH = os.environ.get('BENCH_FIXTURES', '.cache/fixtures')
+
+GITHUB_URL = 'https://raw.githubusercontent.com/M3IT/COVID-19_Data/master/Data/'
+HOSTS = [
+    'https://raw.githubusercontent.com/',
+    'https://www.health.gov.au/',
+    'https://data.nsw.gov.au/',
+]
+
+# Maximum records per datastore SQL result, as in CKAN
+ROWS_MAX = 32000
+
+VACCINATION_DATA = 'covid-19-vaccination-vaccination-data'
+VACCINATION_LGA = 'covid-19-vaccination-geographic-vaccination-rates-lga'
+
+
+def store_path(scale, path=None):
+    '''Folder of the fixture store at a scale'''
+    return os.path.join(path or FIXTURES_PATH, f'x{scale}')
+
+
+def seed(filename, **kwargs):
+    '''Read a csv snapshot'''
+    df = pd.read_csv(os.path.join(DATA_PATH, filename), index_col=0, **kwargs)
+    df['date'] = pd.to_datetime(df['date'])
+    return df.drop(columns='saved_date')
+
+
+def repeat(df, scale):
+    '''Repeat the history of a dataframe, each copy shifted after the last'''
+    span = df['date'].max() - df['date'].min() + timedelta(days=1)
+    return pd.concat([
+        df.assign(date=df['date'] + i * span) for i in range(scale)
+    ], ignore_index=True)
+
+
+def _age_group(value, sep='-', open_end='+'):
+    '''Format a saved age group tuple, e.g. (70, 79) as 70-79'''
+    if pd.isnull(value):
+        return None
+    bounds = ast.literal_eval(value)
+    if len(bounds) == 1:
+        return f'{bounds[0]}{open_end}'
+    return sep.join(str(bound) for bound in bounds)
+
+
+def _xlsx(rows):
+    '''Write rows into an Excel file.
+    Returns bytes.
+    '''
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for row in rows:
+        ws.append(row)
+    f = io.BytesIO()
+    wb.save(f)
+    return f.getvalue()
+
+
+def _report_name(date):
+    return f'{date.day}-{date.strftime("%B").lower()}-{date.year}'
+
+
+class Store():
+    '''Writer of the static responses of a fixture store'''
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        os.makedirs(os.path.join(path, 'responses'), exist_ok=True)
+
+    def add(self, url, content, content_type):
+        if isinstance(content, str):
+            content = content.encode()
+        filename = hashlib.sha256(url.encode()).hexdigest()
+        with open(os.path.join(self.path, 'responses', filename), 'wb') as f:
+            f.write(content)
+        self.index[url] = {
+            'path': filename,
+            'content_type': content_type,
+            'etag': f'"{hashlib.sha256(content).hexdigest()}"',
+        }
+
+    def close(self):
+        with open(os.path.join(self.path, 'index.json'), 'w') as f:
+            json.dump(self.index, f)
+
+
+def build_github(store, scale):
+    '''Raw COVID AU state and deaths csv files'''
+    df = repeat(seed('covid_au_data.csv'), scale)
+    df = df.rename(columns={'state_name': 'state', 'state_code': 'state_abbrev'})
+    for measure in ['hosp', 'icu', 'vent']:
+        df[f'{measure}_cum'] = df.groupby('state')[measure].cumsum()
+    store.add(
+        GITHUB_URL + 'COVID_AU_state.csv',
+        df.drop(columns='country').to_csv(index=False, date_format='%Y-%m-%d'),
+        'text/csv',
+    )
+    df = repeat(seed('covid_au_death_data.csv'), scale)
+    df = pd.DataFrame({
+        'date': df['date'],
+        'state': df['state_code'],
+        'gender': df['sex'],
+        'age': None,
+        'age_bracket': df['age_group'].map(
+            lambda x: _age_group(x, open_end='-')
+        ),
+    })
+    store.add(
+        GITHUB_URL + 'COVID_AU_deaths.csv',
+        df.to_csv(index=False, date_format='%Y-%m-%d'),
+        'text/csv',
+    )
+
+
+def build_health(store, collection, reports):
+    '''Collection page, item pages and Excel files of a vaccination
+    collection, from (date, rows) per report.
+    '''
+    base_url = vaccinations.BASE_URL
+    items = []
+    for date, rows in reports:
+        name = _report_name(date)
+        item = f'resources/publications/{collection}-{name}'
+        link = f'{base_url}sites/default/files/documents/{collection}-{name}.xlsx'
+        store.add(
+            base_url + item,
+            f'<html><a class="health-file__link" data-filetype="application/'
+            f'vnd.openxmlformats-officedocument.spreadsheetml.sheet" '
+            f'href="{link}">{name}</a></html>',
+            'text/html',
+        )
+        store.add(link, _xlsx(rows), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        items.append(f'<a href="{item}">{name}</a>')
+    store.add(
+        f'{base_url}resources/collections/{collection}',
+        '<html><div class="paragraphs-items">' + ''.join(reversed(items)) + '</div></html>',
+        'text/html',
+    )
+
+
+def vaccination_reports(scale):
+    '''Measure name and value rows per report date'''
+    df = repeat(seed('covid_au_vaccination_data.csv'), scale)
+    df['age_group'] = df['age_group'].map(_age_group)
+    df['sex'] = df['sex'].map({'Male': 'M', 'Female': 'F'})
+    for date, report in df.groupby('date'):
+        states = report[report['age_group'].isnull()].set_index('state_code')
+        demographics = report[report['age_group'].notnull()]\
+            .set_index(['age_group', 'sex'])
+        rows = [('Measure Name', 'Value')]
+        for state in STATE_CODES.values():
+            for measure, field in vaccinations.STATE_MEASURES.items():
+                value = states[field].get(state, 0)
+                rows.append((
+                    vaccinations.STATE_COLUMN.format(state=state, measure=measure),
+                    float(value),
+                ))
+        for age_group in vaccinations.AGE_GROUPS:
+            for sex in ['M', 'F']:
+                for measure, field in vaccinations.AGE_MEASURES.items():
+                    value = demographics[field].get((age_group, sex), 0)
+                    rows.append((
+                        vaccinations.AGE_COLUMN.format(
+                            age_group=age_group, sex=sex, measure=measure
+                        ),
+                        float(value),
+                    ))
+        yield date, rows
+
+
+def lga_reports(scale):
+    '''LGA rows per report date, below the 8 preamble rows'''
+    df = repeat(seed('covid_vaccination_by_lga.csv'), scale)
+    df = df.rename(columns={
+        'vax_1_%_15+': 'vax_1_percent',
+        'vax_2_%_15+': 'vax_2_percent',
+        'population_15+': 'population',
+    })
+    percent = lambda x: '>95%' if x >= 95 else f'{x}%'
+    for date, report in df.groupby('date'):
+        rows = [(None,) * 6] * 8
+        rows.append(('LGA', 'State', 'Remoteness', 'Dose 1 %', 'Dose 2 %', 'Population'))
+        for record in report.itertuples(index=False):
+            rows.append((
+                record.lga_name,
+                record.state_name,
+                'Major Cities',
+                percent(record.vax_1_percent),
+                percent(record.vax_2_percent),
+                f'{record.population:,.0f}' if pd.notnull(record.population) else 'N/A',
+            ))
+        yield date, rows
+
+
+def build_nsw(path, scale):
+    '''Records of the NSW Government datastore resources.
+
+    The cases seed is stored as one record per date and location, not
+    expanded by count, tests and age ranges are derived from it.
+    '''
+    df = repeat(seed('covid_nsw_cases_by_location.csv', dtype={'lga_code': str}), scale)
+    dates = df['date'].dt.strftime('%Y-%m-%d')
+    location = {
+        'lhd_2010_code': df['lhd_code'],
+        'lhd_2010_name': df['lhd_name'],
+        'lga_code19': df['lga_code'],
+        'lga_name19': df['lga_name'],
+    }
+    age_groups = ['AgeGroup_0-19', 'AgeGroup_20-24', 'AgeGroup_25-29',
+        'AgeGroup_30-34', 'AgeGroup_35-39', 'AgeGroup_40-44', 'AgeGroup_45-49',
+        'AgeGroup_50-54', 'AgeGroup_55-59', 'AgeGroup_60-64', 'AgeGroup_65-69',
+        'AgeGroup_70+']
+    resources = {
+        'cases_by_location': pd.DataFrame({'notification_date': dates, **location}),
+        'tests_by_location': pd.DataFrame({
+            'test_date': dates,
+            'postcode': '2000',
+            **location,
+            'test_count': df['cases'] * 20,
+        }),
+        'cases_by_age_range': pd.DataFrame({
+            'notification_date': dates,
+            'age_group': [age_groups[i % len(age_groups)] for i in range(len(df))],
+        }),
+    }
+    db = sqlite3.connect(os.path.join(path, 'datastore.sqlite'))
+    for resource_type, records in resources.items():
+        records.insert(0, '_id', range(1, len(records) + 1))
+        records.to_sql(
+            nsw_government.RESOURCES[resource_type],
+            db,
+            index=False,
+            if_exists='replace',
+        )
+    db.commit()
+    db.close()
+
+
+def build(scale, path=None):
+    '''Build the fixture store at a scale, unless already built.
+    Returns the folder of the store.
+    '''
+    path = store_path(scale, path)
+    if os.path.exists(os.path.join(path, 'index.json')):
+        return path
+    shutil.rmtree(path, ignore_errors=True)
+    store = Store(path)
+    build_github(store, scale)
+    build_health(store, VACCINATION_DATA, vaccination_reports(scale))
+    build_health(store, VACCINATION_LGA, lga_reports(scale))
+    build_nsw(path, scale)
+    # Written last, marks the store as complete
+    store.close()
+    return path
+
+
+class ReplayAdapter(requests.adapters.BaseAdapter):
+    '''Transport adapter serving responses from a fixture store.
+
+    Args:
+        path (str): Folder of the fixture store.
+    '''
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        with open(os.path.join(path, 'index.json')) as f:
+            self.index = json.load(f)
+
+    def _response(self, request, status, content=b'', headers=None):
+        response = requests.Response()
+        response.status_code = status
+        response._content = content
+        response.headers.update(headers or {})
+        response.url = request.url
+        response.request = request
+        response.reason = 'OK' if status < 400 else 'Not Found'
+        return response
+
+    def _datastore_sql(self, request):
+        sql = parse_qs(urlparse(request.url).query)['sql'][0]
+        db = sqlite3.connect(os.path.join(self.path, 'datastore.sqlite'))
+        try:
+            cursor = db.execute(sql)
+            columns = [d[0] for d in cursor.description]
+            records = [dict(zip(columns, r)) for r in cursor.fetchmany(ROWS_MAX + 1)]
+        finally:
+            db.close()
+        return json.dumps({'success': True, 'result': {
+            'records': records[:ROWS_MAX],
+            'records_truncated': len(records) > ROWS_MAX,
+        }}).encode()
+
+    def send(self, request, **kwargs):
+        if request.url.startswith(nsw_government.SQL_URL):
+            return self._response(request, 200, self._datastore_sql(request), {
+                'Content-Type': 'application/json',
+            })
+        entry = self.index.get(request.url)
+        if entry is None:
+            return self._response(request, 404)
+        etag, last_modified = entry.get('etag'), entry.get('last_modified')
+        if etag and request.headers.get('If-None-Match') == etag:
+            return self._response(request, 304)
+        since = request.headers.get('If-Modified-Since')
+        if last_modified and since and \
+                parsedate_to_datetime(last_modified) <= parsedate_to_datetime(since):
+            return self._response(request, 304)
+        with open(os.path.join(self.path, 'responses', entry['path']), 'rb') as f:
+            content = f.read()
+        headers = {'Content-Type': entry['content_type']}
+        if etag:
+            headers['ETag'] = etag
+        if last_modified:
+            headers['Last-Modified'] = last_modified
+        return self._response(request, 200, content, headers)
+
+    def close(self):
+        pass
+
+
+def mount(session, path):
+    '''Serve the hosts of all sources from a fixture store'''
+    adapter = ReplayAdapter(path)
+    for host in HOSTS:
+        session.mount(host, adapter)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, nargs='+', default=[1], help='Scales to build.')
+    parser.add_argument('--path', type=str, help='Fixture store folder.')
+    args = parser.parse_args()
+    for scale in args.scale:
+        print(build(scale, args.path))
@@ -0,0 +1,87 @@
+'''Benchmark the Parquet sink against the CSV sink.
+
+Compares write time, size on disk and read-back time on the csv
+snapshots in the data folder.
+Run from the data-ingestion folder:
+    python -m benchmarks.parquet_sink --scale 10
+'''
+import argparse
+import ast
+import glob
+import os
+import shutil
+import tempfile
+import time
+import pandas as pd
+
+from ingestion.parquet import save_parquet
+
+DATA_PATH = 'data'
+
+
+def load(path, scale):
+    '''Load a snapshot as a processed dataframe'''
+    df = pd.read_csv(path, index_col=0)
+    df['date'] = pd.to_datetime(df['date'])
+    if 'age_group' in df.columns:
+        df['age_group'] = df['age_group'].map(
+            lambda x: ast.literal_eval(x) if isinstance(x, str) else None
+        )
+    return pd.concat([df] * scale, ignore_index=True)
+
+
+def size(path):
+    '''Size on disk of a file or directory in bytes'''
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path) for f in files
+    )
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main(args):
+    tmp = tempfile.mkdtemp()
+    print(
+        f'{"file":<36}{"rows":>9}{"sink":>9}{"write s":>9}'
+        f'{"size KB":>10}{"read s":>9}'
+    )
+    try:
+        for path in sorted(glob.glob(os.path.join(DATA_PATH, 'covid_*.csv'))):
+            df = load(path, args.scale)
+            name = os.path.basename(path)
+            csv_path = os.path.join(tmp, name)
+            parquet_path = os.path.join(tmp, name[:-4])
+            results = {
+                'csv': (
+                    timed(df.to_csv, csv_path, chunksize=100),
+                    size(csv_path),
+                    timed(pd.read_csv, csv_path, index_col=0),
+                ),
+                'parquet': (
+                    timed(save_parquet, df, parquet_path, partition_by=args.partition_by),
+                    size(parquet_path),
+                    timed(pd.read_parquet, parquet_path),
+                ),
+            }
+            for sink, (write_time, nbytes, read_time) in results.items():
+                print(
+                    f'{name:<36}{len(df):>9}{sink:>9}{write_time:>9.3f}'
+                    f'{nbytes/1024:>10,.0f}{read_time:>9.3f}'
+                )
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, default=1, help='Times to repeat each dataset.')
+    parser.add_argument('--partition-by', type=str, default='month', help='Parquet partition granularity.')
+    args = parser.parse_args()
+    main(args)
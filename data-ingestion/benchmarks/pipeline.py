@@ -0,0 +1,134 @@
+'''Benchmark each source's pipeline stages on the recorded fixtures.
+
+Each source runs against the fixture store of a given scale, with cold
+caches and state, and its retrieve, process, validate and save stages
+are timed. With --warm, each source is run once beforehand to warm the
+HTTP and result caches, and only the state is cold. The results are
+appended as JSON lines, one line per source and scale, so runs can be
+compared over time.
+Run from the data-ingestion folder:
+    python -m benchmarks.pipeline --scale 1 10 100
+'''
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from importlib import import_module
+from unittest import mock
+import pandas as pd
+
+import main as pipeline
+from benchmarks import fixtures
+from ingestion import http
+from ingestion.metrics import source_record, write_json_lines
+
+RESULTS_PATH = os.environ.get('BENCH_RESULTS', '.cache/benchmarks.jsonl')
+
+# Source configs to run, by name
+SOURCES = {
+    'covid_au_state': ('covid19data', {'filename': 'COVID_AU_state.csv'}),
+    'covid_au_deaths': ('covid19data', {'filename': 'COVID_AU_deaths.csv'}),
+    'nsw_tests_by_location': ('nsw_government', {'resource_type': 'tests_by_location'}),
+    'nsw_cases_by_location': ('nsw_government', {'resource_type': 'cases_by_location'}),
+    'nsw_cases_by_age_range': ('nsw_government', {'resource_type': 'cases_by_age_range'}),
+    'vaccination_data': ('vaccinations', {
+        'collection': fixtures.VACCINATION_DATA,
+    }),
+    'vaccination_lga': ('vaccinations', {
+        'collection': fixtures.VACCINATION_LGA,
+        'lga_lhd_bundled': True,
+    }),
+}
+
+
+def commit():
+    '''Current git commit, if any'''
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(name, store, sink, streaming, tmp):
+    '''Run a source against a fixture store, with cold caches and state.
+    Returns the metrics record of the source.
+    '''
+    module, source = SOURCES[name]
+    module = import_module(f'sources.{module}')
+    # Tables of the database set in POSTGRESQL, files otherwise
+    sink_name = f'benchmark_{name}' if sink == 'postgres' else os.path.join(tmp, name)
+    cfg = {
+        'source': source,
+        'sink': {'type': sink, 'name': sink_name, 'mode': 'replace'},
+        'streaming': streaming,
+    }
+    env = {
+        'INGESTION_STATE': os.path.join(tmp, 'state.json'),
+        'HTTP_CACHE': os.path.join(tmp, 'http'),
+        'RESULT_CACHE': os.path.join(tmp, 'results'),
+    }
+    stages, engine = {}, None
+    with mock.patch.dict(os.environ, env), \
+            mock.patch.multiple(
+                'sources.vaccinations',
+                MANIFEST_PATH=os.path.join(tmp, 'manifests'),
+                PARSED_CACHE=os.path.join(tmp, 'xlsx'),
+            ):
+        engine = module.Ingest(cfg)
+        fixtures.mount(engine.http.session, store)
+        pipeline.run_source(engine, cfg['sink']['name'], stages)
+    http.flush()
+    return source_record(name, module.__name__.split('.')[-1], stages, http=engine.http)
+
+
+def main(args):
+    names = args.sources or list(SOURCES)
+    header = f'{"source":<24} {"scale":>5}' + ''.join(
+        f' {stage:>9}' for stage in ['retrieve', 'process', 'validate', 'save']
+    ) + f' {"rows":>9}'
+    print(header)
+    for scale in args.scale:
+        store = fixtures.build(scale, args.fixtures)
+        records = []
+        for name in names:
+            with tempfile.TemporaryDirectory() as tmp:
+                if args.warm:
+                    run(name, store, args.sink, args.stream, tmp)
+                    os.remove(os.path.join(tmp, 'state.json'))
+                record = run(name, store, args.sink, args.stream, tmp)
+            record.update({
+                'benchmark': 'pipeline',
+                'scale': scale,
+                'sink': args.sink,
+                'streaming': args.stream,
+                'warm': args.warm,
+                'commit': commit(),
+                'python': sys.version.split()[0],
+                'pandas': pd.__version__,
+            })
+            records.append(record)
+            stages = record['stages']
+            print(f'{name:<24} {scale:>5}' + ''.join(
+                f" {stages[stage]['wall_seconds']:>8.2f}s" if stage in stages else f' {"-":>9}'
+                for stage in ['retrieve', 'process', 'validate', 'save']
+            ) + f" {stages.get('save', {}).get('rows_out', 0):>9}")
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        write_json_lines(args.output, records)
+    print(f'Results appended to {args.output}')
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 100], help='Scales of the seed history.')
+    parser.add_argument('--sources', type=str, nargs='+', choices=list(SOURCES), help='Sources to run, all by default.')
+    parser.add_argument('--sink', type=str, default='csv', choices=['csv', 'parquet', 'postgres'], help='Sink type, postgres needs the POSTGRESQL environment variable.')
+    parser.add_argument('--stream', action='store_true', help='Run the sources in streaming mode.')
+    parser.add_argument('--warm', action='store_true', help='Warm the HTTP and result caches before timing.')
+    parser.add_argument('--fixtures', type=str, help='Fixture store folder.')
+    parser.add_argument('--output', type=str, default=RESULTS_PATH, help='JSON lines file to append results to.')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,95 @@
+'''Benchmark the COPY Postgres sink against batched to_sql inserts.
+
+Needs a local database set in the POSTGRESQL environment variable.
+Run from the data-ingestion folder:
+    POSTGRESQL=postgresql://localhost/herd python -m benchmarks.postgres_sink
+'''
+import argparse
+import glob
+import os
+import time
+from datetime import datetime, date, time as dtime, timedelta
+import pandas as pd
+import pandas.api.types as ptypes
+import sqlalchemy
+from sqlalchemy import ARRAY, create_engine
+
+from ingestion.postgres import save_postgres
+
+DATA_PATH = 'data'
+TABLE = 'benchmark_sink'
+
+
+_type_py2sql_dict = {
+ int: sqlalchemy.sql.sqltypes.BigInteger,
+ str: sqlalchemy.sql.sqltypes.Unicode,
+ float: sqlalchemy.sql.sqltypes.Float,
+ datetime: sqlalchemy.sql.sqltypes.DateTime,
+ bytes: sqlalchemy.sql.sqltypes.LargeBinary,
+ bool: sqlalchemy.sql.sqltypes.Boolean,
+ date: sqlalchemy.sql.sqltypes.Date,
+ dtime: sqlalchemy.sql.sqltypes.Time,
+ timedelta: sqlalchemy.sql.sqltypes.Interval,
+ list: sqlalchemy.sql.sqltypes.ARRAY,
+ tuple: sqlalchemy.sql.sqltypes.ARRAY,
+ dict: sqlalchemy.sql.sqltypes.JSON
+}
+
+
+def sql_dtypes(df):
+    '''Previous SQL type inference for to_sql, tuples as ARRAY'''
+    dtypes = {}
+    for col in df.columns:
+        if ptypes.is_object_dtype(df[col].dtype):
+            _df = df[col].dropna()
+            if _df.empty:
+                continue
+            x = _df.iloc[0]
+            if isinstance(x, tuple):
+                t = _type_py2sql_dict.get(type(x[0]))
+                if t is not None:
+                    dtypes[col] = ARRAY(t)
+    return dtypes
+
+
+def to_sql_save(df, engine):
+    '''Previous batched INSERT implementation'''
+    df.to_sql(
+        TABLE,
+        engine,
+        if_exists='replace',
+        chunksize=100,
+        index=False,
+        dtype=sql_dtypes(df)
+    )
+
+
+def copy_save(df, engine):
+    save_postgres(df, TABLE, engine, mode='replace')
+
+
+def main(args):
+    engine = create_engine(os.environ['POSTGRESQL'])
+    print(f'{"file":<36}{"rows":>10}{"to_sql rows/s":>16}{"copy rows/s":>16}{"speedup":>10}')
+    for path in sorted(glob.glob(os.path.join(DATA_PATH, '*.csv'))):
+        df = pd.read_csv(path, index_col=0)
+        df = pd.concat([df] * args.scale, ignore_index=True)
+        times = []
+        for func in (to_sql_save, copy_save):
+            start = time.perf_counter()
+            func(df, engine)
+            times.append(time.perf_counter() - start)
+        print(
+            f'{os.path.basename(path):<36}{len(df):>10}'
+            f'{len(df)/times[0]:>16,.0f}{len(df)/times[1]:>16,.0f}'
+            f'{times[0]/times[1]:>9.1f}x'
+        )
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=int, default=1, help='Times to repeat each dataset.')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,94 @@
+'''Benchmark peak memory of batch and streaming ingestion.
+
+Runs the COVID AU deaths file through retrieve, process, validate and a
+csv sink, in batch and streaming mode, as the history grows. Checks that
+both modes save the same rows.
+Run from the data-ingestion folder:
+    python -m benchmarks.streaming --rows 100000 400000 1600000
+'''
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from ingestion import CachedResponse
+from sources import covid19data
+
+FILENAME = 'COVID_AU_deaths.csv'
+
+
+def fixture(n_rows, seed=0):
+    '''Raw deaths csv with one row per death'''
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-03-01', periods=max(n_rows // 20, 1))
+    df = pd.DataFrame({
+        'date': rng.choice(dates.strftime('%Y-%m-%d'), n_rows),
+        'state': rng.choice(['NSW', 'VIC', 'QLD', 'SA', 'WA'], n_rows),
+        'gender': rng.choice(['Male', 'Female*', None], n_rows),
+        'age': rng.choice([np.nan, 64, 71, 85], n_rows),
+        'age_bracket': rng.choice(['60-69', '70-79', '80-', None], n_rows),
+    })
+    return df.to_csv(index=False).encode()
+
+
+def run(content, path, streaming, chunk_rows):
+    '''Ingest the fixture into a csv sink.
+    Returns seconds taken and peak traced memory in bytes.
+    '''
+    engine = covid19data.Ingest({
+        'source': {'filename': FILENAME, 'chunk_rows': chunk_rows},
+        'sink': {'type': 'csv', 'name': path, 'mode': 'replace'},
+        'streaming': streaming,
+    })
+    sha256 = hashlib.sha256(content).hexdigest()
+    engine.http.get = lambda url: CachedResponse(url, content, sha256)
+    engine.is_unchanged = lambda *responses: False
+    engine._save_state = lambda: None
+    tracemalloc.start()
+    start = time.perf_counter()
+    if streaming:
+        chunks = engine.process_chunks(engine.retrieve_chunks())
+        engine.save_chunks(map(engine.validate, chunks))
+    else:
+        engine.save(engine.validate(engine.process(engine.retrieve())))
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def saved(path):
+    '''Saved rows, without metadata, in a comparable order'''
+    df = pd.read_csv(path, index_col=0).drop(columns='saved_date')
+    return df.drop_duplicates().sort_values(list(df.columns))\
+        .reset_index(drop=True)
+
+
+def main(args):
+    print(f'{"rows":>10} {"mode":>9} {"seconds":>8} {"peak MB":>8}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows in args.rows:
+            content = fixture(n_rows)
+            paths = {}
+            for streaming in (False, True):
+                mode = 'streaming' if streaming else 'batch'
+                paths[mode] = os.path.join(tmp, f'{mode}.csv')
+                seconds, peak = run(content, paths[mode], streaming, args.chunk_rows)
+                print(f'{n_rows:>10} {mode:>9} {seconds:>8.2f} {peak / 1024 ** 2:>8.1f}')
+            # Duplicates are only dropped within a chunk when streaming
+            pd.testing.assert_frame_equal(
+                saved(paths['batch']),
+                saved(paths['streaming']),
+            )
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 400000, 1600000], help='Rows of history.')
+    parser.add_argument('--chunk-rows', type=int, default=50000, help='Rows per streamed chunk.')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,109 @@
+'''Benchmark the vaccination wide-to-long reshape against the record loop.
+
+Times both as the number of report dates grows. The output is checked
+to be identical to a copy of the previous implementation in
+tests/test_vaccinations.py.
+Run from the data-ingestion folder:
+    python -m benchmarks.vaccination_reshape --dates 10 100 1000
+'''
+import argparse
+import time
+from copy import deepcopy
+import numpy as np
+import pandas as pd
+
+from sources import vaccinations
+from sources.utils import STATE_CODES, STATE_NAMES
+
+COLLECTION = 'covid-19-vaccination-vaccination-data'
+
+
+def fixture(n_dates, seed=0):
+    '''Wide vaccination data with one row per report date'''
+    rng = np.random.default_rng(seed)
+    columns = []
+    for state in STATE_CODES.values():
+        columns += [
+            vaccinations.STATE_COLUMN.format(state=state, measure=measure)
+            for measure in vaccinations.STATE_MEASURES
+        ]
+    for age_group in vaccinations.AGE_GROUPS:
+        for sex in ['M', 'F']:
+            columns += [
+                vaccinations.AGE_COLUMN.format(
+                    age_group=age_group, sex=sex, measure=measure
+                )
+                for measure in vaccinations.AGE_MEASURES
+            ]
+    df = pd.DataFrame(
+        rng.integers(1000, 1000000, size=(n_dates, len(columns))).astype(float),
+        columns=columns,
+    )
+    df['date'] = pd.date_range('2021-01-01', periods=n_dates)
+    return df
+
+
+def legacy_reshape(df):
+    '''Previous record-by-record implementation'''
+    state_docs = []
+    demo_docs = []
+    for doc in df.to_dict('records'):
+        for state in STATE_CODES.values():
+            _doc = {}
+            _doc['date'] = doc['date']
+            _doc['state_name'] = STATE_NAMES[state]
+            _doc['state_code'] = state
+            _doc['country'] = 'Australia'
+            population = doc[f'{state} - Population 16 and over']
+            vax_1_dose = doc[f'{state} - Residence state - Number of people 16 and over with 1 dose']
+            vax_2_dose = doc[f'{state} - Residence state - Number of people 16 and over fully vaccinated']
+            _doc['vax_1_dose'] = vax_1_dose
+            _doc['vax_2_dose'] = vax_2_dose
+            _doc['vax_1_percent'] = vax_1_dose/population
+            _doc['vax_2_percent'] = vax_2_dose/population
+            _doc['population'] = population
+            state_docs.append(_doc)
+        for age_group in vaccinations.AGE_GROUPS:
+            _doc = {}
+            _doc['date'] = doc['date']
+            _doc['country'] = 'Australia'
+            _doc['age_group'] = tuple(
+                int(k) for k in age_group.replace('+', '').strip().split('-')
+            )
+            for sex in ['M', 'F']:
+                __doc = deepcopy(_doc)
+                population = doc[f'Age group - {age_group} - {sex} - Population']
+                vax_1_dose = doc[f'Age group - {age_group} - {sex} - Number of people with 1 dose']
+                vax_2_dose = doc[f'Age group - {age_group} - {sex} - Number of people fully vaccinated']
+                __doc['sex'] = 'Female' if sex == 'F' else 'Male'
+                __doc['vax_1_dose'] = vax_1_dose
+                __doc['vax_2_dose'] = vax_2_dose
+                __doc['vax_1_percent'] = vax_1_dose/population
+                __doc['vax_2_percent'] = vax_2_dose/population
+                __doc['population'] = population
+                demo_docs.append(__doc)
+    return pd.DataFrame(state_docs), pd.DataFrame(demo_docs)
+
+
+def main(args):
+    print(f'{"dates":>8}{"rows":>10}{"loop s":>10}{"vector s":>10}{"speedup":>10}')
+    for n_dates in args.dates:
+        df = fixture(n_dates)
+        start = time.perf_counter()
+        state_df, demo_df = legacy_reshape(df)
+        legacy_time = time.perf_counter() - start
+        start = time.perf_counter()
+        vaccinations.reshape_vaccination_data(df)
+        vector_time = time.perf_counter() - start
+        print(
+            f'{n_dates:>8}{len(state_df) + len(demo_df):>10}'
+            f'{legacy_time:>10.3f}{vector_time:>10.3f}'
+            f'{legacy_time/vector_time:>9.1f}x'
+        )
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dates', type=int, nargs='+', default=[10, 100, 1000], help='Numbers of report dates.')
+    args = parser.parse_args()
+    main(args)
@@ -7,4 +7,20 @@ from .configuration import (
     SourceSchema,
     SinkSchema,
     BASE_PROCESSED_SCHEMA,
+    dimension_column,
 )
+from .cleaning import (
+    clean_label,
+    map_unique,
+    parse_digits,
+    parse_number,
+    parse_percent,
+    parse_range,
+)
+from .excel import read_xlsx
+from .hashing import hash_dimensions
+from .http import HTTPCache, CachedResponse
+from .results import ResultCache
+from .state import StateStore
+from .transform import apply_transforms, key_dimensions
+from .transport import Transport, get_transport
@@ -0,0 +1,163 @@
+'''Backfill of source history in date partitions across a process pool'''
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from importlib import import_module
+import pandas as pd
+
+from .state import StateStore
+
+# Pandas frequency of each partition granularity
+PARTITION_FREQS = {
+    'day': 'D',
+    'week': 'W-MON',
+    'month': 'MS',
+    'year': 'YS',
+}
+
+# Lock serializing the saves of the worker processes
+_save_lock = None
+
+
+def parse_range(value):
+    '''Parse a START:END range of ISO dates, END included. A missing END
+    is today.
+    Returns (start, end) datetimes, end excluded.
+    '''
+    start, sep, end = value.partition(':')
+    if not sep or not start:
+        raise ValueError(f'Invalid backfill range: {value}, expected START:END')
+    start = datetime.fromisoformat(start)
+    end = datetime.fromisoformat(end) if end else datetime.utcnow()
+    end = datetime(end.year, end.month, end.day) + timedelta(days=1)
+    if end <= start:
+        raise ValueError(f'Invalid backfill range: {value}, END is before START')
+    return start, end
+
+
+def partitions(start, end, partition_by='month'):
+    '''Split a date range into partitions aligned to the granularity.
+
+    Args:
+        start (datetime): Start of the range.
+        end (datetime): End of the range, excluded.
+    kwargs:
+        partition_by (str): One of day, week, month or year.
+    Returns list of (start, end) datetimes, end excluded.
+    '''
+    bounds = pd.date_range(start, end, freq=PARTITION_FREQS[partition_by])
+    bounds = sorted({start, *(b.to_pydatetime() for b in bounds), end})
+    return [
+        (a, b) for a, b in zip(bounds, bounds[1:])
+        if start <= a and b <= end
+    ]
+
+
+def _init_worker(lock, level):
+    global _save_lock
+    _save_lock = lock
+    logging.basicConfig(level=level)
+
+
+def run_partition(module, cfg, start, end):
+    '''Retrieve, process, validate and save the data of a source within a
+    date partition, in a worker process. The data is appended to the sink.
+
+    Args:
+        module (str): Name of the source module.
+        cfg (dict): Ingest config of the source.
+        start (datetime): Start of the partition.
+        end (datetime): End of the partition, excluded.
+    Returns number of rows saved.
+    '''
+    cfg = {**cfg, 'sink': {**cfg['sink'], 'mode': 'append'}}
+    engine = import_module(f'.{module}', package='sources').Ingest(cfg)
+    engine.date_range = (start, end)
+    raw = engine.retrieve()
+    if raw.empty:
+        return 0
+    # Process, unless the raw data of the partition was processed before
+    df = engine.cached_result()
+    if df is None:
+        df = engine.validate(engine.process(raw))
+        engine.cache_result(df)
+    if df.empty:
+        return 0
+    with _save_lock:
+        return engine.save(df)
+
+
+def checkpoint_key(engine):
+    '''Key of the backfill checkpoint of a source in the state store'''
+    return f'backfill:{engine.state_key}'
+
+
+def backfill(entries, modules, date_range, partition_by='month', workers=4):
+    '''Backfill the history of config entries within a date range.
+
+    The range of each source is split into date partitions, processed
+    independently across a process pool. Completed partitions are
+    checkpointed per source in the state store, so a backfill of the same
+    range and partitions resumes where it stopped.
+
+    Args:
+        entries (list): Config entries, with module and cfg.
+        modules (dict): Imported source modules by name.
+        date_range (tuple): Start and end datetimes, end excluded.
+    kwargs:
+        partition_by (str): One of day, week, month or year.
+        workers (int): Number of worker processes.
+    Returns list of (name, start, error) of failed partitions.
+    '''
+    store = StateStore()
+    parts = partitions(*date_range, partition_by=partition_by)
+    spec = {
+        'range': [d.isoformat() for d in date_range],
+        'partition_by': partition_by,
+    }
+    pending, checkpoints = [], {}
+    for i in entries:
+        name = i['cfg']['sink']['name']
+        engine = modules[i['module']].Ingest(i['cfg'])
+        key = checkpoint_key(engine)
+        checkpoint = store.get(key) or {}
+        if {k: checkpoint.get(k) for k in spec} != spec:
+            checkpoint = {**spec, 'done': []}
+        checkpoints[name] = (key, checkpoint)
+        todo = [p for p in parts if p[0].isoformat() not in checkpoint['done']]
+        logging.info(f'Backfilling {name}: {len(todo)} of {len(parts)} partitions to do')
+        if todo:
+            # Fetch data shared by the partitions once, before the workers
+            engine.date_range = date_range
+            engine.prepare_backfill()
+            pending += [(i, name, start, end) for start, end in todo]
+    failed = []
+    # Spawned rather than forked, so no connections are shared with workers
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(context.Lock(), logging.getLogger().level),
+    ) as executor:
+        futures = {
+            executor.submit(run_partition, i['module'], i['cfg'], start, end):
+                (name, start, end)
+            for i, name, start, end in pending
+        }
+        for future in as_completed(futures):
+            name, start, end = futures[future]
+            label = f'{name} [{start:%Y-%m-%d}, {end:%Y-%m-%d})'
+            try:
+                rows = future.result()
+            except Exception as e:
+                logging.error(f'Backfill of {label} failed: {e!r}')
+                failed.append((name, start, e))
+                continue
+            logging.info(f'Backfilled {label}: {rows} rows')
+            key, checkpoint = checkpoints[name]
+            checkpoint['done'].append(start.isoformat())
+            store.set(key, checkpoint)
+    return failed
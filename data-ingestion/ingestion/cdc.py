@@ -0,0 +1,85 @@
+'''Change data capture against the last saved snapshot of a sink'''
+
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+from .hashing import hash_rows
+
+DEFAULT_SNAPSHOT_PATH = '.cache/snapshots'
+
+# Columns not part of the row content
+METADATA_COLUMNS = ['saved_date']
+
+
+class Snapshot():
+    '''Row hashes per dimensions_id of the data saved to a sink.
+
+    Rows are diffed against the snapshot by their content hash, over the
+    dimensions_id and all measure columns:
+        unchanged: an identical row was saved before;
+        updated: the dimensions_id was saved before, with other content;
+        inserted: the dimensions_id was never saved.
+
+    The snapshot is kept as numpy arrays in an .npz file per sink.
+
+    Args:
+        key (str): Key of the sink, e.g. the state key of the source.
+    kwargs:
+        path (str): Snapshot directory. Defaults to the INGESTION_SNAPSHOTS
+            environment variable, or .cache/snapshots.
+    '''
+    def __init__(self, key, path=None):
+        path = path or os.environ.get('INGESTION_SNAPSHOTS', DEFAULT_SNAPSHOT_PATH)
+        self.path = os.path.join(
+            path, hashlib.sha256(key.encode()).hexdigest() + '.npz'
+        )
+        self.ids = np.array([], dtype='int64')
+        self.hashes = np.array([], dtype='uint64')
+        if os.path.exists(self.path):
+            with np.load(self.path) as f:
+                self.ids, self.hashes = f['ids'], f['hashes']
+        # Rows seen during this run
+        self._run_ids, self._run_hashes = [], []
+        self.changes = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    def diff(self, df):
+        '''Diff rows against the snapshot, counting the changes.
+
+        Args:
+            df (pd.DataFrame): Processed dataframe with a dimensions_id.
+        Returns dataframe of inserted and updated rows.
+        '''
+        ids = df['dimensions_id'].to_numpy(dtype='int64')
+        hashes = hash_rows(df, exclude=METADATA_COLUMNS).to_numpy()
+        self._run_ids.append(ids)
+        self._run_hashes.append(hashes)
+        unchanged = pd.Index(hashes).isin(self.hashes)
+        updated = ~unchanged & pd.Index(ids).isin(self.ids)
+        self.changes['unchanged'] += int(unchanged.sum())
+        self.changes['updated'] += int(updated.sum())
+        self.changes['inserted'] += int((~unchanged & ~updated).sum())
+        if not unchanged.any():
+            return df
+        return df[~unchanged].copy()
+
+    def save(self):
+        '''Save the snapshot, where the rows seen during this run replace
+        the saved rows of their dimensions_id.
+        '''
+        if not self._run_ids:
+            return
+        run = pd.DataFrame({
+            'ids': np.concatenate(self._run_ids),
+            'hashes': np.concatenate(self._run_hashes),
+        }).drop_duplicates()
+        run_ids, run_hashes = run['ids'].to_numpy(), run['hashes'].to_numpy()
+        keep = ~pd.Index(self.ids).isin(run_ids)
+        self.ids = np.concatenate([self.ids[keep], run_ids])
+        self.hashes = np.concatenate([self.hashes[keep], run_hashes])
+        self._run_ids, self._run_hashes = [], []
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.tmp.npz'
+        np.savez(tmp_path, ids=self.ids, hashes=self.hashes)
+        os.replace(tmp_path, self.path)
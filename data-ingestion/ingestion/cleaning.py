@@ -0,0 +1,104 @@
+'''Vectorized cleaning of raw columns'''
+
+import re
+import numpy as np
+import pandas as pd
+
+
+def map_unique(series, func):
+    '''Map a function over the distinct values of a series only, for
+    parsing low cardinality columns (age brackets, labels) into objects
+    such as tuples that have no vectorized form.
+
+    Args:
+        series (pd.Series): Values to map, missing values map to None.
+        func (callable): Function of a single non-missing value.
+    Returns series of objects.
+    '''
+    codes, uniques = pd.factorize(series)
+    # Missing values have code -1, the trailing None
+    values = np.empty(len(uniques) + 1, dtype=object)
+    values[:-1] = [func(x) for x in uniques]
+    values[-1] = None
+    return pd.Series(values[codes], index=series.index, name=series.name)
+
+
+def apply_unique(series, func):
+    '''Apply a vectorized function of a series to the distinct values of
+    a series only. Missing values map to NaN.
+
+    Args:
+        series (pd.Series): Values to clean.
+        func (callable): Function of a series of non-missing values,
+            returning a series of the same length.
+    Returns series.
+    '''
+    codes, uniques = pd.factorize(series)
+    # Missing values have code -1, the trailing NaN
+    values = np.append(func(pd.Series(uniques, dtype=object)).to_numpy(), np.nan)
+    return pd.Series(values[codes], index=series.index, name=series.name)
+
+
+def _parse_range(x):
+    return tuple(int(d or 0) for d in x.strip().split('-'))
+
+
+def parse_range(series):
+    '''Parse ranges such as 70-79 into tuples of ints, an open bound
+    (80-) as 0.
+    Returns series of tuples, None where missing.
+    '''
+    return map_unique(series, _parse_range)
+
+
+def parse_digits(series):
+    '''Parse the groups of digits of each value, such as the bounds of
+    AgeGroup_20-24, into tuples of strings.
+    Returns series of tuples, None where missing.
+    '''
+    return map_unique(series, lambda x: tuple(re.findall(r'\d+', x)))
+
+
+def _parse_percent(series):
+    return series.astype(str).str.replace(r'[>%]', '', regex=True).astype(float)
+
+
+def parse_percent(series):
+    '''Parse percentages such as >95% or 95.2 into floats'''
+    return apply_unique(series, _parse_percent).astype(float)
+
+
+def _parse_number(series):
+    return pd.to_numeric(
+        series.astype(str).str.replace(r'[^0-9^.]', '', regex=True)
+        .replace('', np.nan)
+    )
+
+
+def parse_number(series):
+    '''Parse numbers formatted with separators or qualifiers, such as
+    1,234 or >100, into floats, NaN where no number is left.
+    '''
+    return pd.to_numeric(apply_unique(series, _parse_number))
+
+
+def clean_label(series, remove='', missing=None):
+    '''Remove characters (e.g. footnote markers) from labels and fill
+    missing labels.
+
+    Args:
+        series (pd.Series): Labels to clean.
+    kwargs:
+        remove (str): Characters to remove.
+        missing (str): Label of missing values.
+    Returns series.
+    '''
+    if remove:
+        table = str.maketrans('', '', remove)
+        series = map_unique(series, lambda x: x.translate(table))
+    if missing is not None:
+        if isinstance(series.dtype, pd.CategoricalDtype) \
+                and missing not in series.cat.categories:
+            series = series.cat.add_categories([missing])
+        series = series.fillna(missing)
+    return series
@@ -1,8 +1,9 @@
 '''Configuration Schema Validation'''
 
-from marshmallow import Schema, post_load, validate
+from marshmallow import Schema, post_load, validate, validates_schema
 from marshmallow.exceptions import ValidationError
 from marshmallow.fields import (
+    Boolean,
     Integer,
     Nested,
     String
@@ -11,6 +12,8 @@ from marshmallow_oneofschema import OneOfSchema
 import os
 import pandera as pa
 
+from .validation import VALIDATION_MODES
+
 class SourceSchema(Schema):
     '''Custom schema per source'''
     class Meta:
@@ -21,10 +24,16 @@ class SinkBase(Schema):
     name = String(required=True)
     chunksize = Integer(default=100, missing=100)
     mode = String(
-        validate=validate.OneOf(['replace', 'append']),
+        validate=validate.OneOf(['replace', 'append', 'incremental']),
         default='replace',
         missing='replace'
     )
+    cdc = Boolean(default=False, missing=False)
+
+    @validates_schema
+    def validate_cdc(self, data, **kwargs):
+        if data.get('cdc') and data.get('mode') == 'replace':
+            raise ValidationError('cdc needs the append or incremental mode.')
 
 
 class CSVSinkSchema(SinkBase):
@@ -32,9 +41,22 @@ class CSVSinkSchema(SinkBase):
     type = String(required=True)
 
 
+class ParquetSinkSchema(SinkBase):
+    '''Schema for Parquet sink'''
+    type = String(required=True)
+    partition_by = String(
+        validate=validate.OneOf(['year', 'month', 'day']),
+        default='month',
+        missing='month'
+    )
+    compression = String(default='zstd', missing='zstd')
+
+
 class PostgresSinkSchema(SinkBase):
     '''Schema for Postgres sink'''
     type = String(required=True)
+    upsert = Boolean(default=False, missing=False)
+    latest = Boolean(default=True, missing=True)
 
     @post_load
     def ensure_env(self, data, **kwargs):
@@ -49,6 +71,7 @@ class SinkSchema(OneOfSchema):
     type_field_remove = False
     type_schemas = {
         'csv': CSVSinkSchema,
+        'parquet': ParquetSinkSchema,
         'postgres': PostgresSinkSchema,
     }
 
@@ -57,6 +80,13 @@ class IngestSchema(Schema):
     '''Schema for Ingest class config'''
     source = Nested(SourceSchema, required=True)
     sink = Nested(SinkSchema)
+    validation = String(
+        validate=validate.Regexp(VALIDATION_MODES),
+        default='full',
+        missing='full'
+    )
+    streaming = Boolean(default=False, missing=False)
+    cache = Boolean(default=True, missing=True)
 
 
 BASE_PROCESSED_SCHEMA = pa.DataFrameSchema({
@@ -65,4 +95,10 @@ BASE_PROCESSED_SCHEMA = pa.DataFrameSchema({
 },
 # Filter out columns not specified
 strict='filter',
-)
\ No newline at end of file
+)
+
+def dimension_column(nullable=False):
+    '''Schema column of a string dimension, held as a categorical. Object
+    columns are coerced, so dimensions are saved as categoricals.
+    '''
+    return pa.Column('category', nullable=nullable, coerce=True)
@@ -0,0 +1,50 @@
+'''Streaming Excel reader'''
+
+import io
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+# Cell values read as missing, as in pd.read_excel
+NA_VALUES = {'', '#N/A', 'N/A', 'NA', 'NaN', 'n/a', 'nan', 'null', 'NULL'}
+
+
+def read_xlsx(content, header=0, max_col=None, sheet=0):
+    '''Read a sheet of an XLSX file with a read-only streaming reader.
+
+    Rows are streamed one at a time instead of loading the whole workbook,
+    and cells right of max_col are not parsed.
+
+    Args:
+        content (bytes): XLSX file contents.
+    kwargs:
+        header (int): Row number (0-indexed) of the column names, rows
+            above it are skipped.
+        max_col (int): Number of columns to read, all if None.
+        sheet (int): Index of the sheet to read.
+    Returns dataframe.
+    '''
+    wb = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[sheet].iter_rows(
+            max_col=max_col,
+            values_only=True,
+        )
+        for _ in range(header):
+            next(rows, None)
+        columns = [
+            c if c is not None else f'Unnamed: {i}'
+            for i, c in enumerate(next(rows, ()))
+        ]
+        data = [
+            [row[i] if i < len(row) else None for i in range(len(columns))]
+            for row in rows
+        ]
+    finally:
+        wb.close()
+    # Trim trailing empty rows
+    while data and all(v is None for v in data[-1]):
+        data.pop()
+    df = pd.DataFrame(data, columns=columns)
+    df = df.replace(list(NA_VALUES), np.nan)
+    return df.infer_objects()
@@ -0,0 +1,83 @@
+'''Deterministic hashing of dimension columns and rows'''
+
+import pandas as pd
+import pandas.api.types as ptypes
+
+# Fixed key so ids are identical across processes and runs
+HASH_KEY = 'herd-dimensions0'
+
+
+def _canonical(df):
+    '''Cast columns to a canonical dtype per kind, since hashes depend on
+    the dtype: numbers (int64 80 and float64 80.0) as float64, strings
+    and categoricals as objects, and datetimes (of any unit, e.g. us when
+    read from Parquet) as naive datetime64[ns], tz-aware ones in UTC.
+    '''
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        dtype = values.dtype
+        if ptypes.is_bool_dtype(dtype):
+            continue
+        if ptypes.is_numeric_dtype(dtype):
+            if dtype != 'float64':
+                columns[col] = values.astype('float64')
+        elif ptypes.is_datetime64_any_dtype(dtype):
+            if isinstance(dtype, pd.DatetimeTZDtype):
+                values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+            if values.dtype != 'datetime64[ns]':
+                values = values.astype('datetime64[ns]')
+            if values is not df[col]:
+                columns[col] = values
+        elif ptypes.is_string_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
+            if dtype != object:
+                columns[col] = values.astype(object)
+    return df.assign(**columns) if columns else df
+
+
+def hash_dimensions(df, dimensions):
+    '''Computes a stable 64-bit id per row over the given dimension columns.
+
+    Hashing is done column-wise over whole columns rather than per row, and
+    unlike the builtin hash() it is not salted per process, so the same
+    dimensions always produce the same id. Columns are hashed in a
+    canonical dtype, so ids do not depend on whether e.g. a chunk held an
+    integer column as int64 or, with missing values, as float64.
+
+    Args:
+        df (pd.DataFrame): Dataframe containing the dimension columns.
+        dimensions (list): Ordered list of dimension column names.
+    Returns series of signed 64-bit ids aligned to the dataframe index.
+    '''
+    hashed = pd.util.hash_pandas_object(
+        _canonical(df[list(dimensions)]),
+        index=False,
+        hash_key=HASH_KEY,
+        categorize=True,
+    )
+    return pd.Series(
+        hashed.to_numpy().view('int64'),
+        index=df.index,
+        name='dimensions_id',
+    )
+
+
+def hash_rows(df, exclude=()):
+    '''Computes a stable 64-bit content hash per row over all columns.
+
+    Columns are hashed in name order and in a canonical dtype, so the hash
+    does not depend on the column order or dtypes of the dataframe.
+
+    Args:
+        df (pd.DataFrame): Dataframe to hash.
+    kwargs:
+        exclude (iterable): Column names to leave out, e.g. metadata.
+    Returns series of unsigned 64-bit hashes aligned to the dataframe index.
+    '''
+    columns = sorted(col for col in df.columns if col not in set(exclude))
+    return pd.util.hash_pandas_object(
+        _canonical(df[columns]),
+        index=False,
+        hash_key=HASH_KEY,
+        categorize=True,
+    )
@@ -0,0 +1,243 @@
+'''Persistent HTTP response cache with conditional requests'''
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .transport import get_transport
+
+DEFAULT_CACHE_PATH = '.cache/http'
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+# Minimum seconds between writes of a cache index
+INDEX_WRITE_INTERVAL = 1.0
+
+_lock = threading.Lock()
+
+# Indexes by cache path, shared by the HTTPCache instances of a path
+_indexes = {}
+
+
+class _Index():
+    '''In-memory index of a cache directory, written to index.json at most
+    every INDEX_WRITE_INTERVAL seconds and on exit.
+
+    Other processes may share the cache directory, so the entries changed
+    or removed since the last write are merged into the index on disk
+    rather than overwriting it.
+    '''
+    def __init__(self, path):
+        self.path = os.path.join(path, 'index.json')
+        self.entries = self._read()
+        self.size = sum(entry['size'] for entry in self.entries.values())
+        self.written = time.time()
+        self.changed = set()
+        self.removed = set()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def set(self, url, entry):
+        old = self.entries.get(url)
+        if old:
+            self.size -= old['size']
+        self.entries[url] = entry
+        self.size += entry['size']
+        self.changed.add(url)
+        self.removed.discard(url)
+
+    def remove(self, url):
+        self.size -= self.entries.pop(url)['size']
+        self.changed.discard(url)
+        self.removed.add(url)
+
+    def _merge(self):
+        '''Merge the changes since the last write into the index on disk,
+        keeping the most recently accessed entry of a URL
+        '''
+        entries = self._read()
+        for url in self.removed:
+            entries.pop(url, None)
+        for url in self.changed:
+            entry = self.entries[url]
+            if entries.get(url, {}).get('accessed', 0) <= entry['accessed']:
+                entries[url] = entry
+        self.entries = entries
+        self.size = sum(entry['size'] for entry in entries.values())
+
+    def write(self, force=False):
+        # Nothing to write, or the cache directory was removed
+        if not (self.changed or self.removed) \
+                or not os.path.isdir(os.path.dirname(self.path)):
+            return
+        if not force and time.time() - self.written < INDEX_WRITE_INTERVAL:
+            return
+        self._merge()
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+        self.written = time.time()
+        self.changed.clear()
+        self.removed.clear()
+
+
+@atexit.register
+def flush():
+    '''Write the indexes of all caches'''
+    with _lock:
+        for index in _indexes.values():
+            index.write(force=True)
+
+
+class CachedResponse():
+    '''Response body served from the network or the cache.
+
+    Args:
+        url (str): Requested URL.
+        content (bytes): Response body.
+        sha256 (str): Hash of the response body.
+        from_cache (bool): Whether the body was served from the cache.
+    '''
+    def __init__(self, url, content, sha256, from_cache=False):
+        self.url = url
+        self.content = content
+        self.sha256 = sha256
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HTTPCache():
+    '''On-disk cache of HTTP GET responses keyed by URL.
+
+    Cached responses are revalidated with ETag/Last-Modified conditional
+    requests, so unchanged resources are not downloaded again. The cache
+    is bounded in size, evicting the least recently used responses.
+    Requests are made through the shared transport, pooling connections
+    and retrying transient failures. Counts of requests, retries, cache
+    hits and bytes downloaded are kept in stats, and the content hashes of
+    the responses by URL in fetched.
+
+    kwargs:
+        path (str): Cache directory. Defaults to the HTTP_CACHE environment
+            variable, or .cache/http.
+        max_bytes (int): Maximum size of cached bodies. Defaults to the
+            HTTP_CACHE_MAX_BYTES environment variable, or 512MB.
+        transport (Transport): Transport to make requests with, the
+            transport shared by the process by default.
+    '''
+    def __init__(self, path=None, max_bytes=None, transport=None):
+        self.path = path or os.environ.get('HTTP_CACHE', DEFAULT_CACHE_PATH)
+        self.max_bytes = max_bytes or int(
+            os.environ.get('HTTP_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        )
+        self.transport = transport or get_transport()
+        self.stats = {'requests': 0, 'retries': 0, 'cache_hits': 0, 'bytes': 0}
+        self.fetched = {}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def session(self):
+        '''Session of the transport, to mount adapters on'''
+        return self.transport.session
+
+    def _index(self):
+        '''Index of this cache directory, call with the lock held'''
+        if self.path not in _indexes:
+            _indexes[self.path] = _Index(self.path)
+        return _indexes[self.path]
+
+    def _body_path(self, url):
+        return os.path.join(
+            self.path, hashlib.sha256(url.encode()).hexdigest()
+        )
+
+    def _evict(self, index):
+        '''Remove least recently used bodies until within max_bytes'''
+        if index.size <= self.max_bytes:
+            return
+        entries = sorted(index.entries.items(), key=lambda x: x[1]['accessed'])
+        for url, entry in entries:
+            if index.size <= self.max_bytes:
+                break
+            logging.debug(f'Evicting from HTTP cache: {url}')
+            body_path = self._body_path(url)
+            if os.path.exists(body_path):
+                os.remove(body_path)
+            index.remove(url)
+
+    def get(self, url, track=True, **kwargs):
+        '''GET a URL, revalidating any cached response.
+
+        Args:
+            url (str): URL to request.
+        kwargs:
+            track (bool): Record the content hash in fetched, for responses
+                making up the raw data.
+            Others are passed on to requests.
+        Returns CachedResponse.
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        body_path = self._body_path(url)
+        with _lock:
+            entry = self._index().entries.get(url)
+        if entry and not os.path.exists(body_path):
+            entry = None
+        # Conditional request
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        response = self.transport.get(url, headers=headers, **kwargs)
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats['retries'] += response.retries
+            if entry and response.status_code == 304:
+                self.stats['cache_hits'] += 1
+            else:
+                self.stats['bytes'] += len(response.content)
+        if entry and response.status_code == 304:
+            logging.debug(f'Not modified: {url}')
+            with open(body_path, 'rb') as f:
+                content = f.read()
+            from_cache = True
+        else:
+            response.raise_for_status()
+            content = response.content
+            entry = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'sha256': hashlib.sha256(content).hexdigest(),
+                'size': len(content),
+            }
+            # Written whole, as other processes may read the same body
+            tmp_path = f'{body_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, body_path)
+            from_cache = False
+        if track:
+            with self._stats_lock:
+                self.fetched[url] = entry['sha256']
+        with _lock:
+            entry['accessed'] = time.time()
+            index = self._index()
+            index.set(url, entry)
+            self._evict(index)
+            index.write()
+        return CachedResponse(url, content, entry['sha256'], from_cache=from_cache)
@@ -1,35 +1,126 @@
 '''Base class for data source ingestion'''
 
-from datetime import datetime, date, time, timedelta
+from datetime import datetime
+import hashlib
+import json
 import os
-import sqlalchemy
-from sqlalchemy import create_engine, ARRAY
-import pandera as pa
+import threading
+import pandas as pd
+from sqlalchemy import create_engine
 import logging
-import pandas.api.types as ptypes
 
+from . import validation
+from .cdc import Snapshot
 from .configuration import IngestSchema
+from .http import HTTPCache
+from .parquet import save_parquet
+from .postgres import save_postgres
+from .results import ResultCache, result_key, table_hash
+from .state import StateStore
 
-_type_py2sql_dict = {
- int: sqlalchemy.sql.sqltypes.BigInteger,
- str: sqlalchemy.sql.sqltypes.Unicode,
- float: sqlalchemy.sql.sqltypes.Float,
- datetime: sqlalchemy.sql.sqltypes.DateTime,
- bytes: sqlalchemy.sql.sqltypes.LargeBinary,
- bool: sqlalchemy.sql.sqltypes.Boolean,
- date: sqlalchemy.sql.sqltypes.Date,
- time: sqlalchemy.sql.sqltypes.Time,
- timedelta: sqlalchemy.sql.sqltypes.Interval,
- list: sqlalchemy.sql.sqltypes.ARRAY,
- tuple: sqlalchemy.sql.sqltypes.ARRAY,
- dict: sqlalchemy.sql.sqltypes.JSON
-}
+# Database engines by URI, their connection pools kept between runs
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(uri):
+    '''Get the engine of a database URI, created on first use'''
+    with _engines_lock:
+        if uri not in _engines:
+            _engines[uri] = create_engine(uri)
+        return _engines[uri]
 
 
 class BaseIngest():
     '''Base data ingestion class'''
     def __init__(self, cfg):
         self.cfg = IngestSchema().load(cfg)
+        self.http = HTTPCache()
+        self.results = ResultCache()
+        # State staged during a run, persisted once the data is saved
+        self._state = {}
+        self.validation_timings = {}
+        # Schema and dimensions of the validated data, to type sink tables
+        self.schema = None
+        self.dimensions = []
+        # Snapshot of the sink to diff against, loaded on the first save
+        self._snapshot = None
+        self.changes = None
+        # Saved date of the rows of this run, shared by all chunks
+        self._saved_date = None
+        # Dates (start, end excluded) to retrieve, for backfill partitions
+        self.date_range = None
+
+    @property
+    def incremental(self):
+        '''Whether the sink is configured for incremental ingestion'''
+        sink_cfg = self.cfg.get('sink') or {}
+        return sink_cfg.get('mode') == 'incremental'
+
+    @property
+    def state_key(self):
+        '''Key of this source in the state store'''
+        sink_cfg = self.cfg.get('sink')
+        if sink_cfg:
+            return f"{sink_cfg['type']}:{sink_cfg['name']}"
+        return json.dumps(self.cfg['source'], sort_keys=True, default=str)
+
+    def get_state(self, field):
+        '''Get a field of the state saved by the last run of this source.'''
+        return StateStore().get(self.state_key, {}).get(field)
+
+    def get_watermark(self):
+        '''Get the high-water mark saved by the last incremental run.
+        Returns None if not incremental, backfilling or never saved.
+        '''
+        if not self.incremental or self.date_range:
+            return None
+        return self.get_state('watermark')
+
+    def set_watermark(self, value):
+        '''Stage a new high-water mark, persisted once the data is saved.
+        Backfills do not move the high-water mark.
+        '''
+        if self.date_range:
+            return
+        self._state['watermark'] = value
+
+    def is_unchanged(self, *responses):
+        '''Check whether the raw responses are identical to those of the
+        last saved run. The new content hash is persisted once saved.
+
+        Args:
+            responses (CachedResponse): Responses making up the raw data, or
+                their sha256 hashes.
+        Returns bool, always False when backfilling.
+        '''
+        if self.date_range:
+            return False
+        content_hash = hashlib.sha256(
+            ''.join(getattr(r, 'sha256', r) for r in responses).encode()
+        ).hexdigest()
+        self._state['content_hash'] = content_hash
+        return content_hash == self.get_state('content_hash')
+
+    def filter_date_range(self, df, column='date'):
+        '''Keep the rows within the backfill date range, if any.
+
+        Args:
+            df (pd.DataFrame): Dataframe to filter.
+        kwargs:
+            column (str): Date column to filter on.
+        Returns dataframe.
+        '''
+        if self.date_range is None or df.empty:
+            return df
+        start, end = self.date_range
+        dates = pd.to_datetime(df[column])
+        return df[(dates >= start) & (dates < end)]
+
+    def prepare_backfill(self):
+        '''Fetch raw data shared by all partitions of a backfill once, before
+        the partitions are retrieved in parallel. Defaults to nothing.
+        '''
 
     def retrieve(self):
         '''Retrieve raw data from source.
@@ -37,36 +128,191 @@ class BaseIngest():
         '''
         raise NotImplementedError('Data not retrieved.')
 
+    def retrieve_chunks(self):
+        '''Retrieve raw data from source in bounded size chunks, for
+        streaming mode. Defaults to a single chunk of all retrieved data.
+        Yields dataframes.
+        '''
+        df = self.retrieve()
+        if not df.empty:
+            yield df
+
     def process(self, df):
         '''Process raw data.
         Returns dataframe.
         '''
         return df
 
+    def process_chunks(self, chunks):
+        '''Process chunks of raw data, for streaming mode. Defaults to
+        processing each chunk independently, sources whose processing spans
+        chunks (aggregates, diffs) must override this.
+        Yields dataframes.
+        '''
+        for chunk in chunks:
+            yield self.process(chunk)
+
     def validate(self, df):
-        '''Validate processed data'''
-        # Infer schema
-        schema = pa.infer_schema(df)
-        # Validate data
-        return schema(df)
+        '''Validate processed data.
+        Returns dataframe.
+        '''
+        return self.validate_schema(df, None)
+
+    def validate_schema(self, df, schema, dimensions=None):
+        '''Validate data against a declared schema, in the configured
+        validation mode (full, sample:N, head or off). The schema and
+        dimensions are kept to type and index the sink tables.
+
+        Args:
+            df (pd.DataFrame): Processed dataframe.
+            schema (pa.DataFrameSchema): Schema to validate against, or
+                None to skip validation.
+        kwargs:
+            dimensions (list): Dimension columns of the data.
+        Returns dataframe.
+        '''
+        self.schema = schema
+        self.dimensions = dimensions or []
+        if schema is None:
+            logging.debug('No schema declared, skipping validation.')
+            return df
+        df, self.validation_timings = validation.validate(
+            df,
+            schema,
+            mode=self.cfg['validation'],
+        )
+        return df
+
+    def tables(self):
+        '''Secondary tables the processed data depends on besides the
+        fetched responses, such as mappings loaded outside self.http.
+        Defaults to none.
+        Returns dict of dataframes by name.
+        '''
+        return {}
+
+    def result_key(self):
+        '''Key of the processed result of the raw data retrieved in this
+        run, from the source config, code version, content hashes of the
+        fetched responses and of the secondary tables, and the high-water
+        mark the data was filtered with.
+        Returns str, or None if the result cache is off or nothing was fetched.
+        '''
+        if not self.cfg['cache'] or not self.http.fetched:
+            return None
+        return result_key(
+            type(self).__module__,
+            self.cfg,
+            dict(self.http.fetched),
+            watermark=self.date_range or self.get_watermark(),
+            tables={
+                name: table_hash(df) for name, df in self.tables().items()
+            },
+        )
+
+    def cached_result(self):
+        '''Get the processed and validated data of the raw data retrieved
+        in this run, if processed before.
+        Returns dataframe, or None if not cached.
+        '''
+        key = self.result_key()
+        df = self.results.get(key) if key else None
+        if df is not None:
+            logging.info('Serving processed data from the result cache')
+            # Restore the validated schema and dimensions, for the sink
+            self.validate(df.head(0))
+        return df
+
+    def cache_result(self, df):
+        '''Cache the processed and validated data of the raw data
+        retrieved in this run.
+        '''
+        key = self.result_key()
+        if key:
+            self.results.put(key, df)
 
     def save(self, df, name=None):
         '''Save to a specified data sink.
 
+        In incremental mode the data is appended. With cdc, only rows changed
+        since the last saved snapshot are written, and the counts of inserted,
+        updated and unchanged rows are kept in changes. The staged state
+        (high-water mark, content hash, snapshot) is persisted after the save.
+
         kwargs:
             name (str): Name of the sink collection to save to.
+        Returns number of rows saved.
         '''
         sink_cfg = self.cfg.get('sink')
         if sink_cfg is None:
             logging.warning('No sink configuration provided.')
-            return df
+            return 0
+        try:
+            rows = self._save(df, name or sink_cfg['name'], sink_cfg.get('mode'))
+        except Exception:
+            self._discard_run()
+            raise
+        self._save_state()
+        return rows
+
+    def save_chunks(self, chunks, name=None):
+        '''Save chunks of data to the sink one at a time, for streaming mode.
+
+        The first chunk is saved in the configured mode and later chunks are
+        appended, so a replace is not atomic across chunks. The staged state
+        is persisted after the last chunk.
+
+        Args:
+            chunks (iterable): Processed dataframes.
+        kwargs:
+            name (str): Name of the sink collection to save to.
+        Returns number of rows saved.
+        '''
+        sink_cfg = self.cfg.get('sink')
+        if sink_cfg is None:
+            logging.warning('No sink configuration provided.')
+            return 0
+        name = name or sink_cfg['name']
+        mode = sink_cfg.get('mode')
+        rows, first = 0, True
+        try:
+            for chunk in chunks:
+                if chunk.empty:
+                    continue
+                saved = self._save(chunk, name, mode if first else 'append')
+                first = False
+                rows += saved
+                logging.debug(f'Saved chunk of {saved} rows to {name}')
+        except Exception:
+            self._discard_run()
+            raise
+        if not first:
+            self._save_state()
+        return rows
+
+    def _save(self, df, name, mode):
+        '''Write a dataframe to the configured sink in the given mode.
+        Returns number of rows saved.
+        '''
+        sink_cfg = self.cfg['sink']
+        # Only write rows changed since the last saved snapshot, backfills
+        # of partitions in parallel are written in full
+        if sink_cfg.get('cdc') and not self.date_range:
+            if self._snapshot is None:
+                self._snapshot = Snapshot(self.state_key)
+            df = self._snapshot.diff(df)
+            self.changes = self._snapshot.changes
+            if df.empty:
+                return 0
         # Add metadata
-        df['saved_date'] = datetime.utcnow()
-        df = df.drop_duplicates()
+        if self._saved_date is None:
+            self._saved_date = datetime.utcnow()
+        df['saved_date'] = self._saved_date
+        # Only copy the data if there are duplicates to drop
+        duplicated = df.duplicated()
+        if duplicated.any():
+            df = df[~duplicated]
         # Parse config
-        if not name:
-            name = sink_cfg['name']
-        mode = sink_cfg.get('mode')
         chunksize = sink_cfg.get('chunksize')
         _type = sink_cfg.get('type')
         logging.info(f'Saving data to {_type}...')
@@ -75,28 +321,52 @@ class BaseIngest():
             # Ensure csv file name
             if name[-4:] != '.csv':
                 name += '.csv'
-            mode = 'a' if mode == 'append' else 'w'
-            df.to_csv(name, mode=mode, chunksize=chunksize)
+            if mode in ('append', 'incremental'):
+                # Only write the header for a new file
+                header = not os.path.exists(name)
+                df.to_csv(name, mode='a', header=header, chunksize=chunksize)
+            else:
+                df.to_csv(name, mode='w', chunksize=chunksize)
+        # Save to Parquet
+        elif _type == 'parquet':
+            save_parquet(
+                df,
+                name,
+                mode=mode,
+                partition_by=sink_cfg['partition_by'],
+                compression=sink_cfg['compression'],
+            )
         # Save to PostgreSQL
         elif _type == 'postgres':
             # Connect to database
-            uri = os.environ.get('POSTGRESQL')
-            engine = create_engine(uri)
-            # Convert dtypes
-            dtypes = {}
-            for col in df.columns:
-                if ptypes.is_object_dtype(df[col].dtype):
-                    _df = df[col].dropna()
-                    x = _df.iloc[0]
-                    if isinstance(x, tuple):
-                        t = _type_py2sql_dict.get(type(x[0]))
-                        if t is not None:
-                            dtypes[col] = ARRAY(t)
-            df.to_sql(
+            engine = get_engine(os.environ.get('POSTGRESQL'))
+            save_postgres(
+                df,
                 name,
                 engine,
-                if_exists=mode,
-                chunksize=chunksize,
-                index=False,
-                dtype=dtypes
+                mode=mode,
+                upsert=sink_cfg.get('upsert'),
+                latest=sink_cfg.get('latest', True),
+                schema=self.schema,
+                dimensions=self.dimensions,
             )
+        return len(df)
+
+    def _discard_run(self):
+        '''Discard the snapshot rows and saved date of a failed save, so the
+        saved snapshot is reloaded and the rows diffed again on the next save
+        '''
+        self._snapshot = None
+        self._saved_date = None
+
+    def _save_state(self):
+        '''Persist the state staged during this run, not for backfills'''
+        self._saved_date = None
+        if self.date_range:
+            return
+        if self._snapshot is not None:
+            self._snapshot.save()
+            logging.info(f'Changes saved to {self.state_key}: {self.changes}')
+        if self._state:
+            StateStore().update(self.state_key, self._state)
+            logging.debug(f'Saved state: {self._state}')
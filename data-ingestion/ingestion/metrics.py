@@ -0,0 +1,189 @@
+'''Metrics of pipeline stages per source'''
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+STAGES = ['retrieve', 'process', 'validate', 'save']
+
+# Prometheus gauges per source: name, help and record field
+SOURCE_GAUGES = [
+    ('herd_ingest_success', 'Whether the last run of the source succeeded.', 'success'),
+    ('herd_ingest_last_run_timestamp_seconds', 'Time the last run of the source finished.', 'timestamp_seconds'),
+    ('herd_ingest_http_requests', 'HTTP requests made by the source.', 'http_requests'),
+    ('herd_ingest_http_retries', 'HTTP requests retried after a transient failure.', 'http_retries'),
+    ('herd_ingest_http_cache_hits', 'HTTP requests served from the cache (not modified).', 'http_cache_hits'),
+    ('herd_ingest_http_bytes', 'Bytes downloaded by the source.', 'http_bytes'),
+    ('herd_ingest_peak_rss_bytes', 'Peak resident set size of the process after the source ran.', 'peak_rss_bytes'),
+]
+
+# Prometheus gauge of changed rows per source and change type
+CHANGES_GAUGE = ('herd_ingest_changed_rows', 'Rows saved by change type, with change data capture.')
+
+# Prometheus gauges per source and stage
+STAGE_GAUGES = [
+    ('herd_ingest_stage_wall_seconds', 'Wall time of the stage.', 'wall_seconds'),
+    ('herd_ingest_stage_cpu_seconds', 'CPU time of the stage in the source thread.', 'cpu_seconds'),
+    ('herd_ingest_stage_rows_in', 'Rows into the stage.', 'rows_in'),
+    ('herd_ingest_stage_rows_out', 'Rows out of the stage.', 'rows_out'),
+]
+
+
+def peak_rss():
+    '''Peak resident set size of the process in bytes, or None if unknown'''
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+
+
+def _stage(stages, name):
+    return stages.setdefault(name, {
+        'wall_seconds': 0.0,
+        'cpu_seconds': 0.0,
+        'rows_out': 0,
+    })
+
+
+@contextmanager
+def measure(stages, name):
+    '''Record the wall and CPU seconds taken by a stage, even if it fails.
+
+    Args:
+        stages (dict): Metrics per stage name, updated in place.
+        name (str): Name of the stage.
+    Yields the metrics of the stage, to record rows_out in.
+    '''
+    record = _stage(stages, name)
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] += time.perf_counter() - wall
+        record['cpu_seconds'] += time.thread_time() - cpu
+
+
+def measure_chunks(chunks, stages, name):
+    '''Iterate over chunks, recording the wall and CPU seconds taken by
+    this stage alone and the rows out of it. Time spent in upstream stages
+    while waiting for a chunk is excluded.
+
+    Args:
+        chunks (iterable): Dataframes yielded by the stage.
+        stages (dict): Metrics per stage name, updated in place.
+        name (str): Name of the stage.
+    Yields dataframes.
+    '''
+    record = _stage(stages, name)
+    chunks = iter(chunks)
+    while True:
+        upstream = _totals(stages)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            upstream_wall, upstream_cpu = (
+                after - before
+                for before, after in zip(upstream, _totals(stages))
+            )
+            record['wall_seconds'] += time.perf_counter() - wall - upstream_wall
+            record['cpu_seconds'] += time.thread_time() - cpu - upstream_cpu
+        record['rows_out'] += len(chunk)
+        yield chunk
+
+
+def _totals(stages):
+    return (
+        sum(record['wall_seconds'] for record in stages.values()),
+        sum(record['cpu_seconds'] for record in stages.values()),
+    )
+
+
+def source_record(name, module, stages, http=None, changes=None, error=None):
+    '''Summarize the metrics of a source run.
+
+    The rows into each stage are the rows out of the previous one.
+
+    Args:
+        name (str): Name of the source sink.
+        module (str): Name of the source module.
+        stages (dict): Metrics per stage name.
+    kwargs:
+        http (HTTPCache): HTTP cache used by the source, for request counts.
+        changes (dict): Counts of inserted, updated and unchanged rows.
+        error (Exception): Error the run failed with, if any.
+    Returns dict.
+    '''
+    stages = {stage: dict(stages[stage]) for stage in STAGES if stage in stages}
+    rows_in = None
+    for record in stages.values():
+        record['rows_in'] = rows_in
+        rows_in = record['rows_out']
+    stats = http.stats if http is not None else {}
+    now = datetime.utcnow()
+    return {
+        'timestamp': now.isoformat(),
+        'timestamp_seconds': (now - datetime(1970, 1, 1)).total_seconds(),
+        'source': name,
+        'module': module,
+        'success': error is None,
+        'error': repr(error) if error is not None else None,
+        'stages': stages,
+        'changes': changes,
+        'http_requests': stats.get('requests'),
+        'http_retries': stats.get('retries'),
+        'http_cache_hits': stats.get('cache_hits'),
+        'http_bytes': stats.get('bytes'),
+        'peak_rss_bytes': peak_rss(),
+    }
+
+
+def write_json_lines(path, records):
+    '''Append source records to a JSON lines file'''
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record, default=str) + '\n')
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_prometheus(path, records):
+    '''Write source records as a Prometheus textfile, for the node exporter
+    textfile collector. The file is replaced atomically.
+    '''
+    lines = []
+    for metric, description, field in SOURCE_GAUGES:
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} gauge']
+        for record in records:
+            if record[field] is not None:
+                lines.append(f'{metric}{{source="{_label(record["source"])}"}} {float(record[field])}')
+    for metric, description, field in STAGE_GAUGES:
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} gauge']
+        for record in records:
+            for stage, values in record['stages'].items():
+                if values[field] is not None:
+                    labels = f'source="{_label(record["source"])}",stage="{stage}"'
+                    lines.append(f'{metric}{{{labels}}} {float(values[field])}')
+    metric, description = CHANGES_GAUGE
+    lines += [f'# HELP {metric} {description}', f'# TYPE {metric} gauge']
+    for record in records:
+        for change, count in (record['changes'] or {}).items():
+            labels = f'source="{_label(record["source"])}",change="{change}"'
+            lines.append(f'{metric}{{{labels}}} {float(count)}')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
@@ -0,0 +1,56 @@
+'''Partitioned Parquet dataset sink'''
+
+import os
+import shutil
+from datetime import datetime
+import pandas as pd
+import pandas.api.types as ptypes
+
+# Date format of each partition granularity
+PARTITION_FORMATS = {
+    'year': '%Y',
+    'month': '%Y-%m',
+    'day': '%Y-%m-%d',
+}
+
+
+def save_parquet(df, name, mode='replace', partition_by='month', compression='zstd'):
+    '''Save a dataframe as a Parquet dataset partitioned by date.
+
+    Tuple columns (e.g. age_group) are written as list columns. In replace
+    mode the dataset is rewritten, otherwise new files are added to the
+    partitions of the saved dates.
+
+    Args:
+        df (pd.DataFrame): Dataframe to save.
+        name (str): Path of the dataset directory.
+    kwargs:
+        mode (str): One of replace, append or incremental.
+        partition_by (str): Partition granularity, one of year, month or day.
+        compression (str): Parquet compression codec.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = df.copy()
+    for col in df.columns:
+        if ptypes.is_object_dtype(df[col].dtype):
+            values = df[col].dropna()
+            if not values.empty and isinstance(values.iloc[0], tuple):
+                df[col] = df[col].map(
+                    lambda x: list(x) if isinstance(x, tuple) else None
+                )
+    df[partition_by] = pd.to_datetime(df['date'])\
+        .dt.strftime(PARTITION_FORMATS[partition_by])
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if mode == 'replace' and os.path.exists(name):
+        shutil.rmtree(name)
+    timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    pq.write_to_dataset(
+        table,
+        name,
+        partition_cols=[partition_by],
+        basename_template=f'part-{timestamp}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+        compression=compression,
+    )
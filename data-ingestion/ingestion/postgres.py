@@ -0,0 +1,383 @@
+'''PostgreSQL sink using bulk COPY'''
+
+import io
+import logging
+import sqlalchemy
+import pandas as pd
+import pandas.api.types as ptypes
+
+# SQL types per pandera (or pandas) dtype
+SQL_TYPES = {
+    'bool': 'boolean',
+    'int8': 'smallint',
+    'int16': 'smallint',
+    'int32': 'integer',
+    'int64': 'bigint',
+    'Int8': 'smallint',
+    'Int16': 'smallint',
+    'Int32': 'integer',
+    'Int64': 'bigint',
+    'float32': 'real',
+    'float64': 'double precision',
+    'str': 'text',
+    'string': 'text',
+    'string[python]': 'text',
+    'string[pyarrow]': 'text',
+    'datetime64[ns]': 'timestamp',
+}
+
+# SQL types of columns whose meaning the dtype does not capture
+COLUMN_TYPES = {
+    # Calendar days, stored as midnight timestamps in pandas
+    'date': 'date',
+}
+
+# SQL array types per element type, for tuple columns such as age_group
+ARRAY_TYPES = {
+    int: 'integer[]',
+    float: 'double precision[]',
+    str: 'text[]',
+}
+
+INTEGER_TYPES = ('smallint', 'integer', 'bigint')
+
+
+def column_types(df, schema=None):
+    '''SQL types of the columns of a dataframe, taken from the validated
+    schema where declared and from the data otherwise. Tuple columns are
+    typed as arrays of their element type, categoricals as their categories.
+
+    Args:
+        df (pd.DataFrame): Dataframe to save.
+    kwargs:
+        schema (pa.DataFrameSchema): Schema the dataframe was validated with.
+    Returns dict of column name to SQL type.
+    '''
+    types = {}
+    for col in df.columns:
+        dtype = str(df[col].dtype)
+        if schema is not None and col in schema.columns:
+            dtype = str(schema.columns[col].dtype)
+        if col in COLUMN_TYPES:
+            types[col] = COLUMN_TYPES[col]
+        elif dtype in SQL_TYPES:
+            types[col] = SQL_TYPES[dtype]
+        elif isinstance(df[col].dtype, pd.CategoricalDtype) \
+                and len(df[col].cat.categories):
+            # Typed by the categories, e.g. text for string dimensions
+            categories = pd.DataFrame({col: df[col].cat.categories})
+            types[col] = column_types(categories)[col]
+        elif ptypes.is_datetime64_any_dtype(df[col].dtype):
+            types[col] = 'timestamp'
+        elif ptypes.is_integer_dtype(df[col].dtype):
+            types[col] = 'bigint'
+        elif ptypes.is_float_dtype(df[col].dtype):
+            types[col] = 'double precision'
+        else:
+            values = df[col].dropna()
+            x = values.iloc[0] if not values.empty else None
+            if isinstance(x, (tuple, list)):
+                types[col] = ARRAY_TYPES.get(type(x[0]) if x else str, 'text[]')
+            else:
+                types[col] = 'text'
+    return types
+
+
+# Suffix of the tables of the latest saved rows
+LATEST_SUFFIX = '_latest'
+
+# Columns of the latest table indexed for dashboard queries, when present
+LATEST_INDEXES = ['date', 'state_code', 'dimensions_id']
+
+
+def _quote(name):
+    '''Quote a SQL identifier'''
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _array_literal(x):
+    '''Format a tuple as a PostgreSQL array literal'''
+    if not isinstance(x, (tuple, list)):
+        return x
+    return '{' + ','.join(str(i) for i in x) + '}'
+
+
+def copy_dataframe(conn, df, table, types):
+    '''Stream a dataframe into an existing table via COPY FROM STDIN.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): Connection within a transaction.
+        df (pd.DataFrame): Dataframe to copy.
+        table (str): Quoted name of the table to copy into.
+        types (dict): SQL types per column, used to format array columns
+            and integers held as floats.
+    '''
+    formatted = {}
+    for col, t in types.items():
+        if t.endswith('[]'):
+            formatted[col] = df[col].map(_array_literal)
+        elif t in INTEGER_TYPES and ptypes.is_float_dtype(df[col].dtype):
+            # Nullable integers are floats in pandas, written as 1.0
+            formatted[col] = df[col].astype('Int64')
+    if formatted:
+        df = df.assign(**formatted)
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    columns = ', '.join(_quote(col) for col in df.columns)
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)',
+        buffer
+    )
+
+
+def _index_latest(conn, name, columns):
+    '''Create the indexes of a latest table'''
+    latest = _quote(name + LATEST_SUFFIX)
+    for col in LATEST_INDEXES:
+        if col in columns:
+            index = _quote(f'{name}{LATEST_SUFFIX}_{col}_idx')
+            conn.execute(sqlalchemy.text(
+                f'CREATE INDEX IF NOT EXISTS {index} ON {latest} ({_quote(col)})'
+            ))
+
+
+def rebuild_latest(conn, name, columns):
+    '''Rebuild the latest table of a target from its full history.
+
+    The latest table holds the rows of the most recent saved_date of each
+    dimensions_id, so queries need not dedup the append history. Several
+    rows of a saved_date may share a dimensions_id, e.g. when the key
+    dimensions do not cover every column, and are all kept.
+    '''
+    target = _quote(name)
+    latest = _quote(name + LATEST_SUFFIX)
+    conn.execute(sqlalchemy.text(f'DROP TABLE IF EXISTS {latest}'))
+    conn.execute(sqlalchemy.text(
+        f'CREATE TABLE {latest} AS SELECT t.* FROM {target} t '
+        f'JOIN (SELECT dimensions_id, MAX(saved_date) AS saved_date '
+        f'FROM {target} GROUP BY dimensions_id) m '
+        f'ON t.dimensions_id = m.dimensions_id AND t.saved_date = m.saved_date'
+    ))
+    _index_latest(conn, name, columns)
+
+
+def update_latest(conn, name, staging, columns):
+    '''Update the latest table of a target with newly staged rows.
+
+    Rows of the staged dimensions_id saved before the staged rows are
+    replaced by the staged rows of the most recent saved_date. Rows saved
+    at the same time are kept, so chunks of a run sharing a saved_date add
+    up. The cost scales with the rows saved rather than the history.
+    '''
+    latest = _quote(name + LATEST_SUFFIX)
+    exists = conn.execute(
+        sqlalchemy.text('SELECT to_regclass(:name)'),
+        {'name': latest}
+    ).scalar()
+    if exists is None:
+        rebuild_latest(conn, name, columns)
+        return
+    staged = (
+        f'(SELECT dimensions_id, MAX(saved_date) AS saved_date '
+        f'FROM {staging} GROUP BY dimensions_id)'
+    )
+    conn.execute(sqlalchemy.text(
+        f'DELETE FROM {latest} l USING {staged} m '
+        f'WHERE l.dimensions_id = m.dimensions_id AND l.saved_date < m.saved_date'
+    ))
+    # Staged rows older than a kept latest row are not inserted
+    cols = ', '.join(_quote(col) for col in columns)
+    conn.execute(sqlalchemy.text(
+        f'INSERT INTO {latest} ({cols}) '
+        f'SELECT {", ".join(f"s.{_quote(col)}" for col in columns)} '
+        f'FROM {staging} s JOIN {staged} m '
+        f'ON s.dimensions_id = m.dimensions_id AND s.saved_date = m.saved_date '
+        f'WHERE NOT EXISTS (SELECT 1 FROM {latest} l '
+        f'WHERE l.dimensions_id = s.dimensions_id AND l.saved_date > s.saved_date)'
+    ))
+
+
+def _table_columns(conn, name):
+    '''Columns of an existing table.
+    Returns dict of column name to SQL type, empty if the table does not exist.
+    '''
+    rows = conn.execute(sqlalchemy.text(
+        'SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute '
+        'WHERE attrelid = to_regclass(:table) AND attnum > 0 AND NOT attisdropped '
+        'ORDER BY attnum'
+    ), {'table': _quote(name)})
+    return dict(rows.fetchall())
+
+
+def _has_primary_key(conn, name):
+    return conn.execute(sqlalchemy.text(
+        "SELECT 1 FROM pg_index WHERE indrelid = to_regclass(:table) AND indisprimary"
+    ), {'table': _quote(name)}).scalar() is not None
+
+
+def _has_duplicate_ids(conn, name):
+    return conn.execute(sqlalchemy.text(
+        f'SELECT 1 FROM {_quote(name)} GROUP BY dimensions_id HAVING COUNT(*) > 1 LIMIT 1'
+    )).scalar() is not None
+
+
+def create_indexes(conn, name, dimensions=(), primary_key=False):
+    '''Create the primary key on dimensions_id, or an index if rows are not
+    unique per dimensions_id, and an index per dimension column.
+
+    A table already holding several rows of a dimensions_id, e.g. appended
+    before upserts were enabled, cannot take the primary key. It is logged
+    and dimensions_id is indexed instead.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): Connection within a transaction.
+        name (str): Name of the table.
+    kwargs:
+        dimensions (list): Dimension columns to index.
+        primary_key (bool): Make dimensions_id the primary key.
+    Returns True if dimensions_id is the primary key.
+    '''
+    target = _quote(name)
+    if primary_key and not _has_primary_key(conn, name):
+        if _has_duplicate_ids(conn, name):
+            logging.warning(
+                f'{name} has duplicate dimensions_id, indexing it without a '
+                'primary key. Replace the table to dedup it.'
+            )
+            primary_key = False
+        else:
+            conn.execute(sqlalchemy.text(
+                f'ALTER TABLE {target} ADD PRIMARY KEY (dimensions_id)'
+            ))
+    dimensions = [col for col in dimensions if col != 'dimensions_id']
+    if not primary_key:
+        dimensions = ['dimensions_id', *dimensions]
+    for col in dimensions:
+        index = _quote(f'{name}_{col}_idx')
+        conn.execute(sqlalchemy.text(
+            f'CREATE INDEX IF NOT EXISTS {index} ON {target} ({_quote(col)})'
+        ))
+    return primary_key
+
+
+def create_table(conn, name, types):
+    '''Create a table with the given column types'''
+    columns = ', '.join(f'{_quote(col)} {t}' for col, t in types.items())
+    conn.execute(sqlalchemy.text(f'CREATE TABLE {_quote(name)} ({columns})'))
+
+
+def migrate_table(conn, name, types):
+    '''Additively migrate an existing table to the given column types.
+
+    Missing columns are added. Columns are never dropped or retyped, type
+    changes are only logged.
+
+    Returns True if the table existed.
+    '''
+    existing = _table_columns(conn, name)
+    if not existing:
+        return False
+    for col, t in types.items():
+        if col not in existing:
+            logging.info(f'Adding column {col} {t} to {name}')
+            conn.execute(sqlalchemy.text(
+                f'ALTER TABLE {_quote(name)} ADD COLUMN {_quote(col)} {t}'
+            ))
+        elif existing[col] != t and not (
+            t == 'timestamp' and existing[col] == 'timestamp without time zone'
+        ):
+            logging.warning(
+                f'Column {col} of {name} is {existing[col]}, expected {t}. '
+                'Replace the table to change its type.'
+            )
+    return True
+
+
+def save_postgres(df, name, engine, mode='replace', upsert=False, latest=True,
+                  schema=None, dimensions=()):
+    '''Save a dataframe to PostgreSQL in a single transaction.
+
+    Tables are created with the column types of the validated schema and
+    an index per dimension column. dimensions_id is the primary key with
+    upsert, and otherwise indexed, since appended history repeats it. An
+    upsert into a table already holding duplicate ids replaces their rows.
+    Existing tables are migrated additively, adding new columns.
+
+    The data is copied into a staging table first. In replace mode the
+    staging table is then swapped in for the target, so readers see either
+    the old or the new table and never an empty one. Otherwise the staged
+    rows are inserted into the target, optionally upserted on dimensions_id.
+
+    Args:
+        df (pd.DataFrame): Dataframe to save.
+        name (str): Name of the target table.
+        engine (sqlalchemy.engine.Engine): Database engine.
+    kwargs:
+        mode (str): One of replace, append or incremental.
+        upsert (bool): Keep one row per dimensions_id, updating existing rows.
+        latest (bool): Maintain a {name}_latest table of the rows of the
+            latest saved_date per dimensions_id in the same transaction, if the data has
+            a dimensions_id and saved_date.
+        schema (pa.DataFrameSchema): Schema the dataframe was validated with.
+        dimensions (list): Dimension columns to index.
+    '''
+    types = column_types(df, schema)
+    keyed = 'dimensions_id' in df.columns
+    # The latest rows are only known for keyed rows with a saved date
+    latest = latest and keyed and 'saved_date' in df.columns
+    with engine.begin() as conn:
+        target = _quote(name)
+        staging_name = f'{name}__staging'
+        staging = _quote(staging_name)
+        if mode == 'replace':
+            # Build the new table then swap it in, indexing after the load
+            conn.execute(sqlalchemy.text(f'DROP TABLE IF EXISTS {staging}'))
+            create_table(conn, staging_name, types)
+            copy_dataframe(conn, df, staging, types)
+            conn.execute(sqlalchemy.text(f'DROP TABLE IF EXISTS {target}'))
+            conn.execute(sqlalchemy.text(f'ALTER TABLE {staging} RENAME TO {target}'))
+            if keyed:
+                create_indexes(conn, name, dimensions=dimensions, primary_key=upsert)
+            if latest:
+                rebuild_latest(conn, name, df.columns)
+            return
+        if not migrate_table(conn, name, types):
+            create_table(conn, name, types)
+        keyed_upsert = keyed and create_indexes(
+            conn, name, dimensions=dimensions, primary_key=upsert
+        )
+        if latest:
+            migrate_table(conn, name + LATEST_SUFFIX, types)
+        conn.execute(sqlalchemy.text(
+            f'CREATE TEMP TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP'
+        ))
+        copy_dataframe(conn, df, staging, types)
+        columns = ', '.join(_quote(col) for col in df.columns)
+        if keyed_upsert:
+            updates = ', '.join(
+                f'{_quote(col)} = EXCLUDED.{_quote(col)}'
+                for col in df.columns if col != 'dimensions_id'
+            )
+            conn.execute(sqlalchemy.text(
+                f'INSERT INTO {target} ({columns}) '
+                f'SELECT DISTINCT ON (dimensions_id) {columns} FROM {staging} '
+                f'ON CONFLICT (dimensions_id) DO UPDATE SET {updates}'
+            ))
+        elif upsert:
+            # Without a primary key the rows of the staged ids are replaced
+            conn.execute(sqlalchemy.text(
+                f'DELETE FROM {target} t USING {staging} s '
+                f'WHERE t.dimensions_id = s.dimensions_id'
+            ))
+            conn.execute(sqlalchemy.text(
+                f'INSERT INTO {target} ({columns}) '
+                f'SELECT DISTINCT ON (dimensions_id) {columns} FROM {staging}'
+            ))
+        else:
+            conn.execute(sqlalchemy.text(
+                f'INSERT INTO {target} ({columns}) SELECT {columns} FROM {staging}'
+            ))
+        if latest:
+            update_latest(conn, name, staging, df.columns)
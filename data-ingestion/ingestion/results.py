@@ -0,0 +1,141 @@
+'''Persistent cache of processed and validated results'''
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import pandas as pd
+
+from .hashing import hash_rows
+
+DEFAULT_RESULTS_PATH = '.cache/results'
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+_lock = threading.Lock()
+
+# Code versions by module name
+_versions = {}
+
+
+def code_version(module):
+    '''Hash of the code of a source module, the other modules of its
+    package and the ingestion package, so results are recomputed when the
+    processing code changes.
+
+    Args:
+        module (str): Name of the source module.
+    Returns str.
+    '''
+    with _lock:
+        if module not in _versions:
+            folders = {
+                os.path.dirname(os.path.abspath(sys.modules[module].__file__)),
+                os.path.dirname(os.path.abspath(__file__)),
+            }
+            sha256 = hashlib.sha256()
+            for path in sorted(p for f in folders for p in glob.glob(os.path.join(f, '*.py'))):
+                with open(path, 'rb') as f:
+                    sha256.update(f.read())
+            _versions[module] = sha256.hexdigest()
+        return _versions[module]
+
+
+def table_hash(df):
+    '''Content hash of a secondary table (e.g. a mapping merged in
+    processing), for the result key.
+    Returns str.
+    '''
+    return hashlib.sha256(hash_rows(df).to_numpy().tobytes()).hexdigest()
+
+
+def result_key(module, cfg, fetched, watermark=None, tables=None):
+    '''Key of a processed result: the source config, code version and
+    content of the raw data and of the secondary tables it is merged with.
+
+    Args:
+        module (str): Name of the source module.
+        cfg (dict): Ingest config, the sink is not part of the key.
+        fetched (dict): Content hashes of the responses the raw data was
+            retrieved from, by URL.
+    kwargs:
+        watermark: High-water mark the raw data was filtered with.
+        tables (dict): Content hashes of the secondary tables by name.
+    Returns str.
+    '''
+    return hashlib.sha256(json.dumps({
+        'module': module,
+        'cfg': {k: v for k, v in cfg.items() if k != 'sink'},
+        'code': code_version(module),
+        'fetched': fetched,
+        'watermark': watermark,
+        'tables': tables or {},
+    }, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResultCache():
+    '''On-disk cache of processed and validated dataframes, keyed by
+    result_key and stored as pickles. The cache is bounded in size,
+    evicting the least recently used results.
+
+    kwargs:
+        path (str): Cache directory. Defaults to the RESULT_CACHE
+            environment variable, or .cache/results.
+        max_bytes (int): Maximum size of cached results. Defaults to the
+            RESULT_CACHE_MAX_BYTES environment variable, or 1GB.
+    '''
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or os.environ.get('RESULT_CACHE', DEFAULT_RESULTS_PATH)
+        self.max_bytes = max_bytes or int(
+            os.environ.get('RESULT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        )
+
+    def _result_path(self, key):
+        return os.path.join(self.path, f'{key}.pkl')
+
+    def get(self, key):
+        '''Get a cached result.
+        Returns dataframe, or None if not cached.
+        '''
+        path = self._result_path(key)
+        try:
+            df = pd.read_pickle(path)
+        except (OSError, EOFError):
+            return None
+        # Mark as recently used
+        os.utime(path)
+        return df
+
+    def put(self, key, df):
+        '''Cache a result, evicting the least recently used results
+        beyond max_bytes.
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        path = self._result_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        df.to_pickle(tmp_path, protocol=5)
+        os.replace(tmp_path, path)
+        with _lock:
+            self._evict()
+
+    def _evict(self):
+        '''Remove least recently used results until within max_bytes'''
+        entries = []
+        for path in glob.glob(os.path.join(self.path, '*.pkl')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            logging.debug(f'Evicting from result cache: {path}')
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
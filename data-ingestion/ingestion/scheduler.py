@@ -0,0 +1,128 @@
+'''In-process scheduler of periodic source runs, for daemon mode'''
+
+import logging
+import random
+import re
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds per interval unit
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Maximum seconds between checks for finished runs
+POLL_SECONDS = 1.0
+
+
+def parse_interval(value):
+    '''Parse an interval such as 90, 30s, 15m, 6h or 1d into seconds.
+    Returns float.
+    '''
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*', str(value))
+    if not match:
+        raise ValueError(f'Invalid interval: {value}')
+    return float(match.group(1)) * UNITS[match.group(2) or 's']
+
+
+class Job():
+    '''A function run periodically by the scheduler.
+
+    Args:
+        name (str): Name of the job, unique within the scheduler.
+        interval (float): Seconds between the starts of runs.
+        func (callable): Function of no arguments to run.
+    '''
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = None
+        self.future = None
+
+    @property
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+
+class Scheduler():
+    '''Runs jobs at their intervals in a thread pool until stopped.
+
+    Start times are jittered, so jobs of the same interval do not start
+    together and do not hit a host at the same time every cycle. A job is
+    never started while its previous run is still going, a due run of a
+    running job is skipped to its next interval. On SIGINT or SIGTERM no
+    new runs are started and the scheduler returns once the running jobs
+    finish.
+
+    Args:
+        jobs (list): Jobs to run.
+    kwargs:
+        workers (int): Maximum jobs running at once.
+        jitter (float): Fraction of the interval start times are randomly
+            moved by, and the first runs spread over.
+        on_done (callable): Called in the scheduler thread with the job and
+            the result of each finished run.
+    '''
+    def __init__(self, jobs, workers=4, jitter=0.1, on_done=None):
+        self.jobs = jobs
+        self.workers = workers
+        self.jitter = jitter
+        self.on_done = on_done
+        self.stopping = threading.Event()
+
+    def _delay(self, job):
+        '''Seconds to the next run of a job, jittered'''
+        return job.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def stop(self, *args):
+        '''Stop starting runs, the running ones are finished'''
+        if not self.stopping.is_set():
+            logging.info('Stopping, waiting for running sources to finish...')
+        self.stopping.set()
+
+    def _collect(self):
+        '''Hand the results of finished runs to on_done'''
+        for job in self.jobs:
+            if job.future is None or not job.future.done():
+                continue
+            future, job.future = job.future, None
+            try:
+                result = future.result()
+            except Exception:
+                logging.exception(f'Run of {job.name} failed')
+                continue
+            if self.on_done:
+                self.on_done(job, result)
+
+    def run(self):
+        '''Run the jobs until stopped by a signal or stop().'''
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+        now = time.monotonic()
+        for job in self.jobs:
+            job.next_run = now + random.uniform(0, self.jitter * job.interval)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self.stopping.is_set():
+                self._collect()
+                now = time.monotonic()
+                for job in self.jobs:
+                    if job.next_run > now:
+                        continue
+                    if job.running:
+                        logging.warning(f'{job.name} is still running, skipping this run.')
+                    else:
+                        logging.info(f'Starting {job.name}')
+                        job.future = executor.submit(job.func)
+                    job.next_run = now + self._delay(job)
+                next_run = min(job.next_run for job in self.jobs)
+                self.stopping.wait(min(max(0.0, next_run - now), POLL_SECONDS))
+            # Let running jobs finish
+            for job in self.jobs:
+                if job.future is not None:
+                    job.future.exception()
+        self._collect()
+        logging.info('Scheduler stopped.')
@@ -0,0 +1,52 @@
+'''Local store for per-source ingestion state'''
+
+import json
+import os
+import threading
+
+DEFAULT_STATE_PATH = 'ingestion_state.json'
+
+_lock = threading.Lock()
+
+
+class StateStore():
+    '''JSON file store of values (e.g. high-water marks) keyed by source.
+
+    kwargs:
+        path (str): Path to the state file. Defaults to the INGESTION_STATE
+            environment variable, or ingestion_state.json.
+    '''
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('INGESTION_STATE', DEFAULT_STATE_PATH)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def get(self, key, default=None):
+        '''Get the stored value for a key'''
+        with _lock:
+            return self._read().get(key, default)
+
+    def set(self, key, value):
+        '''Store a value for a key'''
+        with _lock:
+            state = self._read()
+            state[key] = value
+            self._write(state)
+
+    def update(self, key, values):
+        '''Merge a dict of values into the dict stored for a key'''
+        with _lock:
+            state = self._read()
+            state[key] = {**state.get(key, {}), **values}
+            self._write(state)
+
+    def _write(self, state):
+        # Write to a temporary file first so the state is never half written
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
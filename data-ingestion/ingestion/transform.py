@@ -0,0 +1,202 @@
+'''Declarative dataframe transforms'''
+
+import re
+import numpy as np
+import pandas as pd
+
+from .hashing import hash_dimensions
+
+
+def _rename(df, mapping, tables):
+    df.rename(columns=mapping, inplace=True)
+    return df
+
+
+def _drop(df, columns, tables):
+    df.drop(columns=columns, inplace=True, errors='ignore')
+    return df
+
+
+def _constant(df, values, tables):
+    for col, value in values.items():
+        if isinstance(value, str):
+            # A single category, one byte per row
+            df[col] = pd.Categorical.from_codes(
+                np.zeros(len(df), dtype='int8'), [value]
+            )
+        else:
+            df[col] = value
+    return df
+
+
+def _categorize(df, columns, tables):
+    for col in columns:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _derive(df, expressions, tables):
+    for col, expression in expressions.items():
+        if callable(expression):
+            df[col] = expression(df)
+        else:
+            df[col] = df.eval(expression)
+    return df
+
+
+def _map(df, mappings, tables):
+    for col, (source, mapping) in mappings.items():
+        df[col] = df[source].map(mapping)
+    return df
+
+
+def _replace(df, values, tables):
+    return df.replace(values)
+
+
+def _to_datetime(df, columns, tables):
+    for col in columns:
+        df[col] = pd.to_datetime(df[col])
+    return df
+
+
+def _group_count(df, args, tables):
+    return df.groupby(args['by'], observed=True).size().reset_index(name=args['name'])
+
+
+def _diff(df, args, tables):
+    by = args['by']
+    df = df.sort_values(by=[*by, args['order']])
+    groups = df.groupby(by, observed=True)
+    for col, diff_col in args['columns'].items():
+        df[diff_col] = groups[col].diff().fillna(0)
+    return df
+
+
+def _merge(df, name, tables):
+    table = tables[name]
+    return pd.merge(df, table() if callable(table) else table)
+
+
+def _apply(df, func, tables):
+    return func(df)
+
+
+def _key_hash(df, dimensions, tables):
+    df['dimensions_id'] = hash_dimensions(df, dimensions)
+    return df
+
+
+STEPS = {
+    'rename': _rename,
+    'drop': _drop,
+    'constant': _constant,
+    'categorize': _categorize,
+    'derive': _derive,
+    'map': _map,
+    'replace': _replace,
+    'to_datetime': _to_datetime,
+    'group_count': _group_count,
+    'diff': _diff,
+    'merge': _merge,
+    'apply': _apply,
+    'key_hash': _key_hash,
+}
+
+
+def _reads(kind, args):
+    '''Columns read by a column step, or None if unknown (functions)'''
+    if kind == 'constant':
+        return set()
+    if kind == 'map':
+        return {source for source, _ in args.values()}
+    columns = set()
+    for expression in args.values():
+        if callable(expression):
+            return None
+        columns |= set(re.findall(r'[A-Za-z_]\w*', expression))
+    return columns
+
+
+def _fusable(kind, prev, args):
+    '''Whether a column step can be fused with the previous one: it must
+    not redefine or read the columns the previous step defines.
+    '''
+    if set(args) & set(prev):
+        return False
+    reads = _reads(kind, args)
+    return reads is not None and not reads & set(prev)
+
+
+def _fuse(steps):
+    '''Fuse consecutive steps of the same type where order is preserved.
+    Returns list of (step type, arguments).
+    '''
+    fused = []
+    for step in steps:
+        (kind, args), = step.items()
+        if fused and fused[-1][0] == kind:
+            prev = fused[-1][1]
+            if kind in ('constant', 'derive', 'map') and _fusable(kind, prev, args):
+                fused[-1] = (kind, {**prev, **args})
+                continue
+            if kind in ('drop', 'categorize', 'to_datetime'):
+                fused[-1] = (kind, [*prev, *args])
+                continue
+            # Renames are fused unless they chain (a -> b, b -> c)
+            if kind == 'rename' and not set(args) & set(prev.values()):
+                fused[-1] = (kind, {**prev, **args})
+                continue
+        fused.append((kind, args))
+    return fused
+
+
+def apply_transforms(df, steps, tables=None):
+    '''Apply a declarative list of transform steps to a dataframe.
+
+    Each step is a single key dict of step type to arguments:
+        rename: {column: new name}
+        drop: [columns], missing columns are ignored
+        constant: {column: value}, string values as categoricals
+        categorize: [columns], as categoricals, missing columns are ignored
+        derive: {column: expression}, evaluated with df.eval, or a
+            vectorized function of the dataframe returning a series
+        map: {column: (source column, mapping dict)}
+        replace: {value: new value}
+        to_datetime: [columns]
+        group_count: {'by': [columns], 'name': count column}, only
+            observed groups of categorical columns are counted
+        diff: {'by': [columns], 'order': column, 'columns': {column: diff column}},
+            sorts by the group and order columns, diffs within each group
+        merge: name of a table to inner join with
+        apply: function of the dataframe returning a dataframe
+        key_hash: [dimension columns], hashed into dimensions_id
+
+    Consecutive steps of the same type are fused, unless a step redefines
+    or reads a column defined by the previous one, and column steps modify
+    a single copy of the input in place.
+
+    Args:
+        df (pd.DataFrame): Dataframe to transform.
+        steps (list): Transform steps.
+    kwargs:
+        tables (dict): Dataframes (or functions returning them) by name,
+            for merge steps.
+    Returns dataframe.
+    '''
+    df = df.copy()
+    for kind, args in _fuse(steps):
+        df = STEPS[kind](df, args, tables or {})
+    return df
+
+
+def key_dimensions(steps):
+    '''Dimension columns hashed into dimensions_id by a list of transform
+    steps, e.g. to index them in a sink.
+    Returns list of columns.
+    '''
+    dimensions = []
+    for step in steps:
+        dimensions = step.get('key_hash', dimensions)
+    return list(dimensions)
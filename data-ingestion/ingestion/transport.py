@@ -0,0 +1,185 @@
+'''Shared HTTP transport with connection pooling, per-host limits and retries'''
+
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30.0
+DEFAULT_HOST_CONCURRENCY = 8
+# No rate limit by default, the concurrency limit bounds the load of a host
+DEFAULT_HOST_RATE = 0.0
+
+# Responses retried, after backing off
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Errors retried, after backing off
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+_lock = threading.Lock()
+
+# Transport shared by all sources of the process
+_transport = None
+
+
+def _env(name, default, cast=float):
+    return cast(os.environ.get(name, default))
+
+
+def _retry_after(response):
+    '''Seconds to wait from the Retry-After header, or None if not set'''
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Host():
+    '''Concurrency and rate limits of a single host.
+
+    Args:
+        concurrency (int): Maximum requests in flight.
+        rate (float): Maximum requests started per second, 0 for no limit.
+    '''
+    def __init__(self, concurrency, rate):
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        '''Wait for the next request start allowed by the rate limit'''
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class Transport():
+    '''HTTP transport shared by all sources of a process.
+
+    Requests go through a single session, so connections to a host are
+    kept alive and pooled across sources and threads. Requests in flight
+    and started per second are limited per host. Transient failures
+    (connection errors, timeouts, 429 and 5xx responses) are retried with
+    exponential backoff and full jitter, honouring Retry-After. Counts of
+    requests, retries, errors and bytes downloaded are kept in stats.
+
+    kwargs:
+        timeout (float): Seconds to wait to connect and between bytes.
+            Defaults to the HTTP_TIMEOUT environment variable, or 30.
+        retries (int): Retries of a request. Defaults to HTTP_RETRIES, or 5.
+        backoff (float): Seconds of the first backoff, doubled per retry.
+            Defaults to HTTP_BACKOFF, or 0.5.
+        max_backoff (float): Maximum seconds of a backoff.
+        host_concurrency (int): Maximum requests in flight per host.
+            Defaults to HTTP_HOST_CONCURRENCY, or 8.
+        host_rate (float): Maximum requests started per second per host,
+            0 for no limit. Defaults to HTTP_HOST_RATE, or no limit.
+    '''
+    def __init__(self, timeout=None, retries=None, backoff=None,
+                 max_backoff=DEFAULT_MAX_BACKOFF, host_concurrency=None,
+                 host_rate=None):
+        self.timeout = timeout or _env('HTTP_TIMEOUT', DEFAULT_TIMEOUT)
+        self.retries = retries if retries is not None \
+            else _env('HTTP_RETRIES', DEFAULT_RETRIES, int)
+        self.backoff = backoff if backoff is not None \
+            else _env('HTTP_BACKOFF', DEFAULT_BACKOFF)
+        self.max_backoff = max_backoff
+        self.host_concurrency = host_concurrency or _env(
+            'HTTP_HOST_CONCURRENCY', DEFAULT_HOST_CONCURRENCY, int
+        )
+        self.host_rate = host_rate if host_rate is not None \
+            else _env('HTTP_HOST_RATE', DEFAULT_HOST_RATE)
+        self.session = requests.Session()
+        # A pooled connection per request in flight to a host
+        adapter = HTTPAdapter(pool_maxsize=self.host_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.stats = {'requests': 0, 'retries': 0, 'errors': 0, 'bytes': 0}
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = _Host(self.host_concurrency, self.host_rate)
+            return self._hosts[host]
+
+    def _count(self, field, value=1):
+        with self._lock:
+            self.stats[field] += value
+
+    def _sleep(self, attempt, response=None):
+        '''Back off before a retry, for at least any Retry-After'''
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if response is not None:
+            delay = max(delay, min(self.max_backoff, _retry_after(response) or 0))
+        time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        '''GET a URL within the limits of its host, retrying transient
+        failures.
+
+        Args:
+            url (str): URL to request.
+        kwargs:
+            Passed on to requests, with the default timeout.
+        Returns requests.Response, with the retries made in retries.
+        Raises the last error once retries are exhausted.
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        host = self._host(url)
+        attempt = 0
+        while True:
+            response, error = None, None
+            with host.slots:
+                host.wait()
+                try:
+                    response = self.session.get(url, **kwargs)
+                except RETRY_ERRORS as e:
+                    error = e
+            self._count('requests')
+            if response is not None:
+                self._count('bytes', len(response.content))
+                if response.status_code not in RETRY_STATUSES:
+                    response.retries = attempt
+                    return response
+            if attempt >= self.retries:
+                self._count('errors')
+                if error is not None:
+                    raise error
+                response.retries = attempt
+                return response
+            reason = error if error is not None else f'HTTP {response.status_code}'
+            logging.debug(f'Retrying {url} after {reason} (attempt {attempt + 1})')
+            self._count('retries')
+            self._sleep(attempt, response)
+            attempt += 1
+
+
+def get_transport():
+    '''Transport shared by all sources of the process, created on first use'''
+    global _transport
+    with _lock:
+        if _transport is None:
+            _transport = Transport()
+        return _transport
@@ -0,0 +1,68 @@
+'''Validation of processed data against declared schemas'''
+
+import logging
+import re
+import time
+import pandera as pa
+
+# Validation modes: full, sample:N rows, head rows or off
+VALIDATION_MODES = r'^(full|head|off|sample:\d+)$'
+HEAD_ROWS = 1000
+
+
+def coerce(df, schema):
+    '''Filter and coerce a dataframe to a schema without running checks.
+    Returns dataframe.
+    '''
+    if schema.strict == 'filter':
+        df = df[[col for col in df.columns if col in schema.columns]]
+    df = df.copy()
+    for name, column in schema.columns.items():
+        if (column.coerce or schema.coerce) and name in df.columns:
+            df[name] = column.coerce_dtype(df[name])
+    return df
+
+
+def validate(df, schema, mode='full'):
+    '''Validate a dataframe against a schema, column by column.
+
+    Type coercion is always applied to the whole dataframe, while the
+    checks run on the rows selected by the mode.
+
+    Args:
+        df (pd.DataFrame): Dataframe to validate.
+        schema (pa.DataFrameSchema): Schema to validate against.
+    kwargs:
+        mode (str): One of full, sample:N, head or off.
+    Returns validated dataframe and dict of seconds taken per column check.
+    Raises ValueError for an invalid mode.
+    '''
+    if not re.match(VALIDATION_MODES, mode):
+        raise ValueError(f'Invalid validation mode: {mode}')
+    timings = {}
+    start = time.perf_counter()
+    df = coerce(df, schema)
+    timings['coerce'] = time.perf_counter() - start
+    if mode == 'off':
+        return df, timings
+    if mode == 'head':
+        rows = df.head(HEAD_ROWS)
+    elif mode.startswith('sample:'):
+        n = int(mode.split(':')[1])
+        rows = df.sample(min(n, len(df)), random_state=0)
+    else:
+        rows = df
+    for name, column in schema.columns.items():
+        start = time.perf_counter()
+        column.validate(rows, inplace=True)
+        timings[name] = time.perf_counter() - start
+    if schema.checks:
+        start = time.perf_counter()
+        pa.DataFrameSchema(checks=schema.checks).validate(rows)
+        timings['dataframe checks'] = time.perf_counter() - start
+    slowest = sorted(timings.items(), key=lambda x: -x[1])[:3]
+    logging.debug(
+        f'Validated {len(rows)}/{len(df)} rows ({mode}), slowest checks: '
+        + ', '.join(f'{k} {v:.3f}s' for k, v in slowest)
+    )
+    return df, timings
@@ -1,39 +1,247 @@
 '''Main Script'''
 import argparse
+import cProfile
+import os
+import re
+import subprocess
+import sys
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 from marshmallow.fields import Nested, String
 from marshmallow.schema import Schema
 from importlib import import_module
 from ingestion import IngestSchema, logging
+from ingestion.backfill import PARTITION_FREQS, backfill, parse_range
+from ingestion.metrics import (
+    measure,
+    measure_chunks,
+    source_record,
+    write_json_lines,
+    write_prometheus,
+)
+from ingestion.scheduler import Job, Scheduler, parse_interval
 
 class Configuration(Schema):
     module = String(required=True)
     cfg = Nested(IngestSchema, required=True)
+    # Refresh interval in daemon mode, e.g. 30m or 6h
+    interval = String()
 
 FILEPATH = 'ingestion/data/{name}'
 
-def main(args):
-    # Get config
+def stream_source(engine, name, stages):
+    '''Retrieve, process, validate and save a source chunk by chunk'''
+    chunks = measure_chunks(engine.retrieve_chunks(), stages, 'retrieve')
+    chunks = measure_chunks(engine.process_chunks(chunks), stages, 'process')
+    chunks = measure_chunks(map(engine.validate, chunks), stages, 'validate')
+    save = {}
+    with measure(save, 'save') as record:
+        record['rows_out'] = engine.save_chunks(chunks, name=name)
+    # Time spent in upstream stages is excluded from the save time
+    for field in ('wall_seconds', 'cpu_seconds'):
+        record[field] -= sum(stages[stage][field] for stage in stages)
+    stages['save'] = record
+    if not record['rows_out']:
+        logging.info(f'No new data for {name}, skipping.')
+
+def run_source(engine, name, stages):
+    '''Retrieve, process, validate and save a single config entry.
+
+    Args:
+        engine (BaseIngest): Ingest class of the source.
+        name (str): Name of the sink.
+        stages (dict): Filled with the metrics per stage.
+    '''
+    if engine.cfg['streaming']:
+        return stream_source(engine, name, stages)
+    # Retrieve
+    with measure(stages, 'retrieve') as record:
+        df = engine.retrieve()
+        record['rows_out'] = len(df)
+    if df.empty:
+        logging.info(f'No new data for {name}, skipping.')
+        return
+    # Process, unless the raw data was processed before
+    with measure(stages, 'process') as record:
+        cached = engine.cached_result()
+        df = engine.process(df) if cached is None else cached
+        record['rows_out'] = len(df)
+    # Validate
+    with measure(stages, 'validate') as record:
+        if cached is None:
+            df = engine.validate(df)
+            engine.cache_result(df)
+        record['rows_out'] = len(df)
+    # Save
+    with measure(stages, 'save') as record:
+        record['rows_out'] = engine.save(df, name=name)
+
+def profile_path(path, name):
+    '''Path of the profile stats of a source'''
+    return os.path.join(path, re.sub(r'[^\w.-]', '_', name) + '.prof')
+
+def run_config(module, cfg, args):
+    '''Run a config entry, recording its metrics and optionally profiling it.
+    Returns the metrics record of the source.
+    '''
+    name = cfg['sink']['name']
+    stages, engine, error = {}, None, None
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        # Ensure that the Ingest class inherits from the BaseIngest
+        engine = module.Ingest(cfg)
+        run_source(engine, name, stages)
+    except Exception as e:
+        logging.exception(f'Ingestion of {name} failed')
+        error = e
+    finally:
+        if profiler:
+            profiler.disable()
+            os.makedirs(args.profile, exist_ok=True)
+            path = profile_path(args.profile, name)
+            profiler.dump_stats(path)
+            logging.info(f'Saved profile of {name} to {path}')
+    return source_record(
+        name,
+        module.__name__.split('.')[-1],
+        stages,
+        http=engine.http if engine else None,
+        changes=engine.changes if engine else None,
+        error=error,
+    )
+
+def report(records):
+    '''Log a summary of each source run'''
+    logging.info('Summary:')
+    for record in records:
+        name = record['source']
+        stages = ', '.join(
+            f"{k} {v['wall_seconds']:.1f}s/{v['rows_out']} rows"
+            for k, v in record['stages'].items()
+        )
+        requests = f"{record['http_requests'] or 0} requests, {record['http_retries'] or 0} retries, {(record['http_bytes'] or 0) / 1024 ** 2:.1f}MB"
+        if record['changes']:
+            requests += ', ' + ', '.join(f'{v} {k}' for k, v in record['changes'].items())
+        if record['error']:
+            logging.info(f"  FAILED {name} ({record['error']}) ({stages}; {requests})")
+        else:
+            total = sum(v['wall_seconds'] for v in record['stages'].values())
+            logging.info(f'  OK     {name} {total:.1f}s ({stages}; {requests})')
+
+def load_config(args):
+    '''Load the config entries and import their modules, applying the
+    overrides of the command line.
+    Returns list of entries and dict of modules by name.
+    '''
     with open(args.config) as f:
         config = yaml.safe_load(f)
+    # Import modules up front so imports are not raced between threads
+    modules = {
+        i['module']: import_module(f'.{i["module"]}', package='sources')
+        for i in config
+    }
     for i in config:
-        module = import_module(f'.{i["module"]}', package='sources')
-        # Ensure that the Ingest class inherits from the BaseIngest
-        engine = module.Ingest(i['cfg'])
-        name = i['cfg']['sink']['name']
-        # Retrieve
-        df = engine.retrieve()
-        # Process
-        df = engine.process(df)
-        # Validate
-        df = engine.validate(df)
-        # Save
-        engine.save(df, name=name)
+        if args.validation:
+            i['cfg']['validation'] = args.validation
+        if args.stream:
+            i['cfg']['streaming'] = True
+        if args.no_cache:
+            i['cfg']['cache'] = False
+    return config, modules
+
+def post_run(command, record):
+    '''Run the post run command after a source saved data, with the name
+    of the source in HERD_SOURCE.
+    '''
+    save = record['stages'].get('save')
+    if not command or record['error'] or not save or not save['rows_out']:
+        return
+    result = subprocess.run(
+        command,
+        shell=True,
+        env={**os.environ, 'HERD_SOURCE': record['source']},
+    )
+    if result.returncode:
+        logging.error(f"Post run command failed for {record['source']} ({result.returncode})")
+
+def main(args):
+    config, modules = load_config(args)
+    # Profiles of concurrent sources would overlap
+    workers = 1 if args.profile else args.workers
+    # Run sources concurrently, a failing source does not stop the rest
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_config, modules[i['module']], i['cfg'], args)
+            for i in config
+        ]
+        records = [future.result() for future in futures]
+    report(records)
+    if args.metrics:
+        write_json_lines(args.metrics, records)
+    if args.prometheus:
+        write_prometheus(args.prometheus, records)
+    for record in records:
+        post_run(args.post_run, record)
+    return records
+
+def daemon(args):
+    '''Run each config entry at its refresh interval until stopped.
+
+    Modules, the HTTP transport and caches, the LGA to LHD map and
+    database engines stay loaded between runs.
+    '''
+    config, modules = load_config(args)
+    default_interval = parse_interval(args.interval)
+    # Latest record per source, for the Prometheus textfile
+    latest = {}
+
+    def on_done(job, record):
+        report([record])
+        latest[record['source']] = record
+        if args.metrics:
+            write_json_lines(args.metrics, [record])
+        if args.prometheus:
+            write_prometheus(args.prometheus, list(latest.values()))
+        post_run(args.post_run, record)
+
+    jobs = []
+    for i in config:
+        interval = parse_interval(i['interval']) if i.get('interval') else default_interval
+        jobs.append(Job(
+            i['cfg']['sink']['name'],
+            interval,
+            lambda i=i: run_config(modules[i['module']], i['cfg'], args),
+        ))
+        logging.info(f"Scheduled {i['cfg']['sink']['name']} every {interval:.0f}s")
+    if not jobs:
+        logging.info('No sources configured.')
+        return
+    Scheduler(
+        jobs,
+        workers=1 if args.profile else args.workers,
+        jitter=args.jitter,
+        on_done=on_done,
+    ).run()
 
 if __name__=='__main__':
     # Parse arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', type=str, help='Path to config file.', required=True)
+    parser.add_argument('--workers', type=int, default=4, help='Number of sources to run concurrently.')
+    parser.add_argument('--validation', type=str, help='Validation mode for all sources: full, sample:N, head or off.')
+    parser.add_argument('--stream', action='store_true', help='Stream all sources in bounded size chunks.')
+    parser.add_argument('--no-cache', action='store_true', help='Process all sources again instead of serving results from the result cache.')
+    parser.add_argument('--metrics', type=str, help='Append metrics per source to a JSON lines file.')
+    parser.add_argument('--prometheus', type=str, help='Write metrics per source to a Prometheus textfile.')
+    parser.add_argument('--profile', type=str, help='Profile each source into a folder of cProfile stats, one source at a time.')
+    parser.add_argument('--post-run', type=str, help='Shell command run after each source that saved data, with HERD_SOURCE set.')
+    parser.add_argument('--daemon', action='store_true', help='Keep running, refreshing each source at its interval.')
+    parser.add_argument('--interval', type=str, default='1h', help='Refresh interval of sources without an interval in daemon mode, e.g. 30m or 6h.')
+    parser.add_argument('--jitter', type=float, default=0.1, help='Fraction of the interval to randomly move start times by in daemon mode.')
+    parser.add_argument('--backfill', type=str, help='Rebuild the history of START:END (ISO dates, END included) in date partitions across worker processes, resuming an interrupted backfill.')
+    parser.add_argument('--partition', type=str, default='month', choices=list(PARTITION_FREQS), help='Date partitions of a backfill.')
     parser.add_argument('--debug', action='store_true')
     args = parser.parse_args()
     # Set logging level
@@ -42,4 +250,19 @@ if __name__=='__main__':
     else:
         logging.basicConfig(level=logging.INFO)
     # Run main logic
-    main(args)
+    if args.backfill:
+        config, modules = load_config(args)
+        failed = backfill(
+            config,
+            modules,
+            parse_range(args.backfill),
+            partition_by=args.partition,
+            workers=args.workers,
+        )
+        sys.exit(1 if failed else 0)
+    if args.daemon:
+        daemon(args)
+        sys.exit(0)
+    records = main(args)
+    if any(record['error'] for record in records):
+        sys.exit(1)
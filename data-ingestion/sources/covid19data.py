@@ -1,26 +1,115 @@
 '''Data downloaded from COVID-19 Data GitHub repo'''
 
-import requests
 import pandas as pd
 import pandera as pa
 import io
 from datetime import datetime
-from marshmallow.fields import Nested, String
+from marshmallow.fields import Integer, Nested, String
 
 from ingestion import (
     BaseIngest,
     logging,
     SourceSchema,
     IngestSchema,
-    BASE_PROCESSED_SCHEMA
+    BASE_PROCESSED_SCHEMA,
+    apply_transforms,
+    clean_label,
+    dimension_column,
+    key_dimensions,
+    parse_range,
 )
 
 from .utils import STATE_NAMES
 
 
+# Raw dimension columns, read as categoricals
+CATEGORIES = ['state', 'state_abbrev', 'gender', 'age_bracket']
+
+# Transform steps per file
+TRANSFORMS = {
+    'COVID_AU_state.csv': [
+        {'rename': {
+            'state': 'state_name',
+            'state_abbrev': 'state_code',
+        }},
+        {'constant': {'country': 'Australia'}},
+        {'key_hash': [
+            'date',
+            'state_name',
+            'state_code',
+            'country',
+        ]},
+    ],
+    'COVID_AU_deaths.csv': [
+        {'rename': {
+            'state': 'state_code',
+            'gender': 'sex',
+        }},
+        {'map': {'state_name': ('state_code', STATE_NAMES)}},
+        {'derive': {
+            'age_group': lambda df: parse_range(df['age_bracket']),
+            'sex': lambda df: clean_label(df['sex'], remove='*', missing='Unknown'),
+            # Backfill age from the lower bound of the age bracket
+            'age': lambda df: df['age'].fillna(df['age_group'].str[0]),
+        }},
+        {'categorize': ['sex']},
+        {'constant': {
+            'deaths': 1,
+            'country': 'Australia',
+        }},
+        {'key_hash': [
+            'date',
+            'state_name',
+            'state_code',
+            # 'age_group',
+            'age',
+            'sex',
+            'country',
+        ]},
+    ],
+}
+
+# Validation schemas per file
+SCHEMAS = {
+    'COVID_AU_state.csv': BASE_PROCESSED_SCHEMA.add_columns({
+        # Dimensions
+        "date": pa.Column(datetime),
+        "state_name": dimension_column(),
+        "state_code": dimension_column(),
+        "country": dimension_column(),
+        # Measures
+        "confirmed": pa.Column(int, nullable=True, coerce=True),
+        "deaths": pa.Column(int, nullable=True, coerce=True),
+        "tests": pa.Column(int, nullable=True, coerce=True),
+        "positives": pa.Column(int, nullable=True, coerce=True),
+        "recovered": pa.Column(int, nullable=True, coerce=True),
+        "hosp": pa.Column(int, nullable=True, coerce=True),
+        "icu": pa.Column(int, nullable=True, coerce=True),
+        "vent": pa.Column(int, nullable=True, coerce=True),
+        "vaccines": pa.Column(int, nullable=True, coerce=True),
+        "hosp_cum": pa.Column(int, nullable=True, coerce=True),
+        "icu_cum": pa.Column(int, nullable=True, coerce=True),
+        "vent_cum": pa.Column(int, nullable=True, coerce=True),
+    }),
+    'COVID_AU_deaths.csv': BASE_PROCESSED_SCHEMA.add_columns({
+        # Dimensions
+        "date": pa.Column(datetime),
+        "state_name": dimension_column(),
+        "state_code": dimension_column(),
+        "country": dimension_column(),
+        "age_group": pa.Column(object, nullable=True, coerce=True),
+        "sex": dimension_column(nullable=True),
+        # Measures
+        "deaths": pa.Column(int, nullable=True, coerce=True),
+        "age": pa.Column(float, nullable=True, coerce=True),
+    }),
+}
+
+
 class SourceSchema(SourceSchema):
     '''Schema for source'''
     filename = String(required=True)
+    chunk_rows = Integer(default=50000, missing=50000)
 
 
 class IngestSchema(IngestSchema):
@@ -35,115 +124,80 @@ class Ingest(BaseIngest):
         super().__init__(cfg)
         self.cfg = IngestSchema().load(cfg)
 
-    def retrieve(self):
-        '''Retrieve data'''
-        # Parse config
+    def _get(self):
+        '''Request the file.
+        Returns the response, or None if unchanged since the last run.
+        '''
         filename = self.cfg['source']['filename']
         logging.info(f'Retrieving data from {filename}')
-        # Make request
-        response = requests.get(
+        response = self.http.get(
             f'https://raw.githubusercontent.com/M3IT/COVID-19_Data/master/Data/{filename}'
         )
-        df = pd.read_csv(io.StringIO(response.content.decode('utf-8')))
+        if self.is_unchanged(response):
+            logging.info(f'No change in {filename}')
+            return None
+        return response
+
+    def _new_rows(self, df):
+        '''Parse dates and only keep new dates, or the dates of a backfill
+        partition (the file is only published in full).
+        '''
         df['date'] = pd.to_datetime(df['date'])
+        watermark = self.get_watermark()
+        if watermark:
+            df = df[df['date'] > pd.Timestamp(watermark)]
+        return self.filter_date_range(df)
+
+    def prepare_backfill(self):
+        '''Download the file once for all partitions'''
+        self._get()
+
+    def retrieve(self):
+        '''Retrieve data'''
+        response = self._get()
+        if response is None:
+            return pd.DataFrame()
+        df = self._new_rows(pd.read_csv(
+            io.BytesIO(response.content),
+            dtype=dict.fromkeys(CATEGORIES, 'category'),
+        ))
+        if not df.empty:
+            self.set_watermark(df['date'].max().isoformat())
         # Return dataframe
         return df
 
+    def retrieve_chunks(self):
+        '''Retrieve data, parsing the file in chunks of rows'''
+        response = self._get()
+        if response is None:
+            return
+        latest = None
+        for df in pd.read_csv(
+            io.BytesIO(response.content),
+            dtype=dict.fromkeys(CATEGORIES, 'category'),
+            chunksize=self.cfg['source']['chunk_rows'],
+        ):
+            df = self._new_rows(df)
+            if df.empty:
+                continue
+            latest = max(filter(None, [latest, df['date'].max()]))
+            yield df
+        if latest is not None:
+            self.set_watermark(latest.isoformat())
+
     def process(self, df):
         '''Process and validate data'''
         filename = self.cfg['source']['filename']
         logging.info(f'Processing data from {filename}')
-        if filename == 'COVID_AU_state.csv':
-            # Rename fields
-            df = df.rename(columns={
-                'state': 'state_name',
-                'state_abbrev': 'state_code',
-            })
-            # Add fields
-            df['country'] = 'Australia'
-            df['dimensions_id'] = df.apply(
-                lambda x: hash(
-                    tuple([
-                        x.date,
-                        x.state_name,
-                        x.state_code,
-                        x.country,
-                    ])
-                ),
-                axis=1
-            )
-        elif filename == 'COVID_AU_deaths.csv':
-            # Rename fields
-            df = df.rename(columns={
-                'state': 'state_code',
-                'gender': 'sex',
-            })
-            # Transform fields
-            df['state_name'] = df['state_code'].apply(lambda x: STATE_NAMES[x])
-            df['age_group'] = df.apply(
-                lambda x: tuple(int(d or 0) for d in x['age_bracket'].strip().split('-')) \
-                    if not pd.isnull(x['age_bracket']) else None,
-                axis=1
-            )
-            df['sex'] = df['sex'].apply(lambda x: x.replace('*', '') if not pd.isnull(x) else 'Unknown')
-            df['age'] = df.apply(lambda x: x['age'] if not pd.isnull(x['age']) else x['age_group'][0] if x['age_group'] is not None else None, axis=1)
-            # Add fields
-            df['deaths'] = 1
-            df['country'] = 'Australia'
-            df['dimensions_id'] = df.apply(
-                lambda x: hash(
-                    tuple([
-                        x.date,
-                        x.state_name,
-                        x.state_code,
-                        # x.age_group,
-                        x.age,
-                        x.sex,
-                        x.country
-                    ])
-                ),
-                axis=1
-            )
-        # Return dataframe
-        return df
+        if filename not in TRANSFORMS:
+            return df
+        return apply_transforms(df, TRANSFORMS[filename])
 
     def validate(self, df):
         filename = self.cfg['source']['filename']
         logging.info(f'Validating data from {filename}')
-        if filename == 'COVID_AU_state.csv':
-            schema = BASE_PROCESSED_SCHEMA.add_columns({
-                # Dimensions
-                "date": pa.Column(datetime),
-                "state_name": pa.Column(str),
-                "state_code": pa.Column(str),
-                "country": pa.Column(str),
-                # Measures
-                "confirmed": pa.Column(int, nullable=True, coerce=True),
-                "deaths": pa.Column(int, nullable=True, coerce=True),
-                "tests": pa.Column(int, nullable=True, coerce=True),
-                "positives": pa.Column(int, nullable=True, coerce=True),
-                "recovered": pa.Column(int, nullable=True, coerce=True),
-                "hosp": pa.Column(int, nullable=True, coerce=True),
-                "icu": pa.Column(int, nullable=True, coerce=True),
-                "vent": pa.Column(int, nullable=True, coerce=True),
-                "vaccines": pa.Column(int, nullable=True, coerce=True),
-                "hosp_cum": pa.Column(int, nullable=True, coerce=True),
-                "icu_cum": pa.Column(int, nullable=True, coerce=True),
-                "vent_cum": pa.Column(int, nullable=True, coerce=True),
-            })
-            df = schema(df)
-        elif filename == 'COVID_AU_deaths.csv':
-            schema = BASE_PROCESSED_SCHEMA.add_columns({
-                # Dimensions
-                "date": pa.Column(datetime),
-                "state_name": pa.Column(str),
-                "state_code": pa.Column(str),
-                "country": pa.Column(str),
-                "age_group": pa.Column(object, nullable=True, coerce=True),
-                "sex": pa.Column(str, nullable=True, coerce=True),
-                # Measures
-                "deaths": pa.Column(int, nullable=True, coerce=True),
-                "age": pa.Column(float, nullable=True, coerce=True),
-            })
-            df = schema(df)
-        return df
+        return self.validate_schema(
+            df,
+            SCHEMAS.get(filename),
+            dimensions=key_dimensions(TRANSFORMS.get(filename, [])),
+        )
@@ -1,19 +1,25 @@
 '''Script to ingest data from NSW Government'''
 
-import re
-import requests
+import numpy as np
 import pandas as pd
 import pandera as pa
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from marshmallow.fields import Nested, String
-from copy import deepcopy
+from urllib.parse import urlencode
+from marshmallow.fields import Integer, Nested, String
 
 from ingestion import (
     BaseIngest,
     logging,
     SourceSchema,
     IngestSchema,
-    BASE_PROCESSED_SCHEMA
+    BASE_PROCESSED_SCHEMA,
+    apply_transforms,
+    dimension_column,
+    key_dimensions,
+    parse_digits,
 )
 
 RESOURCES = {
@@ -22,10 +28,198 @@ RESOURCES = {
     'cases_by_age_range': '24b34cb5-8b01-4008-9d93-d14cf5518aec',
 }
 
+SQL_URL = 'https://data.nsw.gov.au/data/api/3/action/datastore_search_sql'
+
+# Raw columns needed per resource
+COLUMNS = {
+    'tests_by_location': [
+        'test_date',
+        'postcode',
+        'lhd_2010_code',
+        'lhd_2010_name',
+        'lga_code19',
+        'lga_name19',
+        'test_count',
+    ],
+    'cases_by_location': [
+        'notification_date',
+        'lhd_2010_code',
+        'lhd_2010_name',
+        'lga_code19',
+        'lga_name19',
+    ],
+    'cases_by_age_range': [
+        'notification_date',
+        'age_group',
+    ],
+}
+
+# Raw dimension columns, held as categoricals from retrieval
+CATEGORIES = [
+    'postcode',
+    'lhd_2010_code',
+    'lhd_2010_name',
+    'lga_code19',
+    'lga_name19',
+    'age_group',
+]
+
+# Raw measure columns, held in float64 buffers from retrieval. Dates are
+# kept as strings, as they are hashed into dimensions_id before to_datetime
+NUMBERS = [
+    'test_count',
+]
+
+LOCATION_DIMENSIONS = [
+    'date',
+    'lhd_code',
+    'lhd_name',
+    'lga_code',
+    'lga_name',
+    'state_code',
+    'state_name',
+    'country',
+]
+
+# Transform steps for all resources
+BASE_TRANSFORMS = [
+    {'drop': ['_id', '_full_text']},
+    {'constant': {
+        'state_name': 'New South Wales',
+        'state_code': 'NSW',
+        'country': 'Australia',
+    }},
+    {'rename': {
+        'lhd_2010_code': 'lhd_code',
+        'lhd_2010_name': 'lhd_name',
+        'lga_code19': 'lga_code',
+        'lga_name19': 'lga_name',
+    }},
+    {'categorize': ['postcode', 'lhd_code', 'lhd_name', 'lga_code', 'lga_name']},
+]
+
+# Transform steps per resource
+TRANSFORMS = {
+    'tests_by_location': [
+        {'rename': {
+            'test_date': 'date',
+            'test_count': 'tests',
+        }},
+        {'key_hash': LOCATION_DIMENSIONS},
+    ],
+    'cases_by_location': [
+        {'rename': {'notification_date': 'date'}},
+        {'group_count': {'by': LOCATION_DIMENSIONS, 'name': 'cases'}},
+        {'key_hash': LOCATION_DIMENSIONS},
+    ],
+    'cases_by_age_range': [
+        {'rename': {'notification_date': 'date'}},
+        {'derive': {
+            'age_group': lambda df: parse_digits(df['age_group']),
+        }},
+        {'group_count': {
+            'by': ['date', 'age_group', 'state_code', 'state_name', 'country'],
+            'name': 'cases',
+        }},
+        {'key_hash': [
+            'date',
+            'age_group',
+            'state_code',
+            'state_name',
+            'country',
+        ]},
+    ],
+}
+
+FINAL_TRANSFORMS = [
+    {'to_datetime': ['date']},
+    {'replace': {'None': None}},
+]
+
+# Validation schemas per resource
+SCHEMAS = {
+    'tests_by_location': BASE_PROCESSED_SCHEMA.add_columns({
+        # Dimensions
+        "date": pa.Column(datetime),
+        "postcode": dimension_column(nullable=True),
+        "lhd_code": dimension_column(),
+        "lhd_name": dimension_column(),
+        "lga_code": dimension_column(),
+        "lga_name": dimension_column(),
+        "state_name": dimension_column(),
+        "state_code": dimension_column(),
+        "country": dimension_column(),
+        "dimensions_id": pa.Column(int),
+        # Measures
+        "tests": pa.Column(int, nullable=True, coerce=True),
+    }),
+    'cases_by_location': BASE_PROCESSED_SCHEMA.add_columns({
+        # Dimensions
+        "date": pa.Column(datetime),
+        "lhd_code": dimension_column(),
+        "lhd_name": dimension_column(),
+        "lga_code": dimension_column(),
+        "lga_name": dimension_column(),
+        "state_name": dimension_column(),
+        "state_code": dimension_column(),
+        "country": dimension_column(),
+        "dimensions_id": pa.Column(int),
+        # Measures
+        "cases": pa.Column(int, nullable=True, coerce=True),
+    }),
+    'cases_by_age_range': BASE_PROCESSED_SCHEMA.add_columns({
+        # Dimensions
+        "date": pa.Column(datetime),
+        "state_name": dimension_column(),
+        "state_code": dimension_column(),
+        "country": dimension_column(),
+        "age_group": pa.Column(object),
+        "dimensions_id": pa.Column(int),
+        # Measures
+        "cases": pa.Column(int, nullable=True, coerce=True),
+    }),
+}
+
+
+def column_buffer(col):
+    '''Empty buffer of a raw column, a float64 array for measures.'''
+    return array('d') if col in NUMBERS else []
+
+
+def extend_buffer(buffer, values):
+    '''Appends a page of values to a column buffer, missing measures as NaN.'''
+    if isinstance(buffer, array):
+        buffer.frombytes(np.array(values, dtype='float64').tobytes())
+    else:
+        buffer.extend(values)
+
+
+def records_frame(ids, columns):
+    '''Dataframe of datastore records, with dimensions as categoricals.
+
+    Args:
+        ids (array): Record _ids.
+        columns (dict): Buffers of values by raw column name.
+    Returns dataframe.
+    '''
+    def column(col, values):
+        if col in CATEGORIES:
+            return pd.Categorical(values)
+        if col in NUMBERS:
+            return np.frombuffer(values, dtype='float64')
+        return values
+
+    return pd.DataFrame({
+        '_id': np.frombuffer(ids, dtype='int64'),
+        **{col: column(col, values) for col, values in columns.items()},
+    })
+
 
 class SourceSchema(SourceSchema):
     '''Schema for source'''
     resource_type = String(required=True)
+    page_size = Integer(default=10000, missing=10000)
+    workers = Integer(default=4, missing=4)
 
 
 class IngestSchema(IngestSchema):
@@ -39,198 +233,178 @@ class Ingest(BaseIngest):
         super().__init__(cfg)
         self.cfg = IngestSchema().load(cfg)
 
-    def retrieve(self):
-        '''Get raw data from NSW Government.
+    def _query(self, sql):
+        '''Run a datastore SQL query.
+        Returns the response and the query result.
+        '''
+        response = self.http.get(f'{SQL_URL}?{urlencode({"sql": sql})}')
+        return response, response.json()['result']
+
+    def _pages(self):
+        '''Request pages of records added since the last run.
+
+        The _id range of the resource is split into pages, which are
+        requested concurrently and paginated by _id keyset. At most a
+        window of pages is requested ahead of the consumer.
+
+        Yields the responses and records of each page, in _id order.
         '''
         resource_type = self.cfg['source']['resource_type']
-        data = []
-        def recursive_get_data(sql_statement=None):
-            '''Recursive function to get data'''
-            logging.info(f'Retrieving data from {resource_type}')
-            resource_id = RESOURCES[resource_type]
-            # Construct SQL statement
-            if not sql_statement:
-                sql_statement = f'''
-                SELECT * FROM "{resource_id}"
-                '''
-            # Make request
-            url = f'https://data.nsw.gov.au/data/api/3/action/datastore_search_sql?sql={sql_statement}'
-            response = requests.get(url)
-            response.raise_for_status()
-            # Get json response
-            j = response.json()
-            records = j['result']['records']
-            for record in records:
-                yield record
-            # Check if results are truncated
-            if j['result'].get('records_truncated'):
+        page_size = self.cfg['source']['page_size']
+        resource_id = RESOURCES[resource_type]
+        # Only retrieve records added since the last run
+        watermark = self.get_watermark()
+        condition = 'TRUE'
+        if watermark is not None:
+            if resource_type == 'tests_by_location':
+                condition = f'_id > {int(watermark)}'
+            else:
+                # Counts are aggregated per date, so recount every date with new records
+                condition = f'''notification_date >= (
+                    SELECT MIN(notification_date) FROM "{resource_id}"
+                    WHERE _id > {int(watermark)}
+                )'''
+        # Only retrieve records of the dates of a backfill partition
+        if self.date_range:
+            date_column = COLUMNS[resource_type][0]
+            start, end = self.date_range
+            condition = (
+                f"{date_column} >= '{start:%Y-%m-%d}' "
+                f"AND {date_column} < '{end:%Y-%m-%d}'"
+            )
+        # Get _id range
+        response, result = self._query(f'''
+            SELECT MIN(_id) AS min_id, MAX(_id) AS max_id FROM "{resource_id}"
+            WHERE {condition}
+        ''')
+        yield [response], []
+        bounds = result['records'][0]
+        if bounds['min_id'] is None:
+            return
+        min_id, max_id = int(bounds['min_id']) - 1, int(bounds['max_id'])
+        id_ranges = [
+            (start, min(start + page_size, max_id))
+            for start in range(min_id, max_id, page_size)
+        ]
+        columns = ['_id', *COLUMNS[resource_type]]
+        def get_page(id_range):
+            '''Get records with _id in (start, end], following truncated results'''
+            start, end = id_range
+            page_responses, records = [], []
+            while start < end:
+                response, result = self._query(f'''
+                    SELECT {', '.join(columns)} FROM "{resource_id}"
+                    WHERE _id > {start} AND _id <= {end} AND {condition}
+                    ORDER BY _id LIMIT {page_size}
+                ''')
+                page_responses.append(response)
+                records.extend(result['records'])
+                if not result.get('records_truncated') or not result['records']:
+                    break
                 logging.debug('Result truncated, still retrieving...')
-                # Get latest record
-                last_record = records[-1]
-                date_field = None
-                for k in last_record.keys():
-                    if 'date' in k:
-                        date_field = k
-                sql_statement = f'''
-                SELECT * FROM "{resource_id}"
-                WHERE {date_field} > '{last_record[date_field]}'
-                '''
-                for record in recursive_get_data(sql_statement):
-                    yield record
+                start = int(records[-1]['_id'])
+            return page_responses, records
+        workers = self.cfg['source']['workers']
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            window = deque()
+            for id_range in id_ranges:
+                window.append(executor.submit(get_page, id_range))
+                if len(window) > workers:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+
+    def retrieve(self):
+        '''Get raw data from NSW Government.'''
+        resource_type = self.cfg['source']['resource_type']
+        logging.info(f'Retrieving data from {resource_type}')
+        # Stream records of each page into column buffers
+        responses = []
+        columns = COLUMNS[resource_type]
+        ids = array('q')
+        buffers = {col: column_buffer(col) for col in columns}
+        for page_responses, records in self._pages():
+            responses.extend(page_responses)
+            ids.extend(int(record['_id']) for record in records)
+            for col in columns:
+                extend_buffer(buffers[col], [record.get(col) for record in records])
+        if self.is_unchanged(*responses):
+            logging.info(f'No change in {resource_type}')
+            return pd.DataFrame()
+        df = records_frame(ids, buffers)
+        if not df.empty:
+            self.set_watermark(int(df['_id'].max()))
         # Return dataframe
-        data = list(recursive_get_data())
-        return pd.DataFrame(data)
+        return df
+
+    def retrieve_chunks(self):
+        '''Get raw data from NSW Government, one page at a time.
+
+        Unlike retrieve, pages are not checked against the content hash of
+        the last run before being yielded, the hash is only staged.
+        '''
+        resource_type = self.cfg['source']['resource_type']
+        logging.info(f'Streaming data from {resource_type}')
+        hashes = []
+        max_id = None
+        for page_responses, records in self._pages():
+            hashes.extend(response.sha256 for response in page_responses)
+            if not records:
+                continue
+            ids = array('q', (int(record['_id']) for record in records))
+            max_id = max(ids) if max_id is None else max(max_id, max(ids))
+            buffers = {col: column_buffer(col) for col in COLUMNS[resource_type]}
+            for col, buffer in buffers.items():
+                extend_buffer(buffer, [record.get(col) for record in records])
+            yield records_frame(ids, buffers)
+        self.is_unchanged(*hashes)
+        if max_id is not None:
+            self.set_watermark(max_id)
 
     def process(self, df):
         '''Processes raw data from NSW Government.
         '''
-        # Drop fields
-        df = df.drop(['_id', '_full_text'], axis=1)
         resource_type = self.cfg['source']['resource_type']
-        logging.info(f'Retrieving data from {resource_type}')
-        # Add fields
-        df['state_name'] = 'New South Wales'
-        df['state_code'] = 'NSW'
-        df['country'] = 'Australia'
-        # Rename columns
-        df = df.rename(columns={
-            'lhd_2010_code': 'lhd_code',
-            'lhd_2010_name': 'lhd_name',
-            'lga_code19': 'lga_code',
-            'lga_name19': 'lga_name',
-        })
-        if resource_type == 'tests_by_location':
-            # Rename fields
-            df = df.rename(columns={
-                'test_date': 'date',
-                'test_count': 'tests',
-            })
-            df['dimensions_id'] = df.apply(
-                lambda x: hash(
-                    tuple([
-                        x.date,
-                        x.lhd_code,
-                        x.lhd_name,
-                        x.lga_code,
-                        x.lga_name,
-                        x.state_code,
-                        x.state_name,
-                        x.country,
-                    ])
-                ),
-                axis=1
-            )
-        elif resource_type == 'cases_by_location':
-            # Rename fields
-            df = df.rename(columns={'notification_date': 'date'})
-            # Add fields
-            df['cases'] = 1
-            df = df.groupby(by=[
-                'date',
-                'lhd_code',
-                'lhd_name',
-                'lga_code',
-                'lga_name',
-                'state_code',
-                'state_name',
-                'country',
-            ])['cases'].count().reset_index()
-            df['dimensions_id'] = df.apply(
-                lambda x: hash(
-                    tuple([
-                        x.date,
-                        x.lhd_code,
-                        x.lhd_name,
-                        x.lga_code,
-                        x.lga_name,
-                        x.state_code,
-                        x.state_name,
-                        x.country,
-                    ])
-                ),
-                axis=1
-            )
-        elif resource_type == 'cases_by_age_range':
-            # Rename fields
-            df = df.rename(columns={'notification_date': 'date'})
-            # Transform fields
-            df['age_group'] = df['age_group'].apply(
-                lambda x: tuple(re.findall(r'\d+', x))
-            )
-            # Add fields
-            df['cases'] = 1
-            df = df.groupby(
-                ['date', 'age_group', 'state_code', 'state_name', 'country']
-            )['cases'].count().reset_index()
-            df['dimensions_id'] = df.apply(
-                lambda x: hash(
-                    tuple([
-                        x.date,
-                        x.age_group,
-                        x.state_code,
-                        x.state_name,
-                        x.country,
-                    ])
-                ),
-                axis=1
-            )
-        else:
+        logging.info(f'Processing data from {resource_type}')
+        if resource_type not in TRANSFORMS:
             raise NotImplementedError(
                 f'Processing for resource type {resource_type} not implemented.'
             )
-        # Transform fields
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.replace('None', None)
-        # Return dataframe
-        return df
+        return apply_transforms(df, [
+            *BASE_TRANSFORMS,
+            *TRANSFORMS[resource_type],
+            *FINAL_TRANSFORMS,
+        ])
+
+    def process_chunks(self, chunks):
+        '''Process pages of raw data from NSW Government.
+
+        Tests are processed page by page. Cases are counted per page and
+        the partial counts summed per dimensions_id, so only the counts are
+        held in memory.
+        '''
+        resource_type = self.cfg['source']['resource_type']
+        if resource_type == 'tests_by_location':
+            yield from super().process_chunks(chunks)
+            return
+        df = None
+        for chunk in chunks:
+            counts = self.process(chunk)
+            if df is not None:
+                counts = pd.concat([df, counts], ignore_index=True)
+                counts['cases'] = counts.groupby('dimensions_id')['cases']\
+                    .transform('sum')
+                counts = counts.drop_duplicates('dimensions_id')
+            df = counts
+        if df is not None:
+            yield df
 
     def validate(self, df):
         '''Validate data'''
         resource_type = self.cfg['source']['resource_type']
         logging.info(f'Validating data from {resource_type}')
-        if resource_type == 'tests_by_location':
-            schema = BASE_PROCESSED_SCHEMA.add_columns({
-                # Dimensions
-                "date": pa.Column(datetime),
-                "lhd_code": pa.Column(str),
-                "lhd_name": pa.Column(str),
-                "lga_code": pa.Column(str),
-                "lga_name": pa.Column(str),
-                "state_name": pa.Column(str),
-                "state_code": pa.Column(str),
-                "country": pa.Column(str),
-                "dimensions_id": pa.Column(int),
-                # Measures
-                "tests": pa.Column(int, nullable=True, coerce=True),
-            })
-        elif resource_type == 'cases_by_location':
-            schema = BASE_PROCESSED_SCHEMA.add_columns({
-                # Dimensions
-                "date": pa.Column(datetime),
-                "lhd_code": pa.Column(str),
-                "lhd_name": pa.Column(str),
-                "lga_code": pa.Column(str),
-                "lga_name": pa.Column(str),
-                "state_name": pa.Column(str),
-                "state_code": pa.Column(str),
-                "country": pa.Column(str),
-                "dimensions_id": pa.Column(int),
-                # Measures
-                "cases": pa.Column(int, nullable=True, coerce=True),
-            })
-            df = schema(df)
-        elif resource_type == 'cases_by_age_range':
-            schema = deepcopy(BASE_PROCESSED_SCHEMA)
-            schema.add_columns({
-                # Dimensions
-                "date": pa.Column(datetime),
-                "state_name": pa.Column(str),
-                "state_code": pa.Column(str),
-                "country": pa.Column(str),
-                "age_group": pa.Column(str),
-                "dimensions_id": pa.Column(int),
-                # Measures
-                "cases": pa.Column(int, nullable=True, coerce=True),
-            })
-            df = schema(df)
-        return df
+        return self.validate_schema(
+            df,
+            SCHEMAS.get(resource_type),
+            dimensions=key_dimensions(TRANSFORMS.get(resource_type, [])),
+        )
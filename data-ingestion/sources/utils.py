@@ -1,5 +1,13 @@
 '''Util variables and functions'''
 
+import os
+import threading
+import time
+from datetime import timedelta
+import pandas as pd
+
+from ingestion import logging
+
 from .nsw_government import Ingest
 
 STATE_CODES = {
@@ -24,6 +32,25 @@ STATE_NAMES = {
     'ACT': 'Australian Capital Territory',
 }
 
+LGA_LHD_COLUMNS = ['lhd_code', 'lhd_name', 'lga_code', 'lga_name']
+
+# On-disk cache of the LGA to LHD map, refreshed after LGA_LHD_TTL
+LGA_LHD_CACHE = os.environ.get('LGA_LHD_CACHE', '.cache/lga_lhd_map.csv')
+LGA_LHD_TTL = timedelta(days=7)
+# Retrieval is retried after LGA_LHD_RETRY when it failed
+LGA_LHD_RETRY = timedelta(hours=1)
+
+# Snapshot of the map bundled with the repository
+LGA_LHD_BUNDLED = os.path.join(
+    os.path.dirname(__file__), '..', 'data', 'lga_lhd_map.csv'
+)
+
+_lga_lhd_map = None
+# Time after which the map in memory is loaded again
+_lga_lhd_expires = 0.0
+_lga_lhd_lock = threading.Lock()
+
+
 def retrieve_lga_lhd_map():
     ingestion = Ingest({
         'source': {
@@ -32,8 +59,50 @@ def retrieve_lga_lhd_map():
     })
     df = ingestion.retrieve()
     df = ingestion.process(df)
-    return df.drop_duplicates(
-        ['lhd_code','lhd_name', 'lga_code', 'lga_name']
-    )[['lhd_code','lhd_name', 'lga_code', 'lga_name']]
+    return df.drop_duplicates(LGA_LHD_COLUMNS)[LGA_LHD_COLUMNS]
+
+
+def _read_lga_lhd_map(path):
+    return pd.read_csv(path, dtype=str)[LGA_LHD_COLUMNS]
+
+
+def get_lga_lhd_map(refresh=False, bundled=False):
+    '''Get the LGA to LHD map, loaded lazily at most once per refresh window.
+
+    The map is served from memory, then from the on-disk cache while it is
+    younger than LGA_LHD_TTL, and otherwise retrieved from NSW Government
+    and cached. If retrieval fails, a stale cache or the bundled snapshot
+    is used instead, and retrieval is retried after LGA_LHD_RETRY.
 
-LGA_LHD_MAP = retrieve_lga_lhd_map()
+    kwargs:
+        refresh (bool): Ignore cached maps and retrieve from source.
+        bundled (bool): Use the map bundled with the repository.
+    Returns dataframe.
+    '''
+    global _lga_lhd_map, _lga_lhd_expires
+    if bundled:
+        return _read_lga_lhd_map(LGA_LHD_BUNDLED)
+    with _lga_lhd_lock:
+        # Kept in memory for the refresh window, for long running processes
+        if _lga_lhd_map is not None and time.time() < _lga_lhd_expires and not refresh:
+            return _lga_lhd_map
+        cache_fresh = os.path.exists(LGA_LHD_CACHE) and \
+            time.time() - os.path.getmtime(LGA_LHD_CACHE) < LGA_LHD_TTL.total_seconds()
+        if cache_fresh and not refresh:
+            logging.debug(f'Loading LGA LHD map from {LGA_LHD_CACHE}')
+            _lga_lhd_map = _read_lga_lhd_map(LGA_LHD_CACHE)
+            _lga_lhd_expires = os.path.getmtime(LGA_LHD_CACHE) + LGA_LHD_TTL.total_seconds()
+            return _lga_lhd_map
+        try:
+            df = retrieve_lga_lhd_map()
+        except Exception:
+            logging.exception('Could not retrieve LGA LHD map, using a cached map.')
+            path = LGA_LHD_CACHE if os.path.exists(LGA_LHD_CACHE) else LGA_LHD_BUNDLED
+            _lga_lhd_map = _read_lga_lhd_map(path)
+            _lga_lhd_expires = time.time() + LGA_LHD_RETRY.total_seconds()
+            return _lga_lhd_map
+        os.makedirs(os.path.dirname(LGA_LHD_CACHE) or '.', exist_ok=True)
+        df.to_csv(LGA_LHD_CACHE, index=False)
+        _lga_lhd_map = _read_lga_lhd_map(LGA_LHD_CACHE)
+        _lga_lhd_expires = time.time() + LGA_LHD_TTL.total_seconds()
+        return _lga_lhd_map
@@ -1,33 +1,330 @@
 '''Retrieve and process vaccination data'''
 
+import json
+import os
+import numpy as np
 import pandas as pd
-from requests.sessions import Session
 import pandera as pa
 import re
-from copy import deepcopy
-from marshmallow.fields import Nested, String, Integer
+from marshmallow import validate
+from marshmallow.fields import Boolean, Nested, String, Integer
 from datetime import datetime
-from bs4 import BeautifulSoup
-from multiprocessing import Pool
-from copy import deepcopy
+from bs4 import BeautifulSoup, SoupStrainer
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from ingestion import (
     BaseIngest,
     logging,
     SourceSchema,
     IngestSchema,
-    BASE_PROCESSED_SCHEMA
+    BASE_PROCESSED_SCHEMA,
+    ResultCache,
+    apply_transforms,
+    dimension_column,
+    key_dimensions,
+    parse_number,
+    parse_percent,
+    read_xlsx,
 )
+from ingestion.results import code_version
 
-from .utils import STATE_CODES, STATE_NAMES, LGA_LHD_MAP
+from .utils import STATE_CODES, STATE_NAMES, get_lga_lhd_map
 
 BASE_URL = 'https://www.health.gov.au/'
 
+# Wide vaccination data column patterns and their measures
+STATE_COLUMN = '{state} - {measure}'
+STATE_MEASURES = {
+    'Residence state - Number of people 16 and over with 1 dose': 'vax_1_dose',
+    'Residence state - Number of people 16 and over fully vaccinated': 'vax_2_dose',
+    'Population 16 and over': 'population',
+}
+AGE_COLUMN = 'Age group - {age_group} - {sex} - {measure}'
+AGE_MEASURES = {
+    'Number of people with 1 dose': 'vax_1_dose',
+    'Number of people fully vaccinated': 'vax_2_dose',
+    'Population': 'population',
+}
+AGE_GROUPS = ['16-19', '20-24', '25-29', '30-34', '35-39', '40-44', '45-49',
+    '50-54', '55-59', '60-64', '65-69', '70-74', '75-79', '80-84', '85-89',
+    '90-94', '95+']
+
+# Validation schemas per collection
+SCHEMAS = {
+    'covid-19-vaccination-vaccination-data': BASE_PROCESSED_SCHEMA.add_columns({
+        # Dimensions
+        "date": pa.Column(datetime),
+        "state_name": dimension_column(nullable=True),
+        "state_code": dimension_column(nullable=True),
+        "country": dimension_column(nullable=True),
+        "age_group": pa.Column(object, nullable=True),
+        "sex": dimension_column(nullable=True),
+        "dimensions_id": pa.Column(int),
+        # Measures
+        "vax_1_dose": pa.Column(int, nullable=True, coerce=True),
+        "vax_2_dose": pa.Column(int, nullable=True, coerce=True),
+        "vax_1_dose_diff": pa.Column(int, nullable=True, coerce=True),
+        "vax_2_dose_diff": pa.Column(int, nullable=True, coerce=True),
+        "vax_1_percent": pa.Column(float, nullable=True, coerce=True),
+        "vax_2_percent": pa.Column(float, nullable=True, coerce=True),
+        "population": pa.Column(int, nullable=True, coerce=True),
+    }),
+    'covid-19-vaccination-geographic-vaccination-rates-lga': BASE_PROCESSED_SCHEMA.add_columns({
+        # Dimensions
+        "date": pa.Column(datetime),
+        "lhd_code": dimension_column(nullable=True),
+        "lhd_name": dimension_column(nullable=True),
+        "lga_code": dimension_column(nullable=True),
+        "lga_name": dimension_column(nullable=True),
+        "state_name": dimension_column(nullable=True),
+        "state_code": dimension_column(nullable=True),
+        "country": dimension_column(nullable=True),
+        "dimensions_id": pa.Column(int),
+        # Measures
+        "vax_1_dose_15": pa.Column(float, nullable=True, coerce=True),
+        "vax_2_dose_15": pa.Column(float, nullable=True, coerce=True),
+        "vax_1_dose_15_diff": pa.Column(float, nullable=True, coerce=True),
+        "vax_2_dose_15_diff": pa.Column(float, nullable=True, coerce=True),
+        "vax_1_percent_15": pa.Column(float, nullable=True, coerce=True),
+        "vax_2_percent_15": pa.Column(float, nullable=True, coerce=True),
+        "population_15": pa.Column(float, nullable=True, coerce=True),
+    }),
+}
+
+def _dose_diffs(dimensions, suffix=''):
+    '''Transform step diffing doses within each set of dimensions'''
+    return {'diff': {
+        'by': dimensions,
+        'order': 'date',
+        'columns': {
+            f'vax_{dose}_dose{suffix}': f'vax_{dose}_dose{suffix}_diff'
+            for dose in (1, 2)
+        },
+    }}
+
+
+def _dose(dose):
+    '''Doses from the percentage of the population, rounded'''
+    return lambda df: (
+        df[f'vax_{dose}_percent_15'] * df['population_15'] / 100
+    ).round()
+
+
+# Transform steps per collection, and per reshaped vaccination data frame
+TRANSFORMS = {
+    'state': [
+        {'categorize': ['country', 'state_name', 'state_code']},
+        _dose_diffs(['country', 'state_name', 'state_code']),
+    ],
+    'demographic': [
+        {'categorize': ['country', 'sex']},
+        _dose_diffs(['country', 'age_group', 'sex']),
+    ],
+    'covid-19-vaccination-vaccination-data': [
+        {'categorize': ['country', 'state_name', 'state_code', 'sex']},
+        {'key_hash': [
+            'date',
+            'state_name',
+            'state_code',
+            'country',
+            'age_group',
+            'sex',
+        ]},
+    ],
+    'covid-19-vaccination-geographic-vaccination-rates-lga': [
+        {'replace': {'N/A': np.nan}},
+        {'derive': {
+            'vax_1_percent_15': lambda df: parse_percent(df['vax_1_percent_15']),
+            'vax_2_percent_15': lambda df: parse_percent(df['vax_2_percent_15']),
+            'population_15': lambda df: parse_number(df['population_15']),
+        }},
+        {'derive': {
+            'vax_1_dose_15': _dose(1),
+            'vax_2_dose_15': _dose(2),
+        }},
+        {'map': {'state_code': ('state_name', STATE_CODES)}},
+        {'constant': {'country': 'Australia'}},
+        {'merge': 'lga_lhd_map'},
+        {'categorize': [
+            'lhd_code',
+            'lhd_name',
+            'lga_code',
+            'lga_name',
+            'state_name',
+            'state_code',
+        ]},
+        _dose_diffs([
+            'country',
+            'state_name',
+            'state_code',
+            'lga_code',
+            'lga_name',
+            'lhd_code',
+            'lhd_name',
+        ], suffix='_15'),
+        {'key_hash': [
+            'date',
+            'lhd_code',
+            'lhd_name',
+            'lga_code',
+            'lga_name',
+            'state_name',
+            'state_code',
+            'country',
+        ]},
+    ],
+}
+
+# Manifests of resolved Excel file links per collection
+MANIFEST_PATH = os.environ.get('VAX_MANIFEST', 'manifests')
+
+# Parsed Excel files, keyed by content hash and code version, bounded in
+# size by evicting the least recently used
+PARSED_CACHE = os.environ.get('XLSX_CACHE', '.cache/xlsx')
+PARSED_CACHE_MAX_BYTES = int(os.environ.get('XLSX_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+
+
+def link_date(link):
+    '''Parse the report date from an Excel file link'''
+    return datetime.strptime(
+        re.search(r'\d{1,2}-\w+-\d{4}', link)[0],
+        "%d-%B-%Y"
+    )
+
+
+def _melt(df, column, keys, measures):
+    '''Reshape measure columns named by a pattern into long format.
+
+    Args:
+        df (pd.DataFrame): Wide dataframe, one row per report date.
+        column (str): Column name pattern, formatted with each key and measure.
+        keys (list): Dicts of pattern fields, one output row per key per row.
+        measures (dict): Measure name in the column to output field name.
+    Returns dict of field name to values, ordered by row then key.
+    '''
+    return {
+        field: df[[column.format(**key, measure=measure) for key in keys]]\
+            .to_numpy().ravel()
+        for measure, field in measures.items()
+    }
+
+
+def reshape_vaccination_data(df):
+    '''Reshape wide vaccination data into per state and per age/sex rows.
+    Returns state dataframe and demographic dataframe.
+    '''
+    n = len(df)
+    dates = np.repeat(df['date'].to_numpy(), len(STATE_CODES))
+    states = list(STATE_CODES.values())
+    state_df = pd.DataFrame({
+        'date': dates,
+        'state_name': [STATE_NAMES[state] for state in states] * n,
+        'state_code': states * n,
+        'country': 'Australia',
+        **_melt(df, STATE_COLUMN, [{'state': s} for s in states], STATE_MEASURES),
+    })
+    keys = [
+        {'age_group': age_group, 'sex': sex}
+        for age_group in AGE_GROUPS for sex in ['M', 'F']
+    ]
+    demo_df = pd.DataFrame({
+        'date': np.repeat(df['date'].to_numpy(), len(keys)),
+        'country': 'Australia',
+        'age_group': [
+            tuple(int(k) for k in key['age_group'].replace('+', '').split('-'))
+            for key in keys
+        ] * n,
+        'sex': ['Female' if key['sex'] == 'F' else 'Male' for key in keys] * n,
+        **_melt(df, AGE_COLUMN, keys, AGE_MEASURES),
+    })
+    columns = [
+        'vax_1_dose',
+        'vax_2_dose',
+        'vax_1_percent',
+        'vax_2_percent',
+        'population',
+    ]
+    for _df in (state_df, demo_df):
+        _df['vax_1_percent'] = _df['vax_1_dose']/_df['population']
+        _df['vax_2_percent'] = _df['vax_2_dose']/_df['population']
+    state_df = state_df[['date', 'state_name', 'state_code', 'country', *columns]]
+    demo_df = demo_df[['date', 'country', 'age_group', 'sex', *columns]]
+    return state_df.infer_objects(), demo_df.infer_objects()
+
+
+def _read_vaccination_data(content):
+    '''Parse a national vaccination data report, one row per report'''
+    df = read_xlsx(content)
+    df = df.dropna()
+    df = df.set_index('Measure Name')
+    return df.T
+
+
+def _read_lga_rates(content):
+    '''Parse an LGA vaccination rates report, one row per LGA'''
+    df = read_xlsx(content, header=8, max_col=6)
+    df = df.drop(['Remoteness'], axis=1)
+    df.columns = ['lga_name', 'state_name', 'vax_1_percent_15', 'vax_2_percent_15', 'population_15']
+    return df
+
+
+def _reshape_vaccination_data(df):
+    '''Reshape and transform national vaccination data into state and
+    demographic rows, before the collection transforms
+    '''
+    state_df, demo_df = reshape_vaccination_data(df)
+    return pd.concat([
+        apply_transforms(state_df, TRANSFORMS['state']),
+        apply_transforms(demo_df, TRANSFORMS['demographic']),
+    ])
+
+
+# Excel report parser per collection
+READERS = {
+    'covid-19-vaccination-vaccination-data': _read_vaccination_data,
+    'covid-19-vaccination-geographic-vaccination-rates-lga': _read_lga_rates,
+}
+
+# Reshape of the parsed reports per collection, before its transforms
+RESHAPES = {
+    'covid-19-vaccination-vaccination-data': _reshape_vaccination_data,
+}
+
+
+def load_manifest(collection):
+    '''Load the manifest of resolved item pages for a collection.
+    Returns dict of item page URL to Excel link, date and content hash.
+    '''
+    path = os.path.join(MANIFEST_PATH, f'{collection}.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(collection, manifest):
+    '''Save the manifest of resolved item pages for a collection'''
+    os.makedirs(MANIFEST_PATH, exist_ok=True)
+    path = os.path.join(MANIFEST_PATH, f'{collection}.json')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
 
 class SourceSchema(SourceSchema):
     '''Schema for source'''
     collection = String(required=True)
     limit = Integer()
+    lga_lhd_bundled = Boolean(default=False, missing=False)
+    workers = Integer(default=5, missing=5)
+    chunk_rows = Integer(default=50000, missing=50000)
+    parser = String(
+        validate=validate.OneOf(['html.parser', 'lxml']),
+        default='html.parser',
+        missing='html.parser'
+    )
 
 class IngestSchema(IngestSchema):
     '''Schema for Ingest class config'''
@@ -40,35 +337,115 @@ class Ingest(BaseIngest):
         super().__init__(cfg)
         self.cfg = IngestSchema().load(cfg)
 
-    def retrieve(self):
-        '''Get raw vaccination data'''
+    def _resolve_link(self, page_url):
+        '''Find the Excel file link on a collection item page'''
+        # The link is part of the file URL, the page is not raw data
+        response = self.http.get(page_url, track=False)
+        soup = BeautifulSoup(
+            response.text,
+            features=self.cfg['source']['parser'],
+            parse_only=SoupStrainer('a', {'class': 'health-file__link'}),
+        )
+        excel_file = soup.find('a', {
+            'class': 'health-file__link',
+            'data-filetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        })
+        return excel_file['href']
+
+    def _reports(self):
+        '''Resolve the Excel file links of reports to download.
+
+        Item pages already in the collection manifest are not fetched again,
+        so only new reports are resolved to their Excel file links.
+        Returns list of (link, collection), or None if there is no new data.
+        '''
         limit = self.cfg['source'].get('limit')
-        session = Session()
         collection = self.cfg['source']['collection']
+        workers = self.cfg['source']['workers']
         url = BASE_URL + 'resources/collections/' + collection
         logging.info(f'Retrieving data from {collection}')
-        response = session.get(url)
-        soup = BeautifulSoup(response.text, features="html.parser")
+        response = self.http.get(url)
+        # No new reports if the collection listing is unchanged
+        if self.is_unchanged(response):
+            logging.info(f'No change in {collection}')
+            return None
+        soup = BeautifulSoup(response.text, features=self.cfg['source']['parser'])
         table = soup.find('div', {'class': 'paragraphs-items'})
-        a_tags = table.findAll('a')
-        args = []
-        # Get all Excel file links
-        for a in a_tags:
-            response = session.get(BASE_URL + a['href'])
-            soup = BeautifulSoup(response.text, features="html.parser")
-            excel_file = soup.find('a', {
-                'class': 'health-file__link',
-                'data-filetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            })
-            args.append((excel_file['href'], collection))
-        with open("vax_excel_links.txt", "w") as output:
-            for row in args:
-                output.write(str(row[0]) + '\n')
+        pages = [BASE_URL + a['href'] for a in table.findAll('a')]
         if limit:
-            args = args[:limit]
-        # Download datasets in parallel
-        with Pool(5) as p:
-            return pd.concat(p.starmap(self._download_dataset, args))
+            pages = pages[:limit]
+        # Resolve new item pages concurrently
+        self._manifest = load_manifest(collection)
+        new_pages = [page for page in pages if page not in self._manifest]
+        logging.info(f'Resolving {len(new_pages)} new reports from {collection}')
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for page, link in zip(new_pages, executor.map(self._resolve_link, new_pages)):
+                self._manifest[page] = {
+                    'link': link,
+                    'date': link_date(link).isoformat(),
+                }
+        save_manifest(collection, self._manifest)
+        args = [(self._manifest[page]['link'], collection) for page in pages]
+        # Keep the last saved report (needed for diffs) and any newer ones
+        watermark = self.get_watermark()
+        if watermark:
+            watermark = datetime.fromisoformat(watermark)
+            args = [arg for arg in args if link_date(arg[0]) >= watermark]
+            if not any(link_date(arg[0]) > watermark for arg in args):
+                logging.info(f'No new data for {collection}')
+                return None
+        # Keep the reports of a backfill partition, and the last report
+        # before it (needed for diffs)
+        if self.date_range:
+            start, end = self.date_range
+            before = [arg for arg in args if link_date(arg[0]) < start]
+            args = [arg for arg in args if start <= link_date(arg[0]) < end]
+            if not args:
+                logging.info(f'No reports of {collection} in the partition')
+                return None
+            if before:
+                args.append(max(before, key=lambda arg: link_date(arg[0])))
+        self.set_watermark(max(link_date(arg[0]) for arg in args).isoformat())
+        return args
+
+    def prepare_backfill(self):
+        '''Resolve the report links once for all partitions'''
+        self._reports()
+
+    def retrieve(self):
+        '''Get raw vaccination data.'''
+        args = self._reports()
+        if args is None:
+            return pd.DataFrame()
+        # Download datasets concurrently over a shared connection pool
+        with ThreadPoolExecutor(max_workers=self.cfg['source']['workers']) as executor:
+            df = pd.concat(executor.map(
+                lambda arg: self._download_dataset(*arg),
+                args
+            ))
+        # Record content hashes of the downloaded files
+        save_manifest(self.cfg['source']['collection'], self._manifest)
+        return df
+
+    def retrieve_chunks(self):
+        '''Get raw vaccination data one report at a time, oldest first.
+        At most a window of reports is downloaded ahead of the consumer.
+        '''
+        args = self._reports()
+        if args is None:
+            return
+        args = sorted(args, key=lambda arg: link_date(arg[0]))
+        workers = self.cfg['source']['workers']
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            window = deque()
+            for arg in args:
+                window.append(executor.submit(self._download_dataset, *arg))
+                if len(window) > workers:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+        # Record content hashes of the downloaded files
+        save_manifest(self.cfg['source']['collection'], self._manifest)
 
     def _download_dataset(self, link, collection):
         '''Retrieves individual dataset given a link and collection name.
@@ -78,202 +455,80 @@ class Ingest(BaseIngest):
             collection (str): Name of the dataset to handled specific download.
         '''
         logging.debug(f'Downloading file: {link}')
-        if collection == 'covid-19-vaccination-vaccination-data':
-            _df = pd.read_excel(link)
-            _df = _df.dropna()
-            _df = _df.set_index('Measure Name')
-            _df = _df.T
-        elif collection == 'covid-19-vaccination-geographic-vaccination-rates-lga':
-            _df = pd.read_excel(link, header=8)
-            _df = _df.drop(['Remoteness'], axis=1)
-            _df.columns = ['lga_name', 'state_name', 'vax_1_percent_15', 'vax_2_percent_15', 'population_15']
+        response = self.http.get(link)
+        for entry in self._manifest.values():
+            if entry['link'] == link:
+                entry['sha256'] = response.sha256
+        # Only parse files whose contents or parsing code changed
+        parsed = ResultCache(path=PARSED_CACHE, max_bytes=PARSED_CACHE_MAX_BYTES)
+        key = f'{collection}-{response.sha256}-{code_version(__name__)}'
+        _df = parsed.get(key)
+        if _df is None:
+            _df = READERS[collection](response.content)
+            parsed.put(key, _df)
         # Get date
-        date = datetime.strptime(
-            re.search(r'\d{1,2}-\w+-\d{4}', link)[0],
-            "%d-%B-%Y"
-        )
+        date = link_date(link)
         _df['date'] = date
         logging.debug(f'Download done!: {date}')
         return _df
 
+    def tables(self):
+        '''LGA to LHD map merged with the LGA collection'''
+        if self.cfg['source']['collection'] != 'covid-19-vaccination-geographic-vaccination-rates-lga':
+            return {}
+        return {'lga_lhd_map': get_lga_lhd_map(
+            bundled=self.cfg['source']['lga_lhd_bundled']
+        )}
+
     def process(self, df):
         '''Process raw vaccination data'''
         collection = self.cfg['source']['collection']
         logging.info(f'Processing data from {collection}')
-        if collection == 'covid-19-vaccination-vaccination-data':
-            state_docs = []
-            demo_docs = []
-            for doc in df.to_dict('records'):
-                for state in STATE_CODES.values():
-                    _doc = {}
-                    # Calculate fields
-                    _doc['date'] = doc['date']
-                    _doc['state_name'] = STATE_NAMES[state]
-                    _doc['state_code'] = state
-                    _doc['country'] = 'Australia'
-                    population = doc[f'{state} - Population 16 and over']
-                    vax_1_dose = doc[f'{state} - Residence state - Number of people 16 and over with 1 dose']
-                    vax_2_dose = doc[f'{state} - Residence state - Number of people 16 and over fully vaccinated']
-                    _doc['vax_1_dose'] = vax_1_dose
-                    _doc['vax_2_dose'] = vax_2_dose
-                    _doc['vax_1_percent'] = vax_1_dose/population
-                    _doc['vax_2_percent'] = vax_2_dose/population
-                    _doc['population'] = population
-                    state_docs.append(_doc)
-                for age_group in ['16-19', '20-24', '25-29', '30-34', '35-39',
-                    '40-44', '45-49', '50-54', '55-59', '60-64', '65-69',
-                    '70-74', '75-79', '80-84', '85-89', '90-94', '95+']:
-                    _doc = {}
-                    # Calculate fields
-                    _doc['date'] = doc['date']
-                    _doc['country'] = 'Australia'
-                    _doc['age_group'] = tuple(
-                        int(k) for k in age_group.replace('+', '').strip().\
-                            split('-')
-                    )
-                    for sex in ['M', 'F']:
-                        __doc = deepcopy(_doc)
-                        population = doc[
-                            f'Age group - {age_group} - {sex} - Population'
-                        ]
-                        vax_1_dose = doc[
-                            f'Age group - {age_group} - {sex} - Number of people with 1 dose'
-                        ]
-                        vax_2_dose = doc[
-                            f'Age group - {age_group} - {sex} - Number of people fully vaccinated'
-                        ]
-                        __doc['sex'] = 'Female' if sex == 'F' else 'Male'
-                        __doc['vax_1_dose'] = vax_1_dose
-                        __doc['vax_2_dose'] = vax_2_dose
-                        __doc['vax_1_percent'] = vax_1_dose/population
-                        __doc['vax_2_percent'] = vax_2_dose/population
-                        __doc['population'] = population
-                        demo_docs.append(__doc)
-            state_df = pd.DataFrame(state_docs)
-            dimensions = ['country', 'state_name', 'state_code']
-            state_df = state_df.sort_values(by=[*dimensions, 'date'])
-            state_df['vax_1_dose_diff'] = state_df.groupby(dimensions)['vax_1_dose'].diff().fillna(0)
-            state_df['vax_2_dose_diff'] = state_df.groupby(dimensions)['vax_2_dose'].diff().fillna(0)
-            demo_df = pd.DataFrame(demo_docs)
-            dimensions = ['country', 'age_group', 'sex']
-            demo_df = demo_df.sort_values(by=[*dimensions, 'date'])
-            demo_df['vax_1_dose_diff'] = demo_df.groupby(dimensions)['vax_1_dose'].diff().fillna(0)
-            demo_df['vax_2_dose_diff'] = demo_df.groupby(dimensions)['vax_2_dose'].diff().fillna(0)
-            df = pd.concat([state_df, demo_df])
-            df['dimensions_id'] = df.apply(
-                lambda x: hash(
-                    tuple([
-                        x.date,
-                        x.state_name,
-                        x.state_code,
-                        x.country,
-                        x.age_group,
-                        x.sex,
-                    ])
-                ),
-                axis=1
-            )
-        elif collection == 'covid-19-vaccination-geographic-vaccination-rates-lga':
-            # Transform fields
-            df = df.replace('N/A', None)
-            df['vax_1_percent_15'] = df['vax_1_percent_15'].apply(
-                lambda x: float(re.sub(r'[>%]', '', str(x)))
-            )
-            df['vax_2_percent_15'] = df['vax_2_percent_15'].apply(
-                lambda x: float(re.sub(r'[>%]', '', str(x)))
-            )
-            df['state_code'] = df['state_name'].apply(
-                lambda x: STATE_CODES.get(x)
-            )
-            df['population_15'] = df['population_15'].apply(
-                lambda x: re.sub("[^0-9^.]", "", str(x))
-            )
-            df['population_15'] = df['population_15'].apply(
-                lambda x: float(x) if x else None
-            )
-            df['vax_1_dose_15'] = df.apply(
-                lambda x: x['vax_1_percent_15']*float(x['population_15'])/100,
-                axis=1
-            )
-            df['vax_2_dose_15'] = df.apply(
-                lambda x: x['vax_2_percent_15']*float(x['population_15'])/100,
-                axis=1
-            )
-            df['vax_1_dose_15'] = df['vax_1_dose_15'].apply(
-                lambda x: round(x) if not pd.isnull(x) else None
-            )
-            df['vax_2_dose_15'] = df['vax_2_dose_15'].apply(
-                lambda x: round(x) if not pd.isnull(x) else None
-            )
-            # Add fields
-            df['country'] = 'Australia'
-            df = pd.merge(df, LGA_LHD_MAP)
-            dimensions = ['country', 'state_name', 'state_code', 'lga_code', 'lga_name', 'lhd_code', 'lhd_name']
-            df = df.sort_values(by=[*dimensions, 'date'])
-            df['vax_1_dose_15_diff'] = df.groupby(dimensions)['vax_1_dose_15'].diff().fillna(0)
-            df['vax_2_dose_15_diff'] = df.groupby(dimensions)['vax_2_dose_15'].diff().fillna(0)
-            df['dimensions_id'] = df.apply(
-                lambda x: hash(
-                    tuple([
-                        x.date,
-                        x.lhd_code,
-                        x.lhd_name,
-                        x.lga_code,
-                        x.lga_name,
-                        x.state_name,
-                        x.state_code,
-                        x.country,
-                    ])
-                ),
-                axis=1
-            )
+        reshape = RESHAPES.get(collection)
+        if reshape is not None:
+            df = reshape(df)
+        df = apply_transforms(df, TRANSFORMS.get(collection, []), tables={
+            'lga_lhd_map': lambda: self.tables()['lga_lhd_map'],
+        })
+        # Drop the previously saved report, only kept to calculate diffs
+        watermark = self.get_watermark()
+        if watermark:
+            df = df[df['date'] > pd.Timestamp(watermark)]
+        # Drop the report before a backfill partition, likewise
+        df = self.filter_date_range(df)
         # Return dataframe
         return df
 
+    def process_chunks(self, chunks):
+        '''Process reports in batches of at least chunk_rows raw rows,
+        oldest first.
+
+        Each batch is processed together with the last report of the
+        previous batch, which is only kept to calculate diffs.
+        '''
+        previous, batch, rows = None, [], 0
+        for chunk in chunks:
+            batch.append(chunk)
+            rows += len(chunk)
+            if rows >= self.cfg['source']['chunk_rows']:
+                yield self._process_batch(previous, batch)
+                previous, batch, rows = batch[-1], [], 0
+        if batch:
+            yield self._process_batch(previous, batch)
+
+    def _process_batch(self, previous, batch):
+        '''Process a batch of reports, after the previous report'''
+        if previous is None:
+            return self.process(pd.concat(batch))
+        df = self.process(pd.concat([previous, *batch]))
+        return df[df['date'] > previous['date'].max()]
+
     def validate(self, df):
         '''Validate data'''
         collection = self.cfg['source']['collection']
         logging.info(f'Validating data from {collection}')
-        if collection == 'covid-19-vaccination-vaccination-data':
-            schema = BASE_PROCESSED_SCHEMA.add_columns({
-                # Dimensions
-                "date": pa.Column(datetime),
-                "state_name": pa.Column(str, nullable=True),
-                "state_code": pa.Column(str, nullable=True),
-                "country": pa.Column(str, nullable=True),
-                "age_group": pa.Column(str, nullable=True),
-                "sex": pa.Column(str, nullable=True),
-                "dimensions_id": pa.Column(int),
-                # Measures
-                "vax_1_dose": pa.Column(int, nullable=True, coerce=True),
-                "vax_2_dose": pa.Column(int, nullable=True, coerce=True),
-                "vax_1_dose_diff": pa.Column(int, nullable=True, coerce=True),
-                "vax_2_dose_diff": pa.Column(int, nullable=True, coerce=True),
-                "vax_1_percent": pa.Column(float, nullable=True, coerce=True),
-                "vax_2_percent": pa.Column(float, nullable=True, coerce=True),
-                "population": pa.Column(int, nullable=True, coerce=True),
-            })
-            df = schema(df)
-        elif collection == 'covid-19-vaccination-geographic-vaccination-rates-lga':
-            schema = BASE_PROCESSED_SCHEMA.add_columns({
-                # Dimensions
-                "date": pa.Column(datetime),
-                "lhd_code": pa.Column(str, nullable=True),
-                "lhd_name": pa.Column(str, nullable=True),
-                "lga_code": pa.Column(str, nullable=True),
-                "lga_name": pa.Column(str, nullable=True),
-                "state_name": pa.Column(str, nullable=True),
-                "state_code": pa.Column(str, nullable=True),
-                "country": pa.Column(str, nullable=True),
-                "dimensions_id": pa.Column(int),
-                # Measures
-                "vax_1_dose_15": pa.Column(float, nullable=True, coerce=True),
-                "vax_2_dose_15": pa.Column(float, nullable=True, coerce=True),
-                "vax_1_dose_15_diff": pa.Column(float, nullable=True, coerce=True),
-                "vax_2_dose_15_diff": pa.Column(float, nullable=True, coerce=True),
-                "vax_1_percent_15": pa.Column(float, nullable=True, coerce=True),
-                "vax_2_percent_15": pa.Column(float, nullable=True, coerce=True),
-                "population_15": pa.Column(float, nullable=True, coerce=True),
-            })
-            df = schema(df)
-        return df
+        return self.validate_schema(
+            df,
+            SCHEMAS.get(collection),
+            dimensions=key_dimensions(TRANSFORMS.get(collection, [])),
+        )
@@ -0,0 +1,125 @@
+'''Tests of the backfill date partitions and checkpoints'''
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+import pytest
+
+from ingestion import backfill as backfill_module
+from ingestion.backfill import backfill, parse_range, partitions
+from ingestion.state import StateStore
+
+
+def covers(parts, start, end):
+    '''Whether partitions cover a range in order, without gaps or overlap'''
+    return parts[0][0] == start and parts[-1][1] == end \
+        and all(a[1] == b[0] for a, b in zip(parts, parts[1:])) \
+        and all(a < b for a, b in parts)
+
+
+def test_parse_range_includes_end():
+    assert parse_range('2021-01-15:2021-03-10') == (datetime(2021, 1, 15), datetime(2021, 3, 11))
+    start, end = parse_range('2021-01-15:')
+    assert start == datetime(2021, 1, 15) and end > datetime.utcnow()
+
+
+@pytest.mark.parametrize('value', ['2021-01-15', ':2021-03-10', '2021-03-10:2021-01-15'])
+def test_parse_range_errors(value):
+    with pytest.raises(ValueError, match='Invalid backfill range'):
+        parse_range(value)
+
+
+def test_month_partitions():
+    start, end = parse_range('2021-01-15:2021-03-10')
+    parts = partitions(start, end, 'month')
+    assert parts == [
+        (datetime(2021, 1, 15), datetime(2021, 2, 1)),
+        (datetime(2021, 2, 1), datetime(2021, 3, 1)),
+        (datetime(2021, 3, 1), datetime(2021, 3, 11)),
+    ]
+    # A range on the boundaries is a single partition
+    start, end = parse_range('2021-02-01:2021-02-28')
+    assert partitions(start, end, 'month') == [(start, end)]
+
+
+def test_week_partitions_start_on_mondays():
+    # From a Wednesday to a Friday
+    start, end = parse_range('2021-08-04:2021-08-20')
+    parts = partitions(start, end, 'week')
+    assert covers(parts, start, end)
+    assert [a for a, _ in parts[1:]] == [datetime(2021, 8, 9), datetime(2021, 8, 16)]
+    assert all(a.weekday() == 0 for a, _ in parts[1:])
+
+
+@pytest.mark.parametrize('partition_by', ['day', 'week', 'month', 'year'])
+def test_partitions_cover_the_range(partition_by):
+    start, end = parse_range('2020-02-27:2021-03-02')
+    parts = partitions(start, end, partition_by)
+    assert covers(parts, start, end)
+    if partition_by == 'day':
+        assert len(parts) == (end - start).days
+
+
+class Ingest():
+    '''Source of the backfill, only keyed and prepared'''
+    prepared = 0
+
+    def __init__(self, cfg):
+        self.state_key = f"csv:{cfg['sink']['name']}"
+        self.date_range = None
+
+    def prepare_backfill(self):
+        Ingest.prepared += 1
+
+
+@pytest.fixture
+def partitions_run(tmp_path, monkeypatch):
+    '''Run partitions in threads, recording their starts and failing the
+    partitions starting on the dates in fail
+    '''
+    monkeypatch.setenv('INGESTION_STATE', str(tmp_path / 'state.json'))
+    monkeypatch.setattr(
+        backfill_module,
+        'ProcessPoolExecutor',
+        lambda max_workers, **kwargs: ThreadPoolExecutor(max_workers),
+    )
+    run = []
+    fail = set()
+
+    def run_partition(module, cfg, start, end):
+        run.append(start)
+        if start in fail:
+            raise RuntimeError('unavailable')
+        return 1
+
+    monkeypatch.setattr(backfill_module, 'run_partition', run_partition)
+    return run, fail
+
+
+def test_backfill_resumes(partitions_run):
+    run, fail = partitions_run
+    entries = [{'module': 'source', 'cfg': {'sink': {'name': 'cases'}}}]
+    modules = {'source': SimpleNamespace(Ingest=Ingest)}
+    date_range = parse_range('2021-01-01:2021-04-30')
+    march = datetime(2021, 3, 1)
+    fail.add(march)
+    failed = backfill(entries, modules, date_range, partition_by='month')
+    assert [(name, start) for name, start, _ in failed] == [('cases', march)]
+    assert len(run) == 4
+    checkpoint = StateStore().get('backfill:csv:cases')
+    assert sorted(checkpoint['done']) == [
+        '2021-01-01T00:00:00', '2021-02-01T00:00:00', '2021-04-01T00:00:00',
+    ]
+    # Only the failed partition is run again
+    fail.clear()
+    run.clear()
+    assert backfill(entries, modules, date_range, partition_by='month') == []
+    assert run == [march]
+    # Nothing is left to do, or prepared
+    run.clear()
+    prepared = Ingest.prepared
+    backfill(entries, modules, date_range, partition_by='month')
+    assert run == [] and Ingest.prepared == prepared
+    # Other partitions start over
+    backfill(entries, modules, date_range, partition_by='week')
+    assert len(run) == len(partitions(*date_range, 'week'))
@@ -0,0 +1,66 @@
+'''Tests of change data capture against the saved snapshot'''
+
+import os
+from datetime import datetime
+import pandas as pd
+import pytest
+
+from ingestion.cdc import Snapshot
+from ingestion.ingest import BaseIngest
+
+
+def rows(values, saved_date=datetime(2021, 8, 1)):
+    return pd.DataFrame({
+        'dimensions_id': [i for i, _ in values],
+        'cases': [cases for _, cases in values],
+        'saved_date': saved_date,
+    })
+
+
+def test_diff_counts_changes(tmp_path):
+    first = Snapshot('sink', path=str(tmp_path))
+    assert len(first.diff(rows([(1, 10), (2, 20), (3, 30)]))) == 3
+    assert first.changes == {'inserted': 3, 'updated': 0, 'unchanged': 0}
+    first.save()
+    second = Snapshot('sink', path=str(tmp_path))
+    # Saved dates are not part of the row content
+    df = second.diff(rows([(1, 10), (2, 21), (4, 40)], saved_date=datetime(2021, 8, 2)))
+    assert second.changes == {'inserted': 1, 'updated': 1, 'unchanged': 1}
+    assert df['dimensions_id'].tolist() == [2, 4]
+    second.save()
+    # Updated rows replace the saved row of their dimensions_id
+    third = Snapshot('sink', path=str(tmp_path))
+    third.diff(rows([(2, 20), (2, 21), (3, 30), (4, 40)]))
+    assert third.changes == {'inserted': 0, 'updated': 1, 'unchanged': 3}
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    '''Ingest saving to a csv sink with cdc'''
+    monkeypatch.setenv('INGESTION_STATE', str(tmp_path / 'state.json'))
+    monkeypatch.setenv('INGESTION_SNAPSHOTS', str(tmp_path / 'snapshots'))
+    monkeypatch.setenv('HTTP_CACHE', str(tmp_path / 'http'))
+    monkeypatch.setenv('RESULT_CACHE', str(tmp_path / 'results'))
+    return BaseIngest({
+        'source': {},
+        'sink': {'type': 'csv', 'name': str(tmp_path / 'sink'), 'mode': 'append', 'cdc': True},
+    })
+
+
+def test_failed_save_leaves_snapshot_untouched(engine, tmp_path, monkeypatch):
+    engine.save(rows([(1, 10)]))
+    snapshot = Snapshot(engine.state_key).path
+    saved = os.path.getmtime(snapshot), open(snapshot, 'rb').read()
+
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+
+    with monkeypatch.context() as m:
+        m.setattr(pd.DataFrame, 'to_csv', fail)
+        with pytest.raises(OSError):
+            engine.save(rows([(1, 11), (2, 20)]))
+    assert (os.path.getmtime(snapshot), open(snapshot, 'rb').read()) == saved
+    # The rows of the failed save are saved again by the next one
+    assert engine.save(rows([(1, 11), (2, 20)])) == 2
+    assert engine.changes == {'inserted': 1, 'updated': 1, 'unchanged': 0}
+    assert pd.read_csv(tmp_path / 'sink.csv')['cases'].tolist() == [10, 11, 20]
@@ -0,0 +1,156 @@
+'''Tests of the vectorized cleaning helpers'''
+
+import re
+import numpy as np
+import pandas as pd
+import pytest
+
+from ingestion import (
+    apply_transforms,
+    clean_label,
+    parse_digits,
+    parse_number,
+    parse_percent,
+    parse_range,
+)
+from sources.vaccinations import TRANSFORMS
+
+# Raw values per cleaned column, with missing values
+RAW = {
+    'age_bracket': ['70-79', '80-', ' 0-9 ', None, np.nan, '70-79'],
+    'gender': ['Male', 'Female*', None, 'Female*', np.nan],
+    'age_group': ['AgeGroup_0-19', 'AgeGroup_70+', None, 'AgeGroup_20-24'],
+    'vax_1_percent_15': ['>95%', '87.5%', 90, np.nan, '>95%'],
+    'population_15': ['1,234', '12,345,678', '>100', np.nan, 567],
+}
+
+
+# Per-row cleaning of the original sources, applied with Series.apply
+
+
+def baseline_age_bracket(x):
+    return tuple(int(d or 0) for d in x['age_bracket'].strip().split('-')) \
+        if not pd.isnull(x['age_bracket']) else None
+
+
+def baseline_sex(x):
+    return x.replace('*', '') if not pd.isnull(x) else 'Unknown'
+
+
+def baseline_age_group(x):
+    return tuple(re.findall(r'\d+', x))
+
+
+def baseline_percent(x):
+    return float(re.sub(r'[>%]', '', str(x)))
+
+
+def baseline_population(df):
+    df['population_15'] = df['population_15'].apply(
+        lambda x: re.sub("[^0-9^.]", "", str(x))
+    )
+    df['population_15'] = df['population_15'].apply(
+        lambda x: float(x) if x else None
+    )
+    return df['population_15']
+
+
+CASES = [
+    (
+        'age_bracket',
+        lambda df: df.apply(baseline_age_bracket, axis=1),
+        lambda df: parse_range(df['age_bracket']),
+    ),
+    (
+        'gender',
+        lambda df: df['gender'].apply(baseline_sex),
+        lambda df: clean_label(df['gender'], remove='*', missing='Unknown'),
+    ),
+    (
+        'vax_1_percent_15',
+        lambda df: df['vax_1_percent_15'].apply(baseline_percent),
+        lambda df: parse_percent(df['vax_1_percent_15']),
+    ),
+    (
+        'population_15',
+        baseline_population,
+        lambda df: parse_number(df['population_15']),
+    ),
+]
+
+
+@pytest.mark.parametrize('col, baseline, vectorized', CASES)
+def test_equal_to_baseline(col, baseline, vectorized):
+    df = pd.DataFrame({col: pd.Series(RAW[col], dtype=object)})
+    pd.testing.assert_series_equal(
+        vectorized(df.copy()),
+        baseline(df.copy()),
+        check_dtype=False,
+        check_names=False,
+    )
+
+
+def test_digits_equal_to_baseline():
+    series = pd.Series(RAW['age_group'], dtype=object)
+    # The baseline failed on missing values, which are now None
+    with pytest.raises(TypeError):
+        series.apply(baseline_age_group)
+    present = series.dropna()
+    assert parse_digits(series)[present.index].tolist() \
+        == present.apply(baseline_age_group).tolist()
+    assert parse_digits(series)[2] is None
+
+
+def test_not_available_is_missing():
+    df = pd.DataFrame({
+        'vax_1_percent_15': ['>95%', 'N/A', '80%'],
+        'vax_2_percent_15': ['90%', '85%', 'N/A'],
+        'population_15': ['1,000', 'N/A', '3,000'],
+    })
+    # The baseline cleaned after df.replace('N/A', None), which on pandas
+    # 1.x pads: N/A took the value of the row above
+    padded = df.replace('N/A', np.nan).ffill()
+    assert padded['vax_1_percent_15'].apply(baseline_percent).tolist() == [95.0, 95.0, 80.0]
+    # N/A is now missing, and so are the doses derived from it
+    steps = TRANSFORMS['covid-19-vaccination-geographic-vaccination-rates-lga'][:3]
+    result = apply_transforms(df, steps)
+    assert result['vax_1_percent_15'].isnull().tolist() == [False, True, False]
+    assert result['vax_2_percent_15'].isnull().tolist() == [False, False, True]
+    assert result['population_15'].isnull().tolist() == [False, True, False]
+    assert result['vax_1_dose_15'].tolist()[::2] == [950.0, 2400.0]
+    assert result['vax_1_dose_15'].isnull().tolist() == [False, True, False]
+
+
+def test_parse_range():
+    result = parse_range(pd.Series(RAW['age_bracket'], dtype=object))
+    assert result.tolist() == [(70, 79), (80, 0), (0, 9), None, None, (70, 79)]
+
+
+def test_parse_digits():
+    result = parse_digits(pd.Series(RAW['age_group'], dtype=object))
+    assert result.tolist() == [('0', '19'), ('70',), None, ('20', '24')]
+
+
+def test_parse_percent():
+    result = parse_percent(pd.Series(RAW['vax_1_percent_15'], dtype=object))
+    assert result.tolist()[:3] == [95.0, 87.5, 90.0]
+    assert np.isnan(result[3])
+
+
+def test_parse_number():
+    result = parse_number(pd.Series([*RAW['population_15'], 'N/A'], dtype=object))
+    assert result.tolist()[:3] == [1234, 12345678, 100]
+    assert np.isnan(result[3]) and np.isnan(result[5])
+    assert result[4] == 567
+
+
+def test_clean_label():
+    series = pd.Series(RAW['gender'], dtype=object)
+    result = clean_label(series, remove='*', missing='Unknown')
+    assert result.tolist() == ['Male', 'Female', 'Unknown', 'Female', 'Unknown']
+
+
+def test_clean_label_of_categoricals():
+    series = pd.Series(RAW['gender'], dtype='category')
+    result = clean_label(series, missing='Unknown')
+    assert result.tolist() == ['Male', 'Female*', 'Unknown', 'Female*', 'Unknown']
@@ -0,0 +1,57 @@
+'''Tests of dimension and row hashing'''
+
+import numpy as np
+import pandas as pd
+
+from ingestion.hashing import hash_dimensions, hash_rows
+
+
+def test_int_and_float_columns_hash_equal():
+    ints = pd.DataFrame({'state_code': ['NSW', 'VIC'], 'age': [80, 45]})
+    floats = pd.DataFrame({'state_code': ['NSW', 'VIC'], 'age': [80.0, 45.0]})
+    assert ints['age'].dtype == 'int64'
+    pd.testing.assert_series_equal(
+        hash_dimensions(ints, ['state_code', 'age']),
+        hash_dimensions(floats, ['state_code', 'age']),
+    )
+    pd.testing.assert_series_equal(hash_rows(ints), hash_rows(floats))
+
+
+def test_ids_do_not_depend_on_missing_values_of_a_chunk():
+    # A chunk with a missing age is float64, one without is int64
+    whole = pd.DataFrame({'age': [80, np.nan, 45]})
+    chunk = pd.DataFrame({'age': [80, 45]}, index=[0, 2])
+    assert hash_dimensions(whole, ['age'])[[0, 2]].tolist() \
+        == hash_dimensions(chunk, ['age']).tolist()
+
+
+def test_categorical_and_string_columns_hash_equal():
+    values = ['New South Wales', 'Victoria', None]
+    objects = pd.DataFrame({'state_name': pd.Series(values, dtype=object)})
+    categories = pd.DataFrame({'state_name': pd.Series(values, dtype='category')})
+    pd.testing.assert_series_equal(
+        hash_dimensions(objects, ['state_name']),
+        hash_dimensions(categories, ['state_name']),
+    )
+
+
+def test_ids_are_stable():
+    df = pd.DataFrame({'date': pd.to_datetime(['2021-01-01']), 'state_code': ['NSW']})
+    ids = hash_dimensions(df, ['date', 'state_code'])
+    assert ids.dtype == 'int64'
+    assert ids.tolist() == hash_dimensions(df.copy(), ['date', 'state_code']).tolist()
+    # Column order of the dataframe does not matter for row hashes
+    pd.testing.assert_series_equal(hash_rows(df), hash_rows(df[['state_code', 'date']]))
+
+
+def test_datetime_units_and_timezones_hash_equal():
+    dates = pd.to_datetime(['2021-08-01 00:00', '2021-08-02 10:30'])
+    ns = pd.DataFrame({'date': dates.astype('datetime64[ns]'), 'state_code': ['NSW', 'VIC']})
+    us = ns.assign(date=ns['date'].astype('datetime64[us]'))
+    utc = ns.assign(date=ns['date'].dt.tz_localize('UTC'))
+    sydney = ns.assign(date=utc['date'].dt.tz_convert('Australia/Sydney'))
+    assert us['date'].dtype != ns['date'].dtype
+    expected = hash_dimensions(ns, ['date', 'state_code'])
+    for df in (us, utc, sydney):
+        pd.testing.assert_series_equal(hash_dimensions(df, ['date', 'state_code']), expected)
+        pd.testing.assert_series_equal(hash_rows(df), hash_rows(ns))
@@ -0,0 +1,121 @@
+'''Tests of the HTTP response cache against a fixture store'''
+
+import json
+import os
+import pytest
+
+from benchmarks import fixtures
+from ingestion import HTTPCache, Transport
+from ingestion.http import _Index
+
+HOST = 'https://www.health.gov.au/'
+MODIFIED = 'Sun, 01 Aug 2021 00:00:00 GMT'
+
+
+class Store():
+    '''Fixture store of static responses, recording the requests served'''
+    def __init__(self, path):
+        self.path = str(path)
+        self.index = {}
+        self.requests = []
+        os.makedirs(os.path.join(self.path, 'responses'))
+
+    def add(self, url, content, etag=None, last_modified=None):
+        name = f'{len(self.index)}.txt'
+        with open(os.path.join(self.path, 'responses', name), 'wb') as f:
+            f.write(content)
+        self.index[url] = {
+            'path': name,
+            'content_type': 'text/plain',
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+        with open(os.path.join(self.path, 'index.json'), 'w') as f:
+            json.dump(self.index, f)
+
+    def cache(self, path, max_bytes=None):
+        '''Cache served by the store'''
+        store = self
+        cache = HTTPCache(
+            path=str(path),
+            max_bytes=max_bytes,
+            transport=Transport(host_rate=0, retries=0),
+        )
+
+        class Adapter(fixtures.ReplayAdapter):
+            def send(self, request, **kwargs):
+                store.requests.append(dict(request.headers))
+                return super().send(request, **kwargs)
+
+        adapter = Adapter(self.path)
+        # Serve the entries added after the cache is made
+        adapter.index = self.index
+        cache.session.mount(HOST, adapter)
+        return cache
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Store(tmp_path / 'store')
+
+
+def test_etag_revalidated(store, tmp_path):
+    url = HOST + 'a'
+    store.add(url, b'first', etag='"1"')
+    cache = store.cache(tmp_path / 'http')
+    assert not cache.get(url).from_cache
+    response = cache.get(url)
+    assert store.requests[-1]['If-None-Match'] == '"1"'
+    assert response.from_cache and response.content == b'first'
+    assert cache.stats['cache_hits'] == 1
+    assert cache.stats['bytes'] == len(b'first')
+    # A changed resource is downloaded again
+    store.add(url, b'second', etag='"2"')
+    response = cache.get(url)
+    assert not response.from_cache and response.content == b'second'
+
+
+def test_last_modified_revalidated(store, tmp_path):
+    url = HOST + 'a'
+    store.add(url, b'first', last_modified=MODIFIED)
+    cache = store.cache(tmp_path / 'http')
+    cache.get(url)
+    response = cache.get(url)
+    assert store.requests[-1]['If-Modified-Since'] == MODIFIED
+    assert 'If-None-Match' not in store.requests[-1]
+    assert response.from_cache and response.content == b'first'
+    store.add(url, b'second', last_modified='Mon, 02 Aug 2021 00:00:00 GMT')
+    response = cache.get(url)
+    assert not response.from_cache and response.content == b'second'
+
+
+def test_least_recently_used_evicted(store, tmp_path):
+    for name in 'abc':
+        store.add(HOST + name, name.encode() * 10, etag=f'"{name}"')
+    cache = store.cache(tmp_path / 'http', max_bytes=20)
+    cache.get(HOST + 'a')
+    cache.get(HOST + 'b')
+    # Revalidating a makes b the least recently used
+    assert cache.get(HOST + 'a').from_cache
+    cache.get(HOST + 'c')
+    cache.get(HOST + 'a')
+    assert cache.get(HOST + 'c').from_cache
+    assert not os.path.exists(cache._body_path(HOST + 'b'))
+    assert not cache.get(HOST + 'b').from_cache
+    assert 'If-None-Match' not in store.requests[-1]
+
+
+def test_indexes_of_processes_merged(tmp_path):
+    # Indexes of two processes sharing a cache directory
+    first, second = _Index(str(tmp_path)), _Index(str(tmp_path))
+    first.set('a', {'size': 1, 'accessed': 1.0})
+    first.set('b', {'size': 2, 'accessed': 1.0})
+    first.write(force=True)
+    second.set('c', {'size': 3, 'accessed': 2.0})
+    second.write(force=True)
+    assert set(_Index(str(tmp_path)).entries) == {'a', 'b', 'c'}
+    first.remove('b')
+    first.write(force=True)
+    index = _Index(str(tmp_path))
+    assert set(index.entries) == {'a', 'c'}
+    assert index.size == 4
@@ -0,0 +1,117 @@
+'''Tests of the stage metrics and their Prometheus textfile'''
+
+import os
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+
+import main
+from ingestion import metrics
+from ingestion.ingest import BaseIngest
+from ingestion.metrics import measure, measure_chunks, source_record, write_prometheus
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''Fake wall and CPU clock of the metrics, advanced by the stages'''
+    clock = SimpleNamespace(now=0.0)
+    now = lambda: clock.now
+    monkeypatch.setattr(metrics, 'time', SimpleNamespace(perf_counter=now, thread_time=now))
+    return clock
+
+
+class Engine():
+    '''Streaming source of 3 chunks, each stage taking a fixed time per chunk'''
+    def __init__(self, clock):
+        self.clock = clock
+
+    def _take(self, seconds, chunk):
+        self.clock.now += seconds
+        return chunk
+
+    def retrieve_chunks(self):
+        for i in range(3):
+            yield self._take(1.0, pd.DataFrame({'cases': range(i + 1)}))
+
+    def process_chunks(self, chunks):
+        for chunk in chunks:
+            yield self._take(2.0, chunk.head(1))
+
+    def validate(self, chunk):
+        return self._take(4.0, chunk)
+
+    def save_chunks(self, chunks, name=None):
+        return sum(len(self._take(0.5, chunk)) for chunk in chunks)
+
+
+def test_streamed_stage_times_not_double_counted(clock):
+    stages = {}
+    main.stream_source(Engine(clock), 'cases', stages)
+    assert {stage: record['wall_seconds'] for stage, record in stages.items()} == {
+        'retrieve': 3.0, 'process': 6.0, 'validate': 12.0, 'save': 1.5,
+    }
+    assert sum(record['cpu_seconds'] for record in stages.values()) == clock.now
+    assert {stage: record['rows_out'] for stage, record in stages.items()} == {
+        'retrieve': 6, 'process': 3, 'validate': 3, 'save': 3,
+    }
+
+
+def test_measured_on_failure(clock):
+    stages = {}
+    with pytest.raises(ValueError):
+        with measure(stages, 'process'):
+            clock.now += 2.0
+            raise ValueError('bad data')
+    assert stages['process']['wall_seconds'] == 2.0
+
+    def failing():
+        clock.now += 1.0
+        yield pd.DataFrame({'cases': [1]})
+        clock.now += 1.0
+        raise ValueError('bad page')
+
+    with pytest.raises(ValueError):
+        list(measure_chunks(failing(), stages, 'retrieve'))
+    assert stages['retrieve'] == {'wall_seconds': 2.0, 'cpu_seconds': 2.0, 'rows_out': 1}
+
+
+def test_prometheus_textfile(tmp_path, clock):
+    stages = {}
+    with measure(stages, 'retrieve') as record:
+        clock.now += 1.5
+        record['rows_out'] = 10
+    http = SimpleNamespace(stats={'requests': 3, 'retries': 1, 'cache_hits': 2, 'bytes': 100})
+    records = [
+        source_record('cases "nsw"', 'nsw_government', stages, http=http,
+                      changes={'inserted': 4, 'updated': 0, 'unchanged': 6}),
+        source_record('deaths', 'covid19data', {}, error=RuntimeError('down')),
+    ]
+    path = tmp_path / 'herd.prom'
+    write_prometheus(str(path), records)
+    assert os.listdir(tmp_path) == ['herd.prom']
+    text = path.read_text()
+    assert text.endswith('\n')
+    lines = text.splitlines()
+    # Every gauge is declared once, followed by its samples
+    for metric, description, _ in [*metrics.SOURCE_GAUGES, *metrics.STAGE_GAUGES]:
+        i = lines.index(f'# HELP {metric} {description}')
+        assert lines[i + 1] == f'# TYPE {metric} gauge'
+    assert 'herd_ingest_success{source="cases \\"nsw\\""} 1.0' in lines
+    assert 'herd_ingest_success{source="deaths"} 0.0' in lines
+    assert 'herd_ingest_http_retries{source="cases \\"nsw\\""} 1.0' in lines
+    # Unknown values are left out
+    assert not any(line.startswith('herd_ingest_http_requests{source="deaths"}') for line in lines)
+    assert 'herd_ingest_stage_wall_seconds{source="cases \\"nsw\\"",stage="retrieve"} 1.5' in lines
+    assert 'herd_ingest_stage_rows_out{source="cases \\"nsw\\"",stage="retrieve"} 10.0' in lines
+    # The rows into the first stage are unknown
+    assert not any(line.startswith('herd_ingest_stage_rows_in') for line in lines if 'retrieve' in line)
+    assert 'herd_ingest_changed_rows{source="cases \\"nsw\\"",change="inserted"} 4.0' in lines
+    samples = [line for line in lines if not line.startswith('#')]
+    assert all(len(line.rsplit(' ', 1)) == 2 for line in samples)
+
+
+def test_save_without_sink(tmp_path, monkeypatch):
+    monkeypatch.setenv('HTTP_CACHE', str(tmp_path / 'http'))
+    monkeypatch.setenv('RESULT_CACHE', str(tmp_path / 'results'))
+    engine = BaseIngest({'source': {}})
+    assert engine.save(pd.DataFrame({'cases': [1]})) == 0
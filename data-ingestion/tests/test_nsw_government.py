@@ -0,0 +1,150 @@
+'''Tests of the NSW datastore retrieval against the fake CKAN datastore'''
+
+import json
+import os
+import sqlite3
+import pandas as pd
+import pytest
+
+from benchmarks import fixtures
+from ingestion import HTTPCache, Transport
+from sources import nsw_government
+
+LOCATION = {
+    'lhd_2010_code': 'X700',
+    'lhd_2010_name': 'Sydney',
+    'lga_code19': '17200',
+    'lga_name19': 'Sydney (C)',
+}
+
+
+@pytest.fixture
+def datastore(tmp_path, monkeypatch):
+    '''Fake CKAN datastore, adding records of a resource by _id and date'''
+    monkeypatch.setenv('INGESTION_STATE', str(tmp_path / 'state.json'))
+    monkeypatch.setenv('HTTP_CACHE', str(tmp_path / 'http'))
+    monkeypatch.setenv('RESULT_CACHE', str(tmp_path / 'results'))
+    # Truncate results below the page size, as CKAN does past its limit
+    monkeypatch.setattr(fixtures, 'ROWS_MAX', 3)
+    path = tmp_path / 'store'
+    os.makedirs(path)
+    with open(path / 'index.json', 'w') as f:
+        json.dump({}, f)
+
+    def add(resource_type, records):
+        db = sqlite3.connect(path / 'datastore.sqlite')
+        pd.DataFrame(records).to_sql(
+            nsw_government.RESOURCES[resource_type],
+            db,
+            index=False,
+            if_exists='append',
+        )
+        db.commit()
+        db.close()
+
+    add.path = str(path)
+    return add
+
+
+def location_tests(ids, date='2021-08-01'):
+    return [
+        {'_id': i, 'test_date': date, 'postcode': '2000', **LOCATION, 'test_count': i}
+        for i in ids
+    ]
+
+
+def location_cases(ids, date):
+    return [{'_id': i, 'notification_date': date, **LOCATION} for i in ids]
+
+
+def engine(datastore, tmp_path, resource_type):
+    '''Ingest of a resource, served by the fake datastore'''
+    ingest = nsw_government.Ingest({
+        'source': {'resource_type': resource_type, 'page_size': 5, 'workers': 2},
+        'sink': {
+            'type': 'csv',
+            'name': str(tmp_path / resource_type),
+            'mode': 'incremental',
+        },
+    })
+    ingest.http = HTTPCache(transport=Transport(host_rate=0))
+    fixtures.mount(ingest.http.session, datastore.path)
+    return ingest
+
+
+def test_every_id_retrieved_once(datastore, tmp_path):
+    # Gaps in the _ids leave pages short or empty
+    ids = [*range(1, 18), *range(30, 33), 50]
+    datastore('tests_by_location', location_tests(ids))
+    df = engine(datastore, tmp_path, 'tests_by_location').retrieve()
+    assert df['_id'].tolist() == ids
+
+
+def test_truncated_pages_continued(datastore, tmp_path, monkeypatch):
+    ids = list(range(1, 12))
+    datastore('tests_by_location', location_tests(ids))
+    queries = []
+    query = nsw_government.Ingest._query
+    monkeypatch.setattr(
+        nsw_government.Ingest,
+        '_query',
+        lambda self, sql: queries.append(sql) or query(self, sql),
+    )
+    df = engine(datastore, tmp_path, 'tests_by_location').retrieve()
+    assert df['_id'].tolist() == ids
+    # Bounds query, and pages of 5 records truncated at 3 continued once
+    assert len(queries) == 1 + 3 + 2
+
+
+def test_streamed_pages_match_retrieve(datastore, tmp_path):
+    ids = [*range(1, 14), 20, 21]
+    datastore('tests_by_location', location_tests(ids))
+    chunks = engine(datastore, tmp_path, 'tests_by_location').retrieve_chunks()
+    assert pd.concat(list(chunks))['_id'].tolist() == ids
+
+
+def test_watermark_resume(datastore, tmp_path):
+    datastore('tests_by_location', location_tests(range(1, 8)))
+    first = engine(datastore, tmp_path, 'tests_by_location')
+    first.save(first.retrieve())
+    datastore('tests_by_location', location_tests(range(8, 12), date='2021-08-02'))
+    df = engine(datastore, tmp_path, 'tests_by_location').retrieve()
+    assert df['_id'].tolist() == list(range(8, 12))
+
+
+def test_rows_sharing_the_last_date_not_skipped(datastore, tmp_path):
+    datastore('cases_by_location', [
+        *location_cases(range(1, 5), '2021-08-01'),
+        *location_cases(range(5, 8), '2021-08-02'),
+    ])
+    first = engine(datastore, tmp_path, 'cases_by_location')
+    first.save(first.retrieve())
+    # New records on the last saved date, and on a new date
+    datastore('cases_by_location', [
+        *location_cases(range(8, 10), '2021-08-02'),
+        *location_cases(range(10, 11), '2021-08-03'),
+    ])
+    second = engine(datastore, tmp_path, 'cases_by_location')
+    df = second.retrieve()
+    # Every record of the dates with new records is counted again
+    assert df['_id'].tolist() == list(range(5, 11))
+    cases = second.process(df).set_index('date')['cases']
+    assert cases.to_dict() == {
+        pd.Timestamp('2021-08-02'): 5,
+        pd.Timestamp('2021-08-03'): 1,
+    }
+
+
+def test_measures_retrieved_into_typed_buffers(datastore, tmp_path):
+    records = location_tests(range(1, 8))
+    records[2]['test_count'] = None
+    datastore('tests_by_location', records)
+    ingest = engine(datastore, tmp_path, 'tests_by_location')
+    df = ingest.retrieve()
+    assert df['test_count'].dtype == 'float64'
+    assert df['test_count'].isna().tolist() == [i == 3 for i in range(1, 8)]
+    # Dates are hashed as retrieved, so stay strings until processed
+    assert df['test_date'].tolist() == ['2021-08-01'] * 7
+    chunk = pd.concat(list(engine(datastore, tmp_path, 'tests_by_location').retrieve_chunks()))
+    assert chunk['test_count'].dtype == 'float64'
+    assert ingest.process(df)['tests'].sum() == sum(range(1, 8)) - 3
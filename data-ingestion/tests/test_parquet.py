@@ -0,0 +1,41 @@
+'''Tests of the partitioned Parquet sink'''
+
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+
+from ingestion.parquet import save_parquet
+
+
+def frame(dates, cases):
+    return pd.DataFrame({
+        'date': pd.to_datetime(dates),
+        'age_group': [(16, 19), (80,), None][:len(dates)],
+        'cases': cases,
+    })
+
+
+def read(path):
+    return pq.read_table(path).to_pydict()
+
+
+def test_replace_and_append(tmp_path):
+    path = str(tmp_path / 'cases')
+    save_parquet(frame(['2021-07-31', '2021-08-01'], [1, 2]), path, partition_by='month')
+    assert sorted(os.listdir(path)) == ['month=2021-07', 'month=2021-08']
+    # Appends add files to the partitions of their dates
+    save_parquet(frame(['2021-08-02'], [3]), path, mode='append', partition_by='month')
+    assert len(os.listdir(os.path.join(path, 'month=2021-08'))) == 2
+    assert sorted(read(path)['cases']) == [1, 2, 3]
+    # Replace rewrites the whole dataset
+    save_parquet(frame(['2021-09-01'], [4]), path, mode='replace', partition_by='month')
+    assert os.listdir(path) == ['month=2021-09']
+    assert read(path)['cases'] == [4]
+
+
+def test_tuple_columns_read_back_as_lists(tmp_path):
+    path = str(tmp_path / 'cases')
+    save_parquet(frame(['2021-08-01'] * 3, [1, 2, 3]), path, partition_by='day')
+    table = read(path)
+    assert table['age_group'] == [[16, 19], [80], None]
+    assert table['day'] == ['2021-08-01'] * 3
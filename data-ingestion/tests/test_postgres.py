@@ -0,0 +1,238 @@
+'''Tests of the PostgreSQL sink, against the database set in POSTGRESQL'''
+
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+import pandas as pd
+import pandera as pa
+import pytest
+import sqlalchemy
+
+from ingestion import postgres
+from ingestion.configuration import dimension_column
+from ingestion.postgres import LATEST_SUFFIX, column_types, migrate_table, save_postgres
+
+DAY1 = datetime(2021, 8, 1)
+DAY2 = datetime(2021, 8, 2)
+
+
+@pytest.fixture
+def engine():
+    uri = os.environ.get('POSTGRESQL')
+    if not uri:
+        pytest.skip('POSTGRESQL not set')
+    engine = sqlalchemy.create_engine(uri)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def table(engine):
+    '''Name of a table dropped after the test, with its latest table'''
+    name = f'test_{uuid.uuid4().hex[:12]}'
+    yield name
+    with engine.begin() as conn:
+        for table in (name, name + LATEST_SUFFIX, f'{name}__staging'):
+            conn.execute(sqlalchemy.text(f'DROP TABLE IF EXISTS "{table}"'))
+
+
+def postcode_frame(rows, saved_date):
+    '''Tests per postcode, with dimensions_id over the location only'''
+    return pd.DataFrame([
+        {'dimensions_id': i, 'postcode': postcode, 'tests': tests, 'saved_date': saved_date}
+        for i, postcode, tests in rows
+    ])
+
+
+def read(engine, name, order='dimensions_id, postcode'):
+    with engine.connect() as conn:
+        return pd.read_sql(f'SELECT * FROM "{name}" ORDER BY {order}', conn)
+
+
+def rows(df, columns=('dimensions_id', 'postcode', 'tests')):
+    return [tuple(r) for r in df[list(columns)].itertuples(index=False)]
+
+
+def test_replace_rebuilds_latest_rows_of_each_id(engine, table):
+    df = pd.concat([
+        postcode_frame([(1, '2000', 1), (1, '2001', 2), (2, '2010', 3)], DAY1),
+        postcode_frame([(1, '2000', 4), (1, '2001', 5)], DAY2),
+    ])
+    save_postgres(df, table, engine, mode='replace')
+    # Every row of the latest saved_date of an id is kept
+    assert rows(read(engine, table + LATEST_SUFFIX)) == [
+        (1, '2000', 4), (1, '2001', 5), (2, '2010', 3),
+    ]
+
+
+def test_append_updates_latest_rows_of_saved_ids(engine, table):
+    save_postgres(
+        postcode_frame([(1, '2000', 1), (1, '2001', 2), (2, '2010', 3)], DAY1),
+        table, engine, mode='replace'
+    )
+    save_postgres(
+        postcode_frame([(1, '2000', 4), (1, '2001', 5)], DAY2),
+        table, engine, mode='append'
+    )
+    assert len(read(engine, table)) == 5
+    assert rows(read(engine, table + LATEST_SUFFIX)) == [
+        (1, '2000', 4), (1, '2001', 5), (2, '2010', 3),
+    ]
+
+
+def test_chunks_sharing_a_saved_date_add_up(engine, table):
+    save_postgres(postcode_frame([(1, '2000', 1)], DAY1), table, engine, mode='replace')
+    save_postgres(postcode_frame([(1, '2000', 2)], DAY2), table, engine, mode='append')
+    save_postgres(postcode_frame([(1, '2001', 3)], DAY2), table, engine, mode='append')
+    assert rows(read(engine, table + LATEST_SUFFIX)) == [(1, '2000', 2), (1, '2001', 3)]
+    # Rows older than the latest are not inserted
+    save_postgres(postcode_frame([(1, '2002', 4)], DAY1), table, engine, mode='append')
+    assert rows(read(engine, table + LATEST_SUFFIX)) == [(1, '2000', 2), (1, '2001', 3)]
+
+
+def test_replace_never_exposes_an_empty_table(engine, table, monkeypatch):
+    save_postgres(postcode_frame([(1, '2000', 1)], DAY1), table, engine, mode='replace')
+    counts = []
+
+    def count():
+        with engine.connect() as conn:
+            counts.append(conn.execute(
+                sqlalchemy.text(f'SELECT COUNT(*) FROM "{table}"')
+            ).scalar())
+
+    # Read the target from other connections while the new table is loaded,
+    # and once it is swapped in, blocking until the swap is committed
+    copy = postgres.copy_dataframe
+    monkeypatch.setattr(
+        postgres,
+        'copy_dataframe',
+        lambda *args: copy(*args) or count(),
+    )
+    reader = threading.Thread(target=count)
+    rebuild = postgres.rebuild_latest
+
+    def rebuild_latest(*args):
+        reader.start()
+        time.sleep(0.2)
+        rebuild(*args)
+
+    monkeypatch.setattr(postgres, 'rebuild_latest', rebuild_latest)
+    df = postcode_frame([(1, '2000', 2), (2, '2010', 3)], DAY2)
+    save_postgres(df, table, engine, mode='replace')
+    reader.join()
+    assert counts == [1, 2]
+    assert rows(read(engine, table)) == [(1, '2000', 2), (2, '2010', 3)]
+
+
+def test_append_adds_rows(engine, table):
+    save_postgres(postcode_frame([(1, '2000', 1)], DAY1), table, engine, mode='replace')
+    save_postgres(postcode_frame([(1, '2000', 2), (2, '2010', 3)], DAY2), table, engine, mode='append')
+    assert rows(read(engine, table, order='saved_date, dimensions_id')) == [
+        (1, '2000', 1), (1, '2000', 2), (2, '2010', 3),
+    ]
+
+
+def test_upsert_overwrites_on_dimensions_id(engine, table):
+    def frame(rows):
+        return pd.DataFrame([
+            {'dimensions_id': i, 'age_group': age_group, 'sex': sex, 'doses': doses}
+            for i, age_group, sex, doses in rows
+        ])
+
+    save_postgres(
+        frame([(1, (16, 19), ('F',), 1), (2, (20, 24), ('M',), 2)]),
+        table, engine, mode='append', upsert=True
+    )
+    save_postgres(
+        frame([(1, (16, 19), ('F', 'M'), 3), (3, (25, 29), ('M',), 4)]),
+        table, engine, mode='append', upsert=True
+    )
+    with engine.connect() as conn:
+        types = postgres._table_columns(conn, table)
+    assert types['age_group'] == 'integer[]'
+    assert types['sex'] == 'text[]'
+    df = read(engine, table, order='dimensions_id')
+    assert rows(df, ('dimensions_id', 'doses')) == [(1, 3), (2, 2), (3, 4)]
+    assert df['age_group'].tolist() == [[16, 19], [20, 24], [25, 29]]
+    assert df['sex'].tolist() == [['F', 'M'], ['M'], ['M']]
+
+
+def test_column_types_of_schema_dtypes():
+    df = pd.DataFrame({
+        'date': pd.to_datetime(['2021-08-01']),
+        'saved_date': pd.to_datetime(['2021-08-02 10:00']),
+        'flag': [True],
+        'small': [1],
+        'count': [1],
+        'nullable': [1.0],
+        'ratio': [0.5],
+        'single': [0.5],
+        'label': ['a'],
+        'state_code': pd.Categorical(['NSW']),
+        'postcode': pd.Categorical([2000]),
+        'age_group': [(16, 19)],
+        'sex': [('F',)],
+        'dimensions_id': [1],
+    })
+    schema = pa.DataFrameSchema({
+        'date': pa.Column(datetime),
+        'saved_date': pa.Column(datetime),
+        'flag': pa.Column(bool),
+        'small': pa.Column('int16'),
+        'count': pa.Column(int),
+        'nullable': pa.Column('Int64'),
+        'ratio': pa.Column(float),
+        'single': pa.Column('float32'),
+        'label': pa.Column(str),
+        'state_code': dimension_column(),
+        'postcode': dimension_column(),
+        'age_group': pa.Column(object),
+        'sex': pa.Column(object),
+        'dimensions_id': pa.Column(int),
+    })
+    assert column_types(df, schema) == {
+        'date': 'date',
+        'saved_date': 'timestamp',
+        'flag': 'boolean',
+        'small': 'smallint',
+        'count': 'bigint',
+        'nullable': 'bigint',
+        'ratio': 'double precision',
+        'single': 'real',
+        'label': 'text',
+        'state_code': 'text',
+        'postcode': 'bigint',
+        'age_group': 'integer[]',
+        'sex': 'text[]',
+        'dimensions_id': 'bigint',
+    }
+
+
+def test_migrate_table_adds_columns(engine, table, caplog):
+    with engine.begin() as conn:
+        assert not migrate_table(conn, table, {'dimensions_id': 'bigint'})
+        postgres.create_table(conn, table, {'dimensions_id': 'bigint', 'tests': 'bigint'})
+        assert migrate_table(conn, table, {
+            'dimensions_id': 'bigint',
+            'tests': 'double precision',
+            'postcode': 'text',
+        })
+        columns = postgres._table_columns(conn, table)
+    # Columns are added, never retyped
+    assert columns == {'dimensions_id': 'bigint', 'tests': 'bigint', 'postcode': 'text'}
+    assert 'Column tests of' in caplog.text
+
+
+def test_upsert_into_a_table_with_duplicate_ids(engine, table, caplog):
+    save_postgres(
+        postcode_frame([(1, '2000', 1), (1, '2001', 2), (2, '2010', 3)], DAY1),
+        table, engine, mode='append'
+    )
+    save_postgres(
+        postcode_frame([(1, '2000', 4)], DAY2),
+        table, engine, mode='append', upsert=True
+    )
+    assert 'duplicate dimensions_id' in caplog.text
+    assert rows(read(engine, table)) == [(1, '2000', 4), (2, '2010', 3)]
@@ -0,0 +1,18 @@
+'''Tests of the result cache keys'''
+
+import pandas as pd
+
+from ingestion.results import result_key, table_hash
+
+
+def _key(**kwargs):
+    return result_key('ingestion.results', {'source': {}}, {'url': 'sha'}, **kwargs)
+
+
+def test_key_changes_with_secondary_tables():
+    lga_lhd_map = pd.DataFrame({'lga_name': ['Albury'], 'lhd_name': ['Murrumbidgee']})
+    refreshed = pd.DataFrame({'lga_name': ['Albury'], 'lhd_name': ['Southern NSW']})
+    key = _key(tables={'lga_lhd_map': table_hash(lga_lhd_map)})
+    assert key == _key(tables={'lga_lhd_map': table_hash(lga_lhd_map.copy())})
+    assert key != _key(tables={'lga_lhd_map': table_hash(refreshed)})
+    assert key != _key()
@@ -0,0 +1,116 @@
+'''Tests of the daemon scheduler, on a fake clock'''
+
+import os
+import signal
+import threading
+from types import SimpleNamespace
+import pytest
+
+from ingestion import scheduler as scheduler_module
+from ingestion.scheduler import Job, Scheduler, parse_interval
+
+
+@pytest.fixture
+def run(monkeypatch):
+    '''Run a scheduler on a fake clock until a time, waiting on the clock
+    advances it instead of sleeping.
+
+    Args:
+        scheduler (Scheduler): Scheduler to run.
+        until (float): Seconds after which the scheduler is stopped.
+    kwargs:
+        events (dict): Functions called when the clock passes a time.
+        settle (bool): Let running jobs finish before advancing the clock.
+    Returns the clock, also in run.clock.
+    '''
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(scheduler_module, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    handlers = {s: signal.getsignal(s) for s in (signal.SIGINT, signal.SIGTERM)}
+
+    def run(scheduler, until, events=None, settle=True):
+        def wait(timeout):
+            if settle:
+                for job in scheduler.jobs:
+                    if job.future is not None:
+                        job.future.exception()
+            for at, event in (events or {}).items():
+                if clock.now < at <= clock.now + timeout:
+                    event()
+            clock.now += timeout
+            if clock.now >= until:
+                scheduler.stop()
+            return scheduler.stopping.is_set()
+
+        monkeypatch.setattr(scheduler.stopping, 'wait', wait)
+        scheduler.run()
+        return clock
+
+    run.clock = clock
+    yield run
+    for s, handler in handlers.items():
+        signal.signal(s, handler)
+
+
+def test_parse_interval():
+    assert parse_interval(90) == 90.0
+    assert parse_interval('30s') == 30.0
+    assert parse_interval(' 15m ') == 900.0
+    assert parse_interval('1.5h') == 5400.0
+    assert parse_interval('1d') == 86400.0
+
+
+@pytest.mark.parametrize('value', ['', 'm', '-5m', '15 minutes', '1w', '1.5.2h'])
+def test_parse_interval_errors(value):
+    with pytest.raises(ValueError, match='Invalid interval'):
+        parse_interval(value)
+
+
+def test_starts_jittered_within_bounds(run):
+    starts = []
+    job = Job('source', 100.0, lambda: starts.append(run.clock.now))
+    run(Scheduler([job], jitter=0.1), until=2000)
+    assert 0 <= starts[0] <= 10
+    gaps = [b - a for a, b in zip(starts, starts[1:])]
+    assert len(gaps) >= 17
+    assert all(90 <= gap <= 110 for gap in gaps)
+    assert len(set(gaps)) > 1
+
+
+def test_running_job_skipped(run, caplog):
+    release = threading.Event()
+    starts = []
+
+    def slow():
+        starts.append(1)
+        release.wait()
+
+    scheduler = Scheduler([Job('slow', 10.0, slow)], jitter=0)
+    run(scheduler, until=35, events={35: release.set}, settle=False)
+    # Due at 0, 10, 20 and 30, but still running from 0
+    assert len(starts) == 1
+    assert caplog.text.count('slow is still running, skipping this run.') == 3
+
+
+def test_sigterm_finishes_running_jobs(run):
+    release = threading.Event()
+    done = []
+
+    def slow():
+        release.wait()
+        return 'saved'
+
+    def sigterm():
+        os.kill(os.getpid(), signal.SIGTERM)
+        # Finished after the scheduler stops starting runs
+        threading.Timer(0.1, release.set).start()
+
+    scheduler = Scheduler(
+        [Job('slow', 10.0, slow)],
+        jitter=0,
+        on_done=lambda job, result: done.append(result),
+    )
+    clock = run(scheduler, until=1000, events={5: sigterm}, settle=False)
+    # No run was started after the signal, the running one was finished
+    assert clock.now < 10
+    assert release.is_set()
+    assert done == ['saved']
@@ -0,0 +1,50 @@
+'''Tests of the declarative transforms'''
+
+import pandas as pd
+
+from ingestion.transform import _fuse, apply_transforms
+
+
+def test_steps_reading_an_earlier_column_not_fused():
+    df = pd.DataFrame({'x': [1, 2]})
+    result = apply_transforms(df, [
+        {'derive': {'y': 'x*2'}},
+        {'derive': {'y': 'y+1'}},
+        {'derive': {'z': 'y*10'}},
+    ])
+    assert result['y'].tolist() == [3, 5]
+    assert result['z'].tolist() == [30, 50]
+
+
+def test_independent_steps_fused():
+    steps = [
+        {'derive': {'y': 'x*2'}},
+        {'derive': {'z': 'x+1'}},
+        {'constant': {'a': 1}},
+        {'constant': {'b': 2}},
+        {'map': {'c': ('x', {1: 'one'})}},
+        {'map': {'d': ('c', {'one': 1})}},
+    ]
+    assert [kind for kind, _ in _fuse(steps)] == ['derive', 'constant', 'map', 'map']
+
+
+def test_steps_redefining_a_column_not_fused():
+    df = pd.DataFrame({'x': [1, 2]})
+    result = apply_transforms(df, [
+        {'constant': {'a': 1}},
+        {'constant': {'a': 2}},
+        {'map': {'b': ('x', {1: 'one', 2: 'two'})}},
+        {'map': {'b': ('x', {1: 'uno', 2: 'dos'})}},
+    ])
+    assert result['a'].tolist() == [2, 2]
+    assert result['b'].tolist() == ['uno', 'dos']
+
+
+def test_function_steps_not_fused():
+    steps = [
+        {'derive': {'y': 'x*2'}},
+        {'derive': {'z': lambda df: df['y'] + 1}},
+    ]
+    assert len(_fuse(steps)) == 2
+    result = apply_transforms(pd.DataFrame({'x': [1]}), steps)
+    assert result['z'].tolist() == [3]
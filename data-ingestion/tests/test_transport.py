@@ -0,0 +1,100 @@
+'''Tests of the shared transport retries'''
+
+import pytest
+import requests
+
+from ingestion import Transport
+from ingestion import transport as transport_module
+
+URL = 'https://data.nsw.gov.au/data'
+
+
+class StubAdapter(requests.adapters.BaseAdapter):
+    '''Adapter answering requests with a sequence of statuses, or raising
+    the errors in it
+    '''
+    def __init__(self, answers):
+        super().__init__()
+        self.answers = list(answers)
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        self.sent += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        status, headers = answer if isinstance(answer, tuple) else (answer, {})
+        response = requests.Response()
+        response.status_code = status
+        response._content = b'ok'
+        response.headers.update(headers)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    '''Seconds slept, with backoffs at their maximum rather than random'''
+    sleeps = []
+    monkeypatch.setattr(transport_module.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(transport_module.random, 'uniform', lambda a, b: b)
+    return sleeps
+
+
+def stub(answers, **kwargs):
+    transport = Transport(backoff=0.5, **kwargs)
+    adapter = StubAdapter(answers)
+    transport.session.mount('https://', adapter)
+    return transport, adapter
+
+
+def test_retry_after_honoured(sleeps):
+    transport, adapter = stub([(429, {'Retry-After': '7'}), 200])
+    response = transport.get(URL)
+    assert response.status_code == 200
+    assert response.retries == 1 and adapter.sent == 2
+    assert sleeps == [7.0]
+    assert transport.stats['retries'] == 1
+
+
+def test_retry_after_capped(sleeps):
+    transport, _ = stub([(503, {'Retry-After': '3600'}), 200], max_backoff=30.0)
+    transport.get(URL)
+    assert sleeps == [30.0]
+
+
+def test_backoff_doubled(sleeps):
+    transport, adapter = stub([503, requests.ConnectionError(), 503, 200])
+    response = transport.get(URL)
+    assert response.status_code == 200
+    assert response.retries == 3 and adapter.sent == 4
+    assert sleeps == [0.5, 1.0, 2.0]
+
+
+def test_retries_exhausted(sleeps):
+    transport, adapter = stub([503] * 3, retries=2)
+    response = transport.get(URL)
+    assert response.status_code == 503 and response.retries == 2
+    assert adapter.sent == 3
+    assert transport.stats == {'requests': 3, 'retries': 2, 'errors': 1, 'bytes': 6}
+    transport, _ = stub([requests.Timeout()] * 2, retries=1)
+    with pytest.raises(requests.Timeout):
+        transport.get(URL)
+
+
+def test_client_errors_not_retried(sleeps):
+    transport, adapter = stub([404])
+    assert transport.get(URL).status_code == 404
+    assert adapter.sent == 1 and sleeps == []
+
+
+def test_no_rate_limit_by_default(monkeypatch, sleeps):
+    monkeypatch.delenv('HTTP_HOST_RATE', raising=False)
+    transport, _ = stub([200] * 20)
+    for _ in range(20):
+        transport.get(URL)
+    assert sleeps == []
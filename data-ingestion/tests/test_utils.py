@@ -0,0 +1,40 @@
+'''Tests of the LGA to LHD map loading'''
+
+from types import SimpleNamespace
+import pytest
+
+from sources import utils
+
+
+@pytest.fixture
+def clock(tmp_path, monkeypatch):
+    '''Fake clock of the map loading, with an empty on-disk cache'''
+    clock = SimpleNamespace(now=1e9)
+    monkeypatch.setattr(utils, 'time', SimpleNamespace(time=lambda: clock.now))
+    monkeypatch.setattr(utils, 'LGA_LHD_CACHE', str(tmp_path / 'lga_lhd_map.csv'))
+    monkeypatch.setattr(utils, '_lga_lhd_map', None)
+    monkeypatch.setattr(utils, '_lga_lhd_expires', 0.0)
+    return clock
+
+
+def test_failed_retrieve_retried_soon(clock, monkeypatch):
+    attempts = []
+
+    def retrieve():
+        attempts.append(clock.now)
+        if len(attempts) == 1:
+            raise ConnectionError('unavailable')
+        return utils._read_lga_lhd_map(utils.LGA_LHD_BUNDLED).head(3)
+
+    monkeypatch.setattr(utils, 'retrieve_lga_lhd_map', retrieve)
+    # The bundled snapshot is used until the retry
+    bundled = utils.get_lga_lhd_map()
+    assert len(bundled) > 3
+    clock.now += utils.LGA_LHD_RETRY.total_seconds() - 1
+    assert utils.get_lga_lhd_map() is bundled
+    clock.now += 1
+    assert len(utils.get_lga_lhd_map()) == 3
+    # A retrieved map is kept for the TTL
+    clock.now += utils.LGA_LHD_TTL.total_seconds() - 1
+    utils.get_lga_lhd_map()
+    assert len(attempts) == 2
@@ -0,0 +1,110 @@
+'''Tests of the vaccination data reshape'''
+
+from copy import deepcopy
+import numpy as np
+import pandas as pd
+
+from sources import vaccinations
+from sources.utils import STATE_CODES, STATE_NAMES
+
+COLLECTION = 'covid-19-vaccination-vaccination-data'
+
+
+def wide_report(n_dates, seed=0):
+    '''Wide vaccination data with one row per report date'''
+    rng = np.random.default_rng(seed)
+    columns = []
+    for state in STATE_CODES.values():
+        columns += [
+            vaccinations.STATE_COLUMN.format(state=state, measure=measure)
+            for measure in vaccinations.STATE_MEASURES
+        ]
+    for age_group in vaccinations.AGE_GROUPS:
+        for sex in ['M', 'F']:
+            columns += [
+                vaccinations.AGE_COLUMN.format(
+                    age_group=age_group, sex=sex, measure=measure
+                )
+                for measure in vaccinations.AGE_MEASURES
+            ]
+    df = pd.DataFrame(
+        rng.integers(1000, 1000000, size=(n_dates, len(columns))).astype(float),
+        columns=columns,
+    )
+    df['date'] = pd.date_range('2021-01-01', periods=n_dates)
+    return df
+
+
+def legacy_reshape(df):
+    '''Previous record-by-record implementation'''
+    state_docs = []
+    demo_docs = []
+    for doc in df.to_dict('records'):
+        for state in STATE_CODES.values():
+            _doc = {}
+            _doc['date'] = doc['date']
+            _doc['state_name'] = STATE_NAMES[state]
+            _doc['state_code'] = state
+            _doc['country'] = 'Australia'
+            population = doc[f'{state} - Population 16 and over']
+            vax_1_dose = doc[f'{state} - Residence state - Number of people 16 and over with 1 dose']
+            vax_2_dose = doc[f'{state} - Residence state - Number of people 16 and over fully vaccinated']
+            _doc['vax_1_dose'] = vax_1_dose
+            _doc['vax_2_dose'] = vax_2_dose
+            _doc['vax_1_percent'] = vax_1_dose/population
+            _doc['vax_2_percent'] = vax_2_dose/population
+            _doc['population'] = population
+            state_docs.append(_doc)
+        for age_group in vaccinations.AGE_GROUPS:
+            _doc = {}
+            _doc['date'] = doc['date']
+            _doc['country'] = 'Australia'
+            _doc['age_group'] = tuple(
+                int(k) for k in age_group.replace('+', '').strip().split('-')
+            )
+            for sex in ['M', 'F']:
+                __doc = deepcopy(_doc)
+                population = doc[f'Age group - {age_group} - {sex} - Population']
+                vax_1_dose = doc[f'Age group - {age_group} - {sex} - Number of people with 1 dose']
+                vax_2_dose = doc[f'Age group - {age_group} - {sex} - Number of people fully vaccinated']
+                __doc['sex'] = 'Female' if sex == 'F' else 'Male'
+                __doc['vax_1_dose'] = vax_1_dose
+                __doc['vax_2_dose'] = vax_2_dose
+                __doc['vax_1_percent'] = vax_1_dose/population
+                __doc['vax_2_percent'] = vax_2_dose/population
+                __doc['population'] = population
+                demo_docs.append(__doc)
+    return pd.DataFrame(state_docs), pd.DataFrame(demo_docs)
+
+
+def test_reshape_equal_to_previous_implementation():
+    df = wide_report(3)
+    expected = legacy_reshape(df)
+    actual = vaccinations.reshape_vaccination_data(df)
+    for _expected, _actual in zip(expected, actual):
+        pd.testing.assert_frame_equal(_expected, _actual)
+
+
+def test_processed_output_equal_to_previous_implementation(monkeypatch):
+    engine = vaccinations.Ingest({'source': {'collection': COLLECTION}})
+    df = wide_report(3)
+    actual = engine.process(df)
+    monkeypatch.setattr(vaccinations, 'reshape_vaccination_data', legacy_reshape)
+    pd.testing.assert_frame_equal(engine.process(df), actual)
+
+
+def test_streamed_batches_equal_to_batch():
+    engine = vaccinations.Ingest({'source': {'collection': COLLECTION, 'chunk_rows': 2}})
+    df = wide_report(7)
+    reports = [df.iloc[[i]] for i in range(len(df))]
+    chunks = list(engine.process_chunks(reports))
+    # Batches of 2 reports, and the last report
+    assert [chunk['date'].nunique() for chunk in chunks] == [2, 2, 2, 1]
+    def ordered(df):
+        return df.sort_values(['date', 'dimensions_id']).reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(
+        ordered(pd.concat(chunks)),
+        ordered(engine.process(df)),
+        check_categorical=False,
+    )
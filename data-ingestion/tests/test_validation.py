@@ -0,0 +1,66 @@
+'''Tests of the validation modes'''
+
+import pandas as pd
+import pandera as pa
+import pytest
+from marshmallow import ValidationError
+
+from ingestion import validation
+from ingestion.configuration import IngestSchema
+from ingestion.validation import validate
+
+SCHEMA = pa.DataFrameSchema({
+    'cases': pa.Column(int, pa.Check.ge(0), coerce=True),
+})
+
+
+def cases(bad):
+    '''Case counts of 100 rows, negative in the given rows'''
+    df = pd.DataFrame({'cases': [str(i) for i in range(100)]})
+    df.loc[bad, 'cases'] = '-1'
+    return df
+
+
+def outside_sample(n):
+    '''A row left out of a sample of n rows'''
+    sampled = cases([]).sample(n, random_state=0).index
+    return next(i for i in range(100) if i not in sampled)
+
+
+def test_full_checks_every_row():
+    with pytest.raises(pa.errors.SchemaError):
+        validate(cases([99]), SCHEMA, mode='full')
+
+
+def test_sample_checks_sampled_rows():
+    bad = outside_sample(10)
+    df, timings = validate(cases([bad]), SCHEMA, mode='sample:10')
+    # Coerced in full, even where not checked
+    assert df['cases'].dtype == 'int64' and df['cases'][bad] == -1
+    assert set(timings) == {'coerce', 'cases'}
+    with pytest.raises(pa.errors.SchemaError):
+        validate(cases([bad]), SCHEMA, mode='full')
+    # Samples larger than the data check every row
+    with pytest.raises(pa.errors.SchemaError):
+        validate(cases([bad]), SCHEMA, mode='sample:1000')
+
+
+def test_head_checks_first_rows(monkeypatch):
+    monkeypatch.setattr(validation, 'HEAD_ROWS', 10)
+    validate(cases([10]), SCHEMA, mode='head')
+    with pytest.raises(pa.errors.SchemaError):
+        validate(cases([9]), SCHEMA, mode='head')
+
+
+def test_off_only_coerces():
+    df, timings = validate(cases(list(range(100))), SCHEMA, mode='off')
+    assert df['cases'].dtype == 'int64'
+    assert list(timings) == ['coerce']
+
+
+@pytest.mark.parametrize('mode', ['sample', 'sample:', 'sample:ten', 'head:10', 'Full', ''])
+def test_invalid_modes(mode):
+    with pytest.raises(ValueError, match='Invalid validation mode'):
+        validate(cases([]), SCHEMA, mode=mode)
+    with pytest.raises(ValidationError):
+        IngestSchema().load({'source': {}, 'validation': mode})
@@ -1,6 +1,6 @@
 . venv/bin/activate
 git pull
-python ingestion/sink.py
-f="data_update_$(date +"%d%m%y%H%M%S")"
-git commit ingestion/data -m f
-git push
+# After each source saved data, commit only the finished source's file, then
+# rebase on the remote (stashing files other sources are still writing) and push
+exec python main.py --config configs/csv_config.yml --daemon --interval 6h \
+    --post-run 'f="${HERD_SOURCE%.csv}.csv" && git add "$f" && git commit "$f" -m "data_update_$(date +"%d%m%y%H%M%S")" && git pull --rebase --autostash && git push'